@@ -0,0 +1,2 @@
+# Benchmarks for the bot. These are not part of the test suite; run them by hand, e.g.
+#   python -m benchmarks.tty_throughput
@@ -0,0 +1,340 @@
+"""Drives the bot with simulated nodes and a fake Discord, and reports MQTT->edit latency, edit rate and CPU/RSS.
+
+The simulated nodes speak the same topics as the node server. By default they talk to the bot through an
+in-process stand-in for the broker; pass --broker to go through a real one (e.g. a local mosquitto) instead."""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import re
+import resource
+import sys
+import time
+
+import aiomqtt
+
+from gridbot.admission import admission_queue
+from gridbot.config import Config
+from gridbot.entity import UserPrefs, job_table, node_table
+from gridbot.gridbot import bot
+
+
+## broker stand-in ##
+
+class InProcessBroker:
+    """Routes published messages to every client with a matching subscription"""
+
+    def __init__(self):
+        self.clients: list["BrokerClient"] = []
+        self.mids = itertools.count(1)
+
+    def client(self) -> "BrokerClient":
+        client = BrokerClient(self)
+        self.clients.append(client)
+        return client
+
+    def route(self, topic: str, payload: bytes):
+        matched = aiomqtt.Topic(topic)
+        for client in self.clients:
+            if any(matched.matches(pattern) for pattern in client.subscriptions):
+                client.queue.put_nowait(aiomqtt.Message(topic, payload, 2, False, next(self.mids), None))
+
+
+class BrokerClient:
+    """The parts of aiomqtt.Client that the bot and the simulated nodes use"""
+
+    def __init__(self, broker: InProcessBroker):
+        self.broker = broker
+        self.subscriptions: list[str] = []
+        self.queue: asyncio.Queue[aiomqtt.Message] = asyncio.Queue()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.broker.clients.remove(self)
+
+    async def subscribe(self, topic: str, qos: int = 0):
+        self.subscriptions.append(topic)
+
+    async def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False):
+        if payload is None:
+            payload = b""
+        elif isinstance(payload, str):
+            payload = payload.encode()
+        elif not isinstance(payload, (bytes, bytearray)):
+            payload = str(payload).encode()
+        self.broker.route(topic, bytes(payload))
+
+    @property
+    async def messages(self):
+        while True:
+            yield await self.queue.get()
+
+
+## simulated node ##
+
+class SimulatedNode:
+    """Acts like a node server whose jobs print a numbered line every `interval` seconds"""
+
+    def __init__(self, name: str, client, stats: "LoadStats", capacity: int = 4, lines: int = 100,
+                 interval: float = 0.1, line_bytes: int = 60, start_delay: float = 0.05):
+        self.name = name
+        self.client = client
+        self.stats = stats
+        self.capacity = capacity
+        self.lines = lines
+        self.interval = interval
+        self.line_bytes = line_bytes
+        self.start_delay = start_delay
+        self.jobs: dict[int, asyncio.Task] = {}
+
+    async def run(self):
+        await self.client.subscribe(f"{self.name}/#", qos=2)
+        await self.client.subscribe("grid/#", qos=2)
+        await self.announce()
+        async for msg in self.client.messages:
+            await self.on_message(str(msg.topic).split('/'), msg.payload)
+
+    async def announce(self):
+        message = {"node": self.name, "version": "loadgen", "capacity": self.capacity}
+        await self.client.publish("node/connect", json.dumps(message), qos=2)
+
+    async def on_message(self, topic_path: list[str], payload: bytes):
+        match topic_path:
+            case ["grid", "ping"]:
+                await self.announce()
+            case ["grid", "roll_call"]:
+                message = {"node": self.name, "jobs": list(self.jobs)}
+                await self.client.publish("node/roll_call", json.dumps(message), qos=2)
+            case [_, "submit", jid]:
+                jid = int(jid)
+                if len(self.jobs) >= self.capacity:
+                    await self.client.publish(f"job/{jid}/reject", "too many jobs", qos=2)
+                    return
+                script = json.loads(payload)["script"]
+                self.jobs[jid] = asyncio.get_running_loop().create_task(self.run_job(jid, script))
+            case [_, "signal", jid, signal_num]:
+                task = self.jobs.get(int(jid))
+                if task is not None:
+                    task.cancel()
+                    await self.client.publish(f"job/{jid}/stopped", signal_num, qos=2)
+
+    async def run_job(self, jid: int, script: str):
+        try:
+            await asyncio.sleep(self.start_delay)
+            await self.client.publish(f"job/{jid}/startup", qos=2)
+            for seq in range(self.lines):
+                line = f"job {jid} line {seq:06d} "
+                line = line + "x" * max(self.line_bytes - len(line) - 2, 0) + "\r\n"
+                self.stats.published(jid, seq)
+                await self.client.publish(f"job/{jid}/stdout", line, qos=2)
+                await asyncio.sleep(self.interval)
+            await self.client.publish(f"job/{jid}/stopped", "0", qos=2)
+            self.stats.jobs_finished += 1
+        finally:
+            del self.jobs[jid]
+
+
+## fake Discord ##
+
+MARKER = re.compile(r"job (\d+) line (\d+)")
+
+
+class LoadStats:
+    """Matches output lines published by the nodes to the first edit that shows them"""
+
+    def __init__(self):
+        self.publish_times: dict[int, list[float]] = {}
+        self.shown: dict[int, int] = {}
+        self.latencies: list[float] = []
+        self.edits = 0
+        self.jobs_finished = 0
+        self.jobs_refused = 0
+        self.elapsed = 0.0
+
+    def published(self, jid: int, seq: int):
+        self.publish_times.setdefault(jid, []).append(time.perf_counter())
+
+    def edited(self, content: str):
+        now = time.perf_counter()
+        self.edits += 1
+        if content.startswith((":x:", "**Could not start job")):
+            self.jobs_refused += 1
+            return
+        newest: dict[int, int] = {}
+        for match in MARKER.finditer(content):
+            jid, seq = int(match[1]), int(match[2])
+            newest[jid] = max(newest.get(jid, -1), seq)
+        for jid, seq in newest.items():
+            # edits show the latest output, so every line up to the newest one shown is now visible
+            times = self.publish_times.get(jid, ())
+            first = self.shown.get(jid, -1) + 1
+            for sent in times[first:seq + 1]:
+                self.latencies.append(now - sent)
+            self.shown[jid] = max(self.shown.get(jid, -1), seq)
+
+    def unshown(self) -> int:
+        """Lines that were published but never appeared in an edit"""
+        return sum(len(times) - self.shown.get(jid, -1) - 1 for jid, times in self.publish_times.items())
+
+
+class FakeMessage:
+    """A Discord message whose edits take `latency` seconds, like a round trip to the API"""
+    ids = itertools.count(1)
+
+    def __init__(self, stats: LoadStats, latency: float, author=None):
+        self.id = next(self.ids)
+        self.stats = stats
+        self.latency = latency
+        self.author = author
+        self.content = ""
+        self.jump_url = f"https://discord.invalid/{self.id}"
+
+    async def edit(self, content: str = "", **kwargs):
+        await asyncio.sleep(self.latency)
+        self.content = content
+        self.stats.edited(content)
+        return self
+
+    async def reply(self, content: str = "", **kwargs):
+        await asyncio.sleep(self.latency)
+        return FakeMessage(self.stats, self.latency)
+
+    async def add_files(self, *files):
+        await asyncio.sleep(self.latency)
+        return self
+
+
+class FakeAuthor:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+        self.bot = False
+
+
+class FakeContext:
+    """Just enough of a command context for GridMiiBot.submit_job"""
+
+    def __init__(self, stats: LoadStats, latency: float, user_id: int):
+        self.author = FakeAuthor(user_id)
+        self.message = FakeMessage(stats, latency, self.author)
+
+    async def send(self, content: str = "", **kwargs):
+        return await self.message.reply(content)
+
+    async def reply(self, content: str = "", **kwargs):
+        return await self.message.reply(content)
+
+
+## driver ##
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+@contextlib.asynccontextmanager
+async def connect(broker: InProcessBroker|None, address: str|None):
+    if broker is not None:
+        async with broker.client() as client:
+            yield client
+    else:
+        host, _, port = address.partition(":")
+        async with aiomqtt.Client(host, int(port or 1883)) as client:
+            yield client
+
+async def bot_mqtt_loop(client):
+    """The message loop from GridMiiBot.do_mqtt_task, minus the connection handling"""
+    for topic in ("job/#", "node/#"):
+        await client.subscribe(topic, qos=2)
+    async for msg in client.messages:
+        bot.dispatcher.dispatch(msg)
+
+async def run(args) -> LoadStats:
+    stats = LoadStats()
+    broker = InProcessBroker() if args.broker is None else None
+    loop = asyncio.get_running_loop()
+    bot.loop = loop
+    async with contextlib.AsyncExitStack() as stack:
+        bot.mq_client = await stack.enter_async_context(connect(broker, args.broker))
+        tasks = [loop.create_task(bot_mqtt_loop(bot.mq_client))]
+        for n in range(args.nodes):
+            client = await stack.enter_async_context(connect(broker, args.broker))
+            node = SimulatedNode(f"load{n}", client, stats, args.capacity, args.lines, args.interval,
+                                 args.line_bytes, args.start_delay)
+            tasks.append(loop.create_task(node.run()))
+        # wait for every node's connect message to be handled
+        while sum(1 for _ in node_table) < args.nodes:
+            await asyncio.sleep(0.01)
+
+        contexts = []
+        for user_id in range(1, args.jobs + 1):
+            ctx = FakeContext(stats, args.edit_latency, user_id)
+            if not args.pipe:
+                UserPrefs.get_prefs(ctx.author).tty = ("xterm", args.columns, args.rows)
+            contexts.append(ctx)
+        start = time.perf_counter()
+        await asyncio.gather(*(bot.submit_job(ctx, args.command) for ctx in contexts))
+        while (stats.jobs_finished + stats.jobs_refused < args.jobs or admission_queue
+               or any(True for _ in job_table)):
+            await asyncio.sleep(0.05)
+        stats.elapsed = time.perf_counter() - start
+
+        for task in tasks:
+            task.cancel()
+        bot.dispatcher.close()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=100, help="jobs to submit at once")
+    parser.add_argument("--nodes", type=int, default=25)
+    parser.add_argument("--capacity", type=int, default=4, help="jobs each node will run at a time")
+    parser.add_argument("--lines", type=int, default=100, help="lines of output per job")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between lines")
+    parser.add_argument("--line-bytes", type=int, default=60)
+    parser.add_argument("--start-delay", type=float, default=0.05, help="seconds a node takes to start a job")
+    parser.add_argument("--pipe", action="store_true", help="run jobs without a tty")
+    parser.add_argument("--columns", type=int, default=80)
+    parser.add_argument("--rows", type=int, default=24)
+    parser.add_argument("--edit-latency", type=float, default=0.05, help="seconds each Discord API call takes")
+    # The default edit budget is generous so the run measures the bot rather than the budget.
+    # Pass --edit-rate 1 --edit-burst 5 to see what users get with the shipped settings.
+    parser.add_argument("--edit-window", type=float, default=Config.EDIT_WINDOW_SEC)
+    parser.add_argument("--edit-rate", type=float, default=100.0, help="edits per second across all messages")
+    parser.add_argument("--edit-burst", type=int, default=100)
+    parser.add_argument("--broker", metavar="HOST[:PORT]", help="use a real MQTT broker instead of the stand-in")
+    parser.add_argument("--command", default="chatty")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    # the edit scheduler reads these when it makes its token bucket
+    Config.EDIT_WINDOW_SEC = args.edit_window
+    Config.EDIT_RATE = args.edit_rate
+    Config.EDIT_BURST = args.edit_burst
+    Config.QUEUE_LIMIT = max(Config.QUEUE_LIMIT, args.jobs)
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    stats = asyncio.run(run(args))
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = after.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    mode = "pipe" if args.pipe else f"tty {args.columns}x{args.rows}"
+    print(f"{args.jobs} {mode} jobs on {args.nodes} nodes, {args.lines} lines every {args.interval} s each")
+    print(f"edit budget: {args.edit_rate}/s, burst {args.edit_burst}, window {args.edit_window} s; "
+          f"API latency {args.edit_latency * 1000:.0f} ms")
+    print(f"  finished {stats.jobs_finished}, refused {stats.jobs_refused}, in {stats.elapsed:.1f} s")
+    print(f"  edits:            {stats.edits} ({stats.edits / stats.elapsed:.1f}/s)")
+    if stats.latencies:
+        print(f"  MQTT->edit (s):   p50 {percentile(stats.latencies, 50):.3f}  p90 {percentile(stats.latencies, 90):.3f}"
+              f"  p99 {percentile(stats.latencies, 99):.3f}  max {max(stats.latencies):.3f}")
+    print(f"  lines never shown: {stats.unshown()} of {sum(map(len, stats.publish_times.values()))}")
+    print(f"  CPU:              {cpu:.2f} s ({cpu / stats.elapsed * 100:.0f}% of one core, simulated nodes included)")
+    print(f"  max RSS:          {rss:.1f} MiB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Measures how long the event loop stalls while relay URLs are created, calling the object store directly
+(as the bot used to) and through AsyncObjectStore's thread pool. The filesystem store's latency stands in for the
+round trip to the cloud."""
+import argparse
+import asyncio
+import datetime
+import tempfile
+import time
+
+from gridbot.object_store import AsyncObjectStore, FilesystemObjectStore
+
+
+async def watch_loop(stalls: list[float], period: float = 0.005):
+    """Record how late each wakeup is"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(period)
+        stalls.append(time.perf_counter() - start - period)
+
+async def run(store: FilesystemObjectStore, requests: int, threaded: bool, workers: int) -> tuple[float, float]:
+    expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+    stalls = []
+    watcher = asyncio.create_task(watch_loop(stalls))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    if threaded:
+        async_store = AsyncObjectStore(store, max_workers=workers, timeout=60)
+        await asyncio.gather(*(async_store.create_par(f"obj{i}", expires) for i in range(requests)))
+        async_store.close()
+    else:
+        for i in range(requests):
+            store.create_par(f"obj{i}", expires)
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    return elapsed, max(stalls, default=0.0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20, help="relay URLs to create at once")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds each object store call takes")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        store = FilesystemObjectStore(root, latency=args.latency)
+        print(f"{args.requests} relay URLs, {args.latency * 1000:.0f} ms per call")
+        for label, threaded in (("on the event loop", False), (f"{args.workers} threads", True)):
+            elapsed, worst = asyncio.run(run(store, args.requests, threaded, args.workers))
+            print(f"  {label:18}: {elapsed:6.2f} s total, longest event loop stall {worst * 1000:7.1f} ms")
+
+if __name__ == '__main__':
+    main()
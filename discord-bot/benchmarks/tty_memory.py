@@ -0,0 +1,68 @@
+"""Compares the memory used by TtyModel's array planes against the old list-of-lists planes"""
+import argparse
+import time
+import tracemalloc
+
+from gridbot.tty_model import TtyModel
+
+
+def legacy_planes(columns: int, lines: int):
+    """The old representation: a list per row holding one str (or int) per cell"""
+    chars = [[' ' for _ in range(columns)] for _ in range(lines)]
+    attrs = [[0 for _ in range(columns)] for _ in range(lines)]
+    return chars, attrs
+
+def legacy_scroll(chars, attrs, columns: int):
+    """The old scroll: drop the top row and allocate a fresh bottom row"""
+    del chars[0]
+    chars.append([' ' for _ in range(columns)])
+    del attrs[0]
+    attrs.append([0 for _ in range(columns)])
+
+def measure_memory(factory, count: int) -> int:
+    """Bytes allocated to build `count` objects with factory()"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = [factory() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del keep
+    return after - before
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--columns", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=60)
+    parser.add_argument("--jobs", type=int, default=50, help="number of concurrent pty jobs to simulate")
+    parser.add_argument("--scrolls", type=int, default=100_000)
+    args = parser.parse_args()
+    columns, lines = args.columns, args.lines
+
+    def filled_model():
+        tty = TtyModel(columns=columns, lines=lines)
+        tty.write(("x" * columns * lines).encode())
+        return tty
+
+    new = measure_memory(filled_model, args.jobs)
+    old = measure_memory(lambda: legacy_planes(columns, lines), args.jobs)
+    print(f"{args.jobs} terminals of {columns}x{lines}")
+    print(f"  list-of-lists planes: {old / 2**20:8.2f} MiB ({old / args.jobs / (columns * lines):5.1f} bytes/cell)")
+    print(f"  array planes:         {new / 2**20:8.2f} MiB ({new / args.jobs / (columns * lines):5.1f} bytes/cell)")
+
+    chars, attrs = legacy_planes(columns, lines)
+    start = time.perf_counter()
+    for _ in range(args.scrolls):
+        legacy_scroll(chars, attrs, columns)
+    old_scroll = (time.perf_counter() - start) / args.scrolls
+
+    tty = TtyModel(columns=columns, lines=lines)
+    start = time.perf_counter()
+    for _ in range(args.scrolls):
+        tty.scroll()
+    new_scroll = (time.perf_counter() - start) / args.scrolls
+    print(f"microseconds per full screen scroll")
+    print(f"  list-of-lists planes: {old_scroll * 1e6:8.2f}")
+    print(f"  array planes:         {new_scroll * 1e6:8.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Measures the cost of rendering a large terminal after a small write"""
+import argparse
+import time
+
+from gridbot.tty_model import TtyModel
+
+
+def full_render(tty: TtyModel) -> str:
+    """Render every row from scratch, ignoring the row cache"""
+    return '\n'.join(tty.render_row(line) for line in range(tty.lines))
+
+def time_per_call(fn, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--columns", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=60)
+    parser.add_argument("--count", type=int, default=2000)
+    args = parser.parse_args()
+
+    tty = TtyModel(columns=args.columns, lines=args.lines)
+    tty.write(b"x" * (args.columns * args.lines - 1))
+    tty.render()
+
+    def small_write_full():
+        tty.write(b"\r!")
+        full_render(tty)
+
+    def small_write_cached():
+        tty.write(b"\r!")
+        tty.render()
+
+    def scroll_cached():
+        tty.write(b"\r\n!")
+        tty.render()
+
+    print(f"{args.columns}x{args.lines} terminal, microseconds per write + render")
+    print(f"  full rebuild, one char changed:  {time_per_call(small_write_full, args.count) * 1e6:8.1f}")
+    print(f"  row cache, one char changed:     {time_per_call(small_write_cached, args.count) * 1e6:8.1f}")
+    print(f"  row cache, one line scrolled:    {time_per_call(scroll_cached, args.count) * 1e6:8.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Measures TtyModel.write throughput on job output that looks like what users actually run"""
+import argparse
+import time
+
+from gridbot.tty_model import TtyModel
+
+
+def build_log(size: int) -> bytes:
+    """Compiler/make style output: short lines, CRLF as a pty would send them"""
+    line = b"cc -O2 -Wall -c src/jobs.c -o build/jobs.o\r\n"
+    return line * (size // len(line) + 1)
+
+def build_listing(size: int) -> bytes:
+    """ls -l style output with tabs and long lines that wrap"""
+    line = b"-rw-r--r--  1 wii  wii\t 48213 Oct 16 12:01 some-rather-long-file-name-that-wraps.tar.gz\r\n"
+    return line * (size // len(line) + 1)
+
+def build_unicode(size: int) -> bytes:
+    """Text with a fair amount of multibyte UTF-8"""
+    line = "pokémon ☉ deadly lazer 🤔 thinking — naïve café\r\n".encode()
+    return line * (size // len(line) + 1)
+
+def build_progress(size: int) -> bytes:
+    """A progress bar that redraws itself with carriage returns"""
+    out = bytearray()
+    i = 0
+    while len(out) < size:
+        filled = i % 31
+        out += b"\r[" + b"#" * filled + b" " * (30 - filled) + b"] %3d%%" % (filled * 100 // 30)
+        i += 1
+    return bytes(out)
+
+WORKLOADS = {
+    "build log": build_log,
+    "listing": build_listing,
+    "unicode": build_unicode,
+    "progress bar": build_progress,
+}
+
+def write_per_byte(tty: TtyModel, data: bytes):
+    """The old write loop: every byte goes through the state machine"""
+    for code in data:
+        tty.write_one_char(code)
+
+def write_chunked(tty: TtyModel, data: bytes, chunk_size=1024):
+    """Write the way job output arrives: in chunks from the node"""
+    for i in range(0, len(data), chunk_size):
+        tty.write(data[i:i+chunk_size])
+
+def measure(writer, data: bytes, columns: int, lines: int, repeat: int) -> float:
+    """Best throughput in MB/s over `repeat` runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        tty = TtyModel(columns=columns, lines=lines)
+        start = time.perf_counter()
+        writer(tty, data)
+        best = min(best, time.perf_counter() - start)
+    return len(data) / best / 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1 << 20, help="bytes per workload")
+    parser.add_argument("--columns", type=int, default=80)
+    parser.add_argument("--lines", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'workload':<14} {'per-byte MB/s':>14} {'write() MB/s':>13} {'speedup':>8}")
+    for name, build in WORKLOADS.items():
+        data = build(args.size)[:args.size]
+        before = measure(write_per_byte, data, args.columns, args.lines, args.repeat)
+        after = measure(write_chunked, data, args.columns, args.lines, args.repeat)
+        print(f"{name:<14} {before:>14.2f} {after:>13.2f} {after / before:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# holds jobs that can't be placed yet because the grid is full
+import asyncio
+import collections
+import logging
+import time
+import typing
+
+import discord
+from discord.ext.commands import Context
+
+from .config import Config
+from .edit_scheduler import edit_scheduler
+
+
+class PendingJob:
+    """A job submission waiting for a node to have room for it"""
+    def __init__(self, ctx: Context, command_string: str, reply: discord.Message, output_filter=None, callback=None,
+                 tty_spec: tuple[str,int,int]|None = None):
+        self.ctx = ctx
+        self.command_string = command_string
+        self.reply = reply
+        self.output_filter = output_filter
+        self.callback = callback
+        self.tty_spec = tty_spec
+        self.enqueue_time = time.monotonic()
+        self.position: int|None = None
+
+    @property
+    def user_id(self) -> int:
+        return self.ctx.author.id
+
+    def __repr__(self):
+        return f"<PendingJob: user={self.user_id} position={self.position}>"
+
+
+# (pending job) -> node that should run it, or None if it has to keep waiting
+Placer = typing.Callable[[PendingJob], typing.Any]
+# (pending job, node) -> None
+Launcher = typing.Callable[[PendingJob, typing.Any], typing.Awaitable[None]]
+
+
+class AdmissionQueue:
+    """Queue of pending jobs that is fair between users.
+    Each user has their own FIFO, and the queue takes one job from each user in turn."""
+
+    def __init__(self, limit: int|None = None, per_user_limit: int|None = None, timeout: float|None = None):
+        self._limit = limit
+        self._per_user_limit = per_user_limit
+        self._timeout = timeout
+        # users are kept in the order they'll next be served
+        self._queues: collections.OrderedDict[int, collections.deque[PendingJob]] = collections.OrderedDict()
+        self._size = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def limit(self) -> int:
+        return self._limit if self._limit is not None else Config.QUEUE_LIMIT
+
+    @property
+    def per_user_limit(self) -> int:
+        return self._per_user_limit if self._per_user_limit is not None else Config.QUEUE_PER_USER_LIMIT
+
+    @property
+    def timeout(self) -> float:
+        return self._timeout if self._timeout is not None else Config.QUEUE_TIMEOUT_SEC
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self) -> typing.Iterator[PendingJob]:
+        """Iterate over the pending jobs in the order they'll be dispatched, assuming every node is usable"""
+        queues = [list(queue) for queue in self._queues.values()]
+        for depth in range(max(map(len, queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    yield queue[depth]
+
+    def enqueue(self, pending: PendingJob) -> int|None:
+        """Add a job to the queue. Returns its position, or None if the queue (or the user's share of it) is full."""
+        queue = self._queues.get(pending.user_id)
+        if self._size >= self.limit or (queue is not None and len(queue) >= self.per_user_limit):
+            return None
+        if queue is None:
+            queue = collections.deque()
+            self._queues[pending.user_id] = queue
+        queue.append(pending)
+        self._size += 1
+        self._renumber()
+        return pending.position
+
+    def remove(self, pending: PendingJob):
+        """Take a job out of the queue and send its user to the back of the line"""
+        queue = self._queues[pending.user_id]
+        queue.remove(pending)
+        self._size -= 1
+        if queue:
+            self._queues.move_to_end(pending.user_id)
+        else:
+            del self._queues[pending.user_id]
+        pending.position = None
+
+    def _renumber(self) -> list[PendingJob]:
+        """Update the position of every pending job. Returns the jobs whose position changed."""
+        moved = []
+        for position, pending in enumerate(self, 1):
+            if pending.position != position:
+                pending.position = position
+                moved.append(pending)
+        return moved
+
+    def expire(self) -> list[PendingJob]:
+        """Give up on jobs that have waited longer than `timeout` seconds. Returns the jobs that were dropped."""
+        now = time.monotonic()
+        expired = [pending for pending in self if now - pending.enqueue_time > self.timeout]
+        for pending in expired:
+            logging.info(f"queued job for user {pending.user_id} expired after {now - pending.enqueue_time:.1f} s")
+            self.remove(pending)
+            edit_scheduler.submit(pending.reply, ":x: Your job waited too long for a free node, so it was not run. "
+                                                 "Please try again later.")
+        if expired:
+            self._update_positions()
+        return expired
+
+    def _update_positions(self):
+        for pending in self._renumber():
+            edit_scheduler.submit(pending.reply, self.status(pending))
+
+    async def drain(self, place: Placer, launch: Launcher):
+        """Launch as many pending jobs as there is room for.
+        A job whose node is full is passed over so it doesn't hold up the jobs behind it."""
+        async with self._lock:
+            self.expire()
+            launched = True
+            while launched:
+                launched = False
+                for pending in self:
+                    node = place(pending)
+                    if node is None:
+                        continue
+                    self.remove(pending)
+                    try:
+                        await launch(pending, node)
+                    except Exception:
+                        logging.exception(f"error launching queued job {pending}")
+                    launched = True
+                    break
+            self._update_positions()
+
+    def status(self, pending: PendingJob) -> str:
+        """Content for a queued job's reply message"""
+        return f":hourglass: The grid is busy. Your job is queued at position {pending.position}."
+
+
+admission_queue = AdmissionQueue()
@@ -21,6 +21,49 @@ class Config:
     NOTIFY_LIMIT: int = 60
     MIN_REPORT_SEC: int = 1
     OCI_CONFIG_FILE: str|None = None
+    EDIT_WINDOW_SEC: float = 1.0
+    EDIT_RATE: float = 1.0
+    EDIT_BURST: int = 5
+    SPOOL_HEAD_BYTES: int = 64 * 1024
+    SPOOL_TAIL_BYTES: int = 16 * 1024
+    JOB_OUTPUT_CAP: int = 64 * 1024 * 1024
+    GLOBAL_OUTPUT_CAP: int = 512 * 1024 * 1024
+    SCROLLBACK_LINES: int = 1000
+    NODE_CAPACITY: int = 4
+    SCHEDULER_POLICY: str = "least-loaded"
+    QUEUE_LIMIT: int = 50
+    QUEUE_PER_USER_LIMIT: int = 5
+    QUEUE_TIMEOUT_SEC: float = 900.0
+    PING_INTERVAL_SEC: float = 30.0
+    NODE_STALE_SEC: float = 90.0
+    START_TIMEOUT_SEC: float = 20.0
+    START_TIMEOUT_FACTOR: float = 3.0
+    START_TIMEOUT_MIN_SEC: float = 5.0
+    START_TIMEOUT_MAX_SEC: float = 60.0
+    FAILOVER_RETRIES: int = 0
+    SUSPECT_SEC: float = 60.0
+    JOB_STORE_PATH: str|None = None
+    HISTORY_PATH: str|None = None
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int|None = None
+    TRACE_MQTT: bool = False
+    TRACE_SAMPLE_EVERY: int = 1
+    TRACE_MAX_BYTES: int = 64
+    DOWNLOAD_CAP_BYTES: int = 8 * 1024 * 1024
+    DOWNLOAD_TIMEOUT_SEC: float = 120.0
+    OBJECT_STORE_THREADS: int = 4
+    OBJECT_STORE_TIMEOUT_SEC: float = 30.0
+    PAR_POOL_SIZE: int = 4
+    PAR_LIFETIME_SEC: float = 24 * 3600.0
+    PAR_MIN_REMAINING_SEC: float = 3600.0
+    PAR_REFILL_INTERVAL_SEC: float = 600.0
+    RELAY_BACKEND: str = "oci"
+    RELAY_DIR: str = "data/relay"
+    RELAY_HOST: str = "0.0.0.0"
+    RELAY_PORT: int = 8470
+    RELAY_URL: str|None = None
+    UPLOAD_CACHE_DAYS: int = 30
+    UPLOAD_CACHE_MAX_BYTES: int = 10 * 1024 * 1024
 
     @classmethod
     def load_config(cls, config_path: str):
@@ -42,5 +85,57 @@ class Config:
             # job completion notification
             cls.NOTIFY_LIMIT = config.get("notify_limit", 60)
             cls.MIN_REPORT_SEC = config.get("min_report_sec", 1)
+            # output message edit scheduling
+            cls.EDIT_WINDOW_SEC = config.get("edit_window_sec", 1.0)
+            cls.EDIT_RATE = config.get("edit_rate", 1.0)
+            cls.EDIT_BURST = config.get("edit_burst", 5)
+            # job output buffering
+            cls.SPOOL_HEAD_BYTES = config.get("spool_head_bytes", 64 * 1024)
+            cls.SPOOL_TAIL_BYTES = config.get("spool_tail_bytes", 16 * 1024)
+            cls.JOB_OUTPUT_CAP = config.get("job_output_cap", 64 * 1024 * 1024)
+            cls.GLOBAL_OUTPUT_CAP = config.get("global_output_cap", 512 * 1024 * 1024)
+            cls.SCROLLBACK_LINES = config.get("scrollback_lines", 1000)
+            # job placement
+            cls.NODE_CAPACITY = config.get("node_capacity", 4)
+            cls.SCHEDULER_POLICY = config.get("scheduler_policy", "least-loaded")
+            cls.QUEUE_LIMIT = config.get("queue_limit", 50)
+            cls.QUEUE_PER_USER_LIMIT = config.get("queue_per_user_limit", 5)
+            cls.QUEUE_TIMEOUT_SEC = config.get("queue_timeout_sec", 900.0)
+            # node liveness
+            cls.PING_INTERVAL_SEC = config.get("ping_interval_sec", 30.0)
+            cls.NODE_STALE_SEC = config.get("node_stale_sec", 90.0)
+            # job start timeout
+            cls.START_TIMEOUT_SEC = config.get("start_timeout_sec", 20.0)
+            cls.START_TIMEOUT_FACTOR = config.get("start_timeout_factor", 3.0)
+            cls.START_TIMEOUT_MIN_SEC = config.get("start_timeout_min_sec", 5.0)
+            cls.START_TIMEOUT_MAX_SEC = config.get("start_timeout_max_sec", 60.0)
+            # resubmitting jobs that don't start
+            cls.FAILOVER_RETRIES = config.get("failover_retries", 0)
+            cls.SUSPECT_SEC = config.get("suspect_sec", 60.0)
+            # job table persistence
+            cls.JOB_STORE_PATH = config.get("job_store_path", "data/jobs.sqlite")
+            cls.HISTORY_PATH = config.get("history_path", "data/history.sqlite")
+            # metrics endpoint
+            cls.METRICS_HOST = config.get("metrics_host", "127.0.0.1")
+            cls.METRICS_PORT = config.get("metrics_port", None)
+            # MQTT tracing (can be changed at runtime with !trace)
+            cls.TRACE_MQTT = config.get("trace_mqtt", False)
+            cls.TRACE_SAMPLE_EVERY = config.get("trace_sample_every", 1)
+            cls.TRACE_MAX_BYTES = config.get("trace_max_bytes", 64)
             # OCI info (for file downloads)
-            cls.OCI_CONFIG_FILE = config.get("oci_config_file", None)
\ No newline at end of file
+            cls.OCI_CONFIG_FILE = config.get("oci_config_file", None)
+            cls.DOWNLOAD_CAP_BYTES = config.get("download_cap_bytes", 8 * 1024 * 1024)
+            cls.DOWNLOAD_TIMEOUT_SEC = config.get("download_timeout_sec", 120.0)
+            cls.OBJECT_STORE_THREADS = config.get("object_store_threads", 4)
+            cls.OBJECT_STORE_TIMEOUT_SEC = config.get("object_store_timeout_sec", 30.0)
+            cls.PAR_POOL_SIZE = config.get("par_pool_size", 4)
+            cls.PAR_LIFETIME_SEC = config.get("par_lifetime_sec", 24 * 3600.0)
+            cls.PAR_MIN_REMAINING_SEC = config.get("par_min_remaining_sec", 3600.0)
+            cls.PAR_REFILL_INTERVAL_SEC = config.get("par_refill_interval_sec", 600.0)
+            cls.RELAY_BACKEND = config.get("relay_backend", "oci")
+            cls.RELAY_DIR = config.get("relay_dir", "data/relay")
+            cls.RELAY_HOST = config.get("relay_host", "0.0.0.0")
+            cls.RELAY_PORT = config.get("relay_port", 8470)
+            cls.RELAY_URL = config.get("relay_url", None)
+            cls.UPLOAD_CACHE_DAYS = config.get("upload_cache_days", 30)
+            cls.UPLOAD_CACHE_MAX_BYTES = config.get("upload_cache_max_bytes", 10 * 1024 * 1024)
\ No newline at end of file
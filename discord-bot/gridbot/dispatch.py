@@ -0,0 +1,88 @@
+# fans inbound MQTT messages out to per-job worker tasks
+import asyncio
+import collections
+import logging
+import typing
+
+import aiomqtt
+
+Lane = int | str
+MessageHandler = typing.Callable[[aiomqtt.Message], typing.Awaitable[None]]
+ErrorHandler = typing.Callable[[aiomqtt.Message, Exception], typing.Awaitable[None]]
+
+
+class MqttDispatcher:
+    """Routes each inbound message to an ordered lane that is drained by its own worker task.
+    Every job gets a lane keyed by its JID, and node messages share a lane of their own.
+    Messages within a lane are handled in the order they arrived; separate lanes make progress independently."""
+
+    NODE_LANE = "node"
+    MISC_LANE = "misc"
+
+    def __init__(self, handler: MessageHandler, error_handler: ErrorHandler|None = None):
+        self.handler = handler
+        self.error_handler = error_handler
+        self._lanes: dict[Lane, collections.deque[aiomqtt.Message]] = {}
+        self._workers: dict[Lane, asyncio.Task] = {}
+        self._in_flight: set[Lane] = set()
+
+    @classmethod
+    def lane_for(cls, topic: str) -> Lane:
+        """Determine which lane a message with the given topic belongs to"""
+        topic_path = topic.split('/')
+        if topic_path[0] == "job" and len(topic_path) == 3 and topic_path[1].isdigit():
+            return int(topic_path[1])
+        elif topic_path[0] == "node":
+            return cls.NODE_LANE
+        else:
+            return cls.MISC_LANE
+
+    def dispatch(self, msg: aiomqtt.Message):
+        """Queue a message on its lane, starting a worker for the lane if it doesn't have one"""
+        lane = self.lane_for(str(msg.topic))
+        queue = self._lanes.get(lane)
+        if queue is None:
+            queue = collections.deque()
+            self._lanes[lane] = queue
+            self._workers[lane] = asyncio.get_running_loop().create_task(self._work(lane, queue))
+        queue.append(msg)
+
+    async def _work(self, lane: Lane, queue: collections.deque[aiomqtt.Message]):
+        try:
+            while queue:
+                msg = queue.popleft()
+                self._in_flight.add(lane)
+                try:
+                    await self.handler(msg)
+                except Exception as exc:
+                    await self._report(lane, msg, exc)
+                finally:
+                    self._in_flight.discard(lane)
+        finally:
+            # the lane is retired once it runs dry; the next message will start a fresh worker
+            del self._lanes[lane]
+            del self._workers[lane]
+
+    async def _report(self, lane: Lane, msg: aiomqtt.Message, exc: Exception):
+        if self.error_handler is not None:
+            try:
+                await self.error_handler(msg, exc)
+                return
+            except Exception:
+                # carry on with the rest of the lane regardless
+                logging.exception(f"error handler failed in MQTT lane {lane}")
+        logging.exception(f"unhandled exception in MQTT lane {lane}", exc_info=exc)
+
+    def depths(self) -> dict[Lane, int]:
+        """Number of messages each lane has yet to finish handling, including the one in progress"""
+        return {lane: len(queue) + (lane in self._in_flight) for lane, queue in self._lanes.items()}
+
+    async def join(self):
+        """Wait until every lane has run dry"""
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    def close(self):
+        """Cancel all workers, discarding any messages still queued"""
+        for task in self._workers.values():
+            task.cancel()
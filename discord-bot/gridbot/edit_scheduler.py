@@ -0,0 +1,120 @@
+# coalesces Discord message edits so chatty jobs don't hammer the rate limiter
+import asyncio
+import logging
+import time
+
+import discord
+
+from . import metrics
+from .config import Config
+
+
+class TokenBucket:
+    """Token bucket rate limiter. Waiters are served in FIFO order."""
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available right now"""
+        self._refill()
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    async def acquire(self):
+        """Wait until a token is available, then take it"""
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+class EditScheduler:
+    """Collapses all edits to a message that arrive within a window into a single edit,
+    and spends edits from a budget shared by every message so the channel stays under Discord's limits."""
+    def __init__(self, window: float|None = None, rate: float|None = None, burst: int|None = None):
+        # parameters left as None are read from Config the first time they're needed,
+        # because the global scheduler is constructed before the config file is loaded
+        self._window = window
+        self._rate = rate
+        self._burst = burst
+        self._bucket: TokenBucket|None = None
+        self._pending: dict[int, tuple[discord.Message, str]] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    @property
+    def window(self) -> float:
+        """Seconds to wait for more edits before flushing"""
+        return self._window if self._window is not None else Config.EDIT_WINDOW_SEC
+
+    @property
+    def bucket(self) -> TokenBucket:
+        """The global edit budget"""
+        if self._bucket is None:
+            rate = self._rate if self._rate is not None else Config.EDIT_RATE
+            burst = self._burst if self._burst is not None else Config.EDIT_BURST
+            self._bucket = TokenBucket(rate, burst)
+        return self._bucket
+
+    def pending(self, message: discord.Message) -> bool:
+        """True if an edit to the message is waiting to be flushed"""
+        return message.id in self._pending
+
+    def submit(self, message: discord.Message, content: str):
+        """Schedule an edit. Only the latest content submitted within the window will be sent."""
+        key = message.id
+        self._pending[key] = (message, content)
+        task = self._tasks.get(key)
+        if task is None or task.done():
+            self._tasks[key] = asyncio.get_running_loop().create_task(self._drain(key))
+
+    def cancel(self, message: discord.Message):
+        """Drop any edit waiting to be flushed for the message"""
+        key = message.id
+        self._pending.pop(key, None)
+        task = self._tasks.pop(key, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    async def edit_now(self, message: discord.Message, content: str):
+        """Replace any pending edit with this one and send it as soon as the budget allows.
+        Exceptions from Discord are passed on to the caller."""
+        self.cancel(message)
+        await self.bucket.acquire()
+        try:
+            with metrics.DISCORD_EDIT_SECONDS.time(mode="now"):
+                await message.edit(content=content)
+        except discord.HTTPException:
+            metrics.DISCORD_EDIT_ERRORS.inc(mode="now")
+            raise
+
+    async def _drain(self, key: int):
+        try:
+            # keep going while edits are coming in, so edits to one message never overtake each other
+            while key in self._pending:
+                await asyncio.sleep(self.window)
+                await self.bucket.acquire()
+                entry = self._pending.pop(key, None)
+                if entry is None:
+                    break
+                message, content = entry
+                try:
+                    with metrics.DISCORD_EDIT_SECONDS.time(mode="scheduled"):
+                        await message.edit(content=content)
+                except discord.HTTPException:
+                    metrics.DISCORD_EDIT_ERRORS.inc(mode="scheduled")
+                    logging.exception(f"scheduled edit of message {key} failed")
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+edit_scheduler = EditScheduler()
@@ -1,6 +1,9 @@
+import codecs
+import collections
+import io
+import math
 import json
 import os
-import io
 import typing
 from typing import Self, override
 import asyncio
@@ -14,7 +17,13 @@ import datetime as dt
 
 from .config import *
 from .output_filter import filter_backticks
+from .edit_scheduler import edit_scheduler
 from .tty_model import TtyModel
+from .spool import OutputSpool
+from .scheduler import SchedulingPolicy, make_policy
+from .job_store import JobRecord, JobStore
+from .history import HistoryEntry, JobHistory, command_hash
+from . import metrics
 
 ## job table ##
 
@@ -37,20 +46,57 @@ def disposition(status:int) -> str:
 class OutputHandler:
     """Basic output handler """
     def __init__(self, output_message: discord.Message, output_filter=None, ctx: Context|None=None):
-        self.output_buffer = io.BytesIO()
+        self.output_buffer = OutputSpool()
         self.output_message = output_message
         self.filter = output_filter if output_filter else (lambda x: x)
         self.ctx = ctx
         self.will_attach = True
+        # Decoded text is built up as data arrives, so each byte is only decoded once.
+        # The incremental decoder holds on to multibyte sequences that are split across writes.
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._decoded: list[str] = []
+        self._decoded_len = 0
+        self._filtered: str|None = None
+        # Like the output buffer, the decoded text is bounded. Past the spool's head size, only the tail is kept.
+        self._text_limit = self.output_buffer.head_size
+        self.text_truncated = False
+
+    def decode(self, data: bytes, final=False):
+        """Append newly written data to the decoded text"""
+        text = self._decoder.decode(data, final)
+        if text:
+            self._decoded.append(text)
+            self._decoded_len += len(text)
+            self._filtered = None
+            if self._decoded_len > self._text_limit:
+                # let the text grow to twice the tail size between trims so trimming stays cheap
+                tail_size = self.output_buffer.tail_size
+                contents = ''.join(self._decoded)[-tail_size:]
+                self._decoded = [contents]
+                self._decoded_len = len(contents)
+                self._text_limit = 2 * tail_size
+                self.text_truncated = True
 
     def buffer_contents(self) -> str:
-        """Return the contents of the output buffer."""
-        contents = self.output_buffer.getvalue().decode(errors="replace")
-        return self.filter(contents)
+        """Return the filtered contents of the output buffer.
+        For large output, this is only the last part of the output.
+        The result is cached until more data is written."""
+        if self._filtered is None:
+            contents = ''.join(self._decoded)
+            self._decoded = [contents]
+            if self.text_truncated:
+                contents = contents[-self.output_buffer.tail_size:]
+            self._filtered = self.filter(contents)
+        return self._filtered
 
     async def replace_message(self, content: str):
         """Overwrite the output message. This does not clear the output buffer"""
-        await self.output_message.edit(content=content)
+        await edit_scheduler.edit_now(self.output_message, content)
+
+    def schedule_edit(self, content: str):
+        """Edit the output message once the edit scheduler gets around to it.
+        Later calls supersede earlier ones that haven't been sent yet."""
+        edit_scheduler.submit(self.output_message, content)
 
     async def update_message(self, data: bytes):
         """Edit the message to account for new data written to the output buffer.
@@ -60,12 +106,15 @@ class OutputHandler:
     async def write(self, data: bytes):
         """Write data to the output buffer. Display this data in the output message,
         if there is room."""
-        # noinspection PyTypeChecker
-        self.output_buffer.write(data)
+        kept = self.output_buffer.write(data)
+        self.decode(data[:kept])
         await self.update_message(data)
 
     async def notify_stopped(self):
         """Ping the user who started the job"""
+        if self.ctx is None:
+            # restored after a restart, so there's nobody to ping
+            return
         content = f"<@{self.ctx.message.author.id}> your job ({self.output_message.jump_url}) has finished"
         await self.ctx.send(content=content)
 
@@ -73,20 +122,36 @@ class OutputHandler:
         """Edit the message to its final form once the job is complete.
         This is meant to be overridden by a subclass.
         The `will_attach` attribute can be set in this method; doing so will cause the output buffer to be attached"""
-        await self.output_message.edit(content=status)
+        await edit_scheduler.edit_now(self.output_message, status)
 
     async def stopped(self, status: str, jid: int):
         """Close the output buffer. If the output buffer doesn't fit in the message, attach its contents."""
+        # don't let a stale "Running..." edit land after the final one
+        edit_scheduler.cancel(self.output_message)
+        # flush out any incomplete multibyte sequence at the end of the output
+        self.decode(b'', final=True)
+        if self.output_buffer.dropped:
+            dropped = hr.file_size(self.output_buffer.dropped, binary=True)
+            status += f"\n*Output was cut off; {dropped} was not kept*"
         if self.will_attach:
-            # Upload the output buffer as an attachment
-            self.output_buffer.seek(0)
-            attachment = discord.File(self.output_buffer, f"gridmii-output-{jid}.txt")
+            attachment = self.attachment(jid)
             try:
+                if isinstance(self.output_message, discord.PartialMessage) \
+                        and not isinstance(self.output_message, discord.Message):
+                    # a job restored after a restart only has a PartialMessage, which can't take files
+                    self.output_message = await self.output_message.fetch()
                 await self.output_message.add_files(attachment)
             except discord.HTTPException as http_exc:
                 status += f"\n**Error attaching file:**\n```{str(http_exc)}```"
-        await self.update_message_stopped(status, jid)
-        self.output_buffer.close()
+        try:
+            await self.update_message_stopped(status, jid)
+        finally:
+            self.output_buffer.close()
+
+    def attachment(self, jid: int) -> discord.File:
+        """The file to attach to the output message when `will_attach` is set"""
+        # stream the output buffer from disk if it was spilled
+        return discord.File(self.output_buffer.open_for_read(), f"gridmii-output-{jid}.txt")
 
 
 class PipeOutputHandler(OutputHandler):
@@ -104,7 +169,7 @@ class PipeOutputHandler(OutputHandler):
                 # turns out we will attach
                 self.will_attach = True
                 content = "Running...\n*Output will be attached to this message when the job completes*"
-            await self.output_message.edit(content=content)
+            self.schedule_edit(content)
 
     @override
     async def update_message_stopped(self, status: str, jid: int):
@@ -121,33 +186,71 @@ class PipeOutputHandler(OutputHandler):
                 self.will_attach = True
                 await super().update_message_stopped(status, jid)
             else:
-                await self.output_message.edit(content=content)
+                await edit_scheduler.edit_now(self.output_message, content)
         else:
             await super().update_message_stopped(status, jid)
 
 class PtyOutputHandler(OutputHandler):
-    """Performs a level of tty emulation on job output"""
-    # TODO: detect whether it scrolled
+    """Performs a level of tty emulation on job output.
+    The raw output isn't kept; if any of it scrolls off the screen, the terminal's history is attached instead."""
     def __init__(self, output_message: discord.Message, output_filter=None, ctx: Context|None=None,
                  columns=40, lines=25):
         super().__init__(output_message, output_filter, ctx)
         self.will_attach = False
-        self.tty = TtyModel(columns=columns, lines=lines)
+        self.tty = TtyModel(columns=columns, lines=lines, scrollback=Config.SCROLLBACK_LINES)
+        self._last_screen: str|None = None
 
     @override
     async def write(self, data: bytes):
         self.tty.write(data)
-        await super().write(data)
+        await self.update_message(data)
+
+    @override
+    def buffer_contents(self) -> str:
+        return self.tty.history()
+
+    @override
+    def attachment(self, jid: int) -> discord.File:
+        history = self.tty.history()
+        if self.tty.scrollback_dropped:
+            history = f"[{self.tty.scrollback_dropped} earlier lines were not kept]\n" + history
+        return discord.File(io.BytesIO(history.encode()), f"gridmii-output-{jid}.txt")
+
+    @override
+    async def stopped(self, status: str, jid: int):
+        # attach the history if anything scrolled off the screen
+        self.will_attach = bool(self.tty.scrollback)
+        await super().stopped(status, jid)
+
+    def screen_message(self, prefix: str = "", suffix: str = "") -> str:
+        """The screen in a code block between `prefix` and `suffix`, kept within the message limit.
+        Colour escapes can make a full screen too long, so they're dropped if need be, then the top of the screen."""
+        content = f"{prefix}```ansi\n{self.tty.render()}\n```{suffix}"
+        if len(content) <= Job.MESSAGE_LIMIT:
+            return content
+        rows = [self.tty.plain_row(line) for line in range(self.tty.lines)]
+        while rows and not rows[-1]:
+            rows.pop()
+        screen = '\n'.join(rows)
+        room = max(Job.MESSAGE_LIMIT - len(prefix) - len(suffix) - len("```ansi\n\n```"), 0)
+        if len(screen) > room:
+            screen = screen[len(screen) - room:]
+        return f"{prefix}```ansi\n{screen}\n```{suffix}"[:Job.MESSAGE_LIMIT]
 
     @override
     async def update_message(self, data: bytes):
-        content = f"Running...\n```ansi\n{self.tty.render()}\n```"
-        await self.output_message.edit(content=content)
+        if not self.tty.changed:
+            return
+        screen = self.tty.render()
+        if screen == self._last_screen:
+            # e.g. a cursor movement or a character overwritten with itself
+            return
+        self._last_screen = screen
+        self.schedule_edit(self.screen_message(prefix="Running...\n"))
 
     @override
     async def update_message_stopped(self, status: str, jid: int):
-        content = f"```ansi\n{self.tty.render()}\n```\n{status}"
-        await self.output_message.edit(content=content)
+        await edit_scheduler.edit_now(self.output_message, self.screen_message(suffix=f"\n{status}"))
 
 class Job:
     """Represents a running job somewhere in the grid. A Job object a numeric
@@ -162,41 +265,75 @@ class Job:
         self.jid = jid
         self.output_handler = output_handler
         self.started = False
+        # set once the job has been stopped, so a second stop (e.g. a roll call racing the stopped message) is ignored
+        self.finished = False
         self.start_time = time.monotonic()
         self.target_node = target_node_name
         self.callback = callback    # async def callback(job: Job, exit_status: int|None): ...
+        # what was submitted, so the job can be sent to another node if it doesn't start
+        self.script: str|None = None
+        self.tty_spec: tuple[str,int,int]|None = None
+        self.attempt = 1
+        self.user_id: int|None = output_handler.ctx.author.id if output_handler.ctx is not None else None
+        # for the job history
+        self.submit_time = time.time()
+        self.start_latency: float|None = None
+        self.bytes_out = 0
 
     async def startup(self):
         """Called when the job has successfully started."""
+        # until now, start_time was when the job was submitted
+        now = time.monotonic()
+        self.start_latency = now - self.start_time
+        metrics.JOB_START_SECONDS.observe(self.start_latency)
+        if node_table.node_present(self.target_node):
+            node_table.get_node(self.target_node).record_startup(self.start_latency)
+        # mark the job started before the edit, which can wait a while for the edit budget
+        self.started = True
+        self.start_time = now
+        job_table.job_started(self)
         content = f"Your job has started on `{self.target_node}`! Stand by for output..."
         await self.output_handler.replace_message(content=content)
-        self.started = True
-        self.start_time = time.monotonic()
 
     async def reject(self, error: bytes):
         """Called when the job could not start."""
+        self.started = True     # don't let the clean_if_unstarted task fire
         content = f"**Could not start job:** `{error.decode(errors="replace")}`"
         await self.output_handler.replace_message(content=content)
-        self.started = True     # don't let the clean_if_unstarted task fire
+        job_table.record_history(self, "rejected")
         job_table.delete_job(self.jid)
 
-    async def clean_if_unstarted(self, delay=20.0):
+    async def clean_if_unstarted(self, delay: float|None = None, failover=None):
         """A task that will terminate jobs that did not start in a reasonable amount of time.
-        This is meant to be scheduled as a task in the event loop."""
-        # The default delay is an extremely conservative number. One of my test nodes has a horrific connection
-        # to the broker (high latency Internet + buggy network driver), and even this isn't high enough sometimes.
+        This is meant to be scheduled as a task in the event loop.
+        If given, `async def failover(job: Job) -> bool` gets a chance to resubmit the job elsewhere first."""
+        # By default the delay comes from how long jobs have recently taken to start on the node. One of my test
+        # nodes has a horrific connection to the broker (high latency Internet + buggy network driver), so a single
+        # fixed number is either too slow to notice lost jobs on good nodes or too impatient with that one.
+        if delay is None:
+            if node_table.node_present(self.target_node):
+                delay = node_table.get_node(self.target_node).startup_timeout()
+            else:
+                delay = Config.START_TIMEOUT_SEC
         await asyncio.sleep(delay)
         if not self.started:
             logging.warning(f"job {self.jid} did not start on node {self.target_node}")
+            job_table.record_history(self, "unstarted")
+            if failover is not None and await failover(self):
+                return
+            if self.started or not job_table.jid_present(self.jid):
+                return
+            # retire rather than delete, so the node's copy is killed if it starts while the edit is waiting
+            job_table.retire_job(self.jid)
             content = ":x: Your job did not start. The node might not be online."
             await self.output_handler.replace_message(content=content)
-            job_table.delete_job(self.jid)
 
 
     async def write(self, data: bytes):
         """Called when stdout/stderr has been written to and the output buffer needs updated"""
         if not self.started:
             logging.warning(f"jid {self.jid} got write message before starting")
+        self.bytes_out += len(data)
         await self.output_handler.write(data)
 
 
@@ -217,7 +354,10 @@ class Job:
         await mq_client.publish(topic, qos=2)
 
     async def stopped(self, result: bytes=b'0', *, abandoned=False):
-        """Called when the job terminates, successfully or not"""
+        """Called when the job terminates, successfully or not. Only the first call has any effect."""
+        if self.finished:
+            return
+        self.finished = True
         # Decode the result code to form the status
         if not abandoned:
             # noinspection PyTypeChecker
@@ -240,7 +380,12 @@ class Job:
         if sec > Config.NOTIFY_LIMIT:
             await self.output_handler.notify_stopped()
 
-        await self.output_handler.stopped(status, self.jid)
+        try:
+            await self.output_handler.stopped(status, self.jid)
+        except Exception:
+            # the job is over whether or not Discord took the final edit, so clean up regardless
+            logging.exception(f"couldn't post the final output of job {self.jid}")
+        job_table.record_history(self, "abandoned" if abandoned else "exited", result_code, sec)
         job_table.delete_job(self.jid)
 
         if self.callback is not None:
@@ -266,21 +411,112 @@ class JobTable:
         def __init__(self):
             self._table: dict[int, Job] = {}
             self._last_jid = 0
+            # secondary indexes, kept in step with _table by new_job and delete_job
+            # the inner dicts are keyed by JID so the jobs stay in submission order
+            self._by_message_id: dict[int, Job] = {}
+            self._by_node: dict[str, dict[int, Job]] = {}
+            self._by_user: dict[int, dict[int, Job]] = {}
+            # called with each job as it leaves the table, freeing a slot on its node
+            self.on_delete: typing.Callable[[Job], None] | None = None
+            # JIDs of jobs that were given up on and resubmitted, mapped to the node they were sent to
+            self._retired: collections.OrderedDict[int, str] = collections.OrderedDict()
+            # optional on-disk copy of the table, see attach_store
+            self.store: JobStore|None = None
+            # optional record of finished jobs
+            self.history: JobHistory|None = None
+
+        def attach_store(self, store: JobStore):
+            """Persist the table to `store` from now on. JIDs carry on from where the store left off."""
+            self.store = store
+            self._last_jid = max(self._last_jid, store.last_jid())
+
+        @staticmethod
+        def _make_handler(output_message: discord.Message, output_filter, ctx: Context|None,
+                          tty_spec: tuple[str,int,int]|None) -> OutputHandler:
+            if not tty_spec:
+                return PipeOutputHandler(output_message, output_filter, ctx)
+            else:
+                _, columns, lines = tty_spec
+                return PtyOutputHandler(output_message, output_filter, ctx, columns, lines)
 
         def new_job(self, output_message: discord.Message, target_node_name: str, output_filter=filter_backticks,
-                    ctx: Context | None = None, callback = None, tty_spec:tuple[str,int,int]|None=None) -> Job:
+                    ctx: Context | None = None, callback = None, tty_spec:tuple[str,int,int]|None=None,
+                    script: str|None = None) -> Job:
             """Create fresh job object tied to an output message"""
             self._last_jid += 1
             jid = self._last_jid
-            if not tty_spec:
-                output_handler = PipeOutputHandler(output_message, output_filter, ctx)
-            else:
-                _, columns, lines = tty_spec
-                output_handler = PtyOutputHandler(output_message, output_filter, ctx, columns, lines)
+            output_handler = self._make_handler(output_message, output_filter, ctx, tty_spec)
             new_job_entry = Job(jid, target_node_name, output_handler, callback)
+            new_job_entry.script = script
+            new_job_entry.tty_spec = tty_spec
             self._table[jid] = new_job_entry
+            self._index(new_job_entry)
+            if self.store is not None:
+                self.store.add(JobRecord(jid, target_node_name, output_message.channel.id, output_message.id,
+                                         new_job_entry.user_id, tty_spec, script, new_job_entry.submit_time))
             return new_job_entry
 
+        def job_started(self, job: Job):
+            """Note in the store when a job started, so its run time is still right after a restart"""
+            if self.store is not None and job.jid in self._table:
+                self.store.set_started(job.jid, time.time())
+
+        def restore_job(self, record: JobRecord, output_message: discord.Message) -> Job:
+            """Put a job from the store back in the table after a restart.
+            The job is assumed to be running; a roll call will tell if it isn't."""
+            output_handler = self._make_handler(output_message, filter_backticks, None, record.tty_spec)
+            job = Job(record.jid, record.node, output_handler)
+            job.started = True
+            job.script = record.script
+            job.tty_spec = record.tty_spec
+            job.user_id = record.user_id
+            # carry the run time over the restart. A job that hadn't been seen to start is timed from its submission.
+            if record.submitted_at is not None:
+                job.submit_time = record.submitted_at
+            started_at = record.started_at if record.started_at is not None else record.submitted_at
+            if started_at is not None:
+                job.start_time = time.monotonic() - max(time.time() - started_at, 0.0)
+            if record.submitted_at is not None and record.started_at is not None:
+                job.start_latency = record.started_at - record.submitted_at
+            self._table[job.jid] = job
+            self._index(job)
+            self._last_jid = max(self._last_jid, job.jid)
+            return job
+
+        def _index(self, job: Job):
+            self._by_message_id[job.output_handler.output_message.id] = job
+            self._by_node.setdefault(job.target_node, {})[job.jid] = job
+            user_id = job.user_id
+            if user_id is not None:
+                self._by_user.setdefault(user_id, {})[job.jid] = job
+
+        def _unindex(self, job: Job):
+            self._by_message_id.pop(job.output_handler.output_message.id, None)
+            node_jobs = self._by_node.get(job.target_node, {})
+            node_jobs.pop(job.jid, None)
+            if not node_jobs:
+                self._by_node.pop(job.target_node, None)
+            user_id = job.user_id
+            if user_id is not None:
+                user_jobs = self._by_user.get(user_id, {})
+                user_jobs.pop(job.jid, None)
+                if not user_jobs:
+                    del self._by_user[user_id]
+
+        def record_history(self, job: Job, outcome: str, exit_status: int|None = None, runtime: float|None = None):
+            """Account for a job that is leaving the table in the metrics, and in the job history if there is one"""
+            metrics.JOBS_FINISHED.inc(outcome=outcome)
+            if job.started and job.start_latency is not None:
+                metrics.JOB_OUTPUT_BYTES.observe(job.bytes_out)
+                if runtime is not None:
+                    metrics.JOB_RUNTIME_SECONDS.observe(runtime)
+            if self.history is None:
+                return
+            entry = HistoryEntry(job.jid, job.user_id, job.target_node, command_hash(job.script), job.submit_time,
+                                 job.start_latency, runtime if job.start_latency is not None else None,
+                                 job.bytes_out, outcome, exit_status)
+            self.history.record(entry)
+
         def jid_present(self, jid: int) -> bool:
             """True if there is a job with that jid in the job table"""
             return jid in self._table
@@ -289,8 +525,47 @@ class JobTable:
             """Returns the job with the given jid, or throws KeyError if there is no such job"""
             return self._table[jid]
 
+        def by_message_id(self, message_id: int) -> Job|None:
+            """Returns the job whose output message has the given ID, or None if there is no such job"""
+            return self._by_message_id.get(message_id)
+
+        def jobs_on_node(self, node_name: str) -> list[Job]:
+            """Returns the jobs running on the named node, oldest first"""
+            return list(self._by_node.get(node_name, {}).values())
+
+        def count_on_node(self, node_name: str) -> int:
+            """Returns how many jobs are running on the named node"""
+            return len(self._by_node.get(node_name, {}))
+
+        def jobs_for_user(self, user_id: int) -> list[Job]:
+            """Returns the jobs started by the user with the given ID, oldest first"""
+            return list(self._by_user.get(user_id, {}).values())
+
         def delete_job(self, jid: int):
-            del self._table[jid]
+            job = self._table.pop(jid)
+            self._unindex(job)
+            # however the job ended, give back its share of the output cap and any spill file
+            job.output_handler.output_buffer.close()
+            if self.store is not None:
+                self.store.remove(jid)
+            if self.on_delete is not None:
+                self.on_delete(job)
+
+        # only the most recent retirements are remembered
+        RETIRED_LIMIT = 1000
+
+        def retire_job(self, jid: int):
+            """Remove a job that is being resubmitted under a new JID.
+            Messages that arrive later for the old JID can be recognized with `retired_node`."""
+            job = self._table[jid]
+            self._retired[jid] = job.target_node
+            if len(self._retired) > self.RETIRED_LIMIT:
+                self._retired.popitem(last=False)
+            self.delete_job(jid)
+
+        def retired_node(self, jid: int) -> str|None:
+            """The node a retired job was sent to, or None if the JID wasn't retired"""
+            return self._retired.get(jid)
 
         def __iter__(self):
             """Returns an iterator over the jobs in the job table"""
@@ -328,7 +603,7 @@ class RefusedJob(Job):
     def output_buffer(self):
         raise RuntimeError("tried to access the output buffer of a RefusedJob")
 
-    async def clean_if_unstarted(self, delay=20.0):
+    async def clean_if_unstarted(self, delay: float|None = None, failover=None):
         # no-op because we aren't in the job table anyway
         return
 
@@ -337,13 +612,77 @@ class RefusedJob(Job):
 class Node:
     """Represents a node in the grid"""
 
-    def __init__(self, node_name: str, node_version: str|None = None):
+    # weight given to the newest sample in the startup latency moving average
+    STARTUP_EWMA_ALPHA = 0.25
+    # how many recent startup latencies are kept for the percentile
+    STARTUP_SAMPLES = 50
+    # the adaptive start timeout isn't trusted until this many jobs have started
+    STARTUP_MIN_SAMPLES = 5
+
+    def __init__(self, node_name: str, node_version: str|None = None, capacity: int|None = None):
         self.node_name = node_name
         self.version = node_version
+        # how many jobs the node runs at once (MAX_JOBS in the node server)
+        self.capacity = capacity if capacity is not None else Config.NODE_CAPACITY
+        # moving average of the time between submitting a job and the node starting it
+        self.startup_latency: float|None = None
+        self.startup_samples: collections.deque[float] = collections.deque(maxlen=self.STARTUP_SAMPLES)
+        # liveness: when we last heard anything from the node, and how long it took to answer the last ping
+        self.last_seen = time.monotonic()
+        self.ping_rtt: float|None = None
+        self.last_ping_answered = 0
+        # a node that failed to start a job is avoided for a while
+        self.suspect_until = 0.0
+
+    @property
+    def running_jobs(self) -> int:
+        """Number of jobs in the job table that are running on this node"""
+        return job_table.count_on_node(self.node_name)
+
+    def record_startup(self, latency: float):
+        """Fold the time a job took to start into the startup latency statistics"""
+        # the node is evidently starting jobs again
+        self.suspect_until = 0.0
+        self.startup_samples.append(latency)
+        if self.startup_latency is None:
+            self.startup_latency = latency
+        else:
+            alpha = self.STARTUP_EWMA_ALPHA
+            self.startup_latency = alpha * latency + (1 - alpha) * self.startup_latency
+
+    def startup_percentile(self, percentile: float = 95) -> float|None:
+        """The given percentile of recent startup latencies (nearest rank), or None if no job has started yet"""
+        if not self.startup_samples:
+            return None
+        ordered = sorted(self.startup_samples)
+        rank = math.ceil(percentile / 100 * len(ordered))
+        return ordered[max(rank, 1) - 1]
+
+    def startup_timeout(self) -> float:
+        """How long to wait for a job submitted to this node to start before giving up on it"""
+        if len(self.startup_samples) < self.STARTUP_MIN_SAMPLES:
+            return Config.START_TIMEOUT_SEC
+        # leave plenty of headroom over the slow tail, and don't let a burst of slow starts get the better of the average
+        expected = max(self.startup_percentile(95), self.startup_latency)
+        timeout = expected * Config.START_TIMEOUT_FACTOR
+        return min(max(timeout, Config.START_TIMEOUT_MIN_SEC), Config.START_TIMEOUT_MAX_SEC)
 
     def touch(self):
-        """Called when a node already in the table responds to a ping"""
-        pass
+        """Called whenever the node sends us a message"""
+        self.last_seen = time.monotonic()
+
+    def mark_suspect(self):
+        """Avoid giving this node new jobs for a while, because a job sent to it never started"""
+        self.suspect_until = time.monotonic() + Config.SUSPECT_SEC
+
+    @property
+    def is_suspect(self) -> bool:
+        return time.monotonic() < self.suspect_until
+
+    @property
+    def is_stale(self) -> bool:
+        """True if the node has been quiet for so long that it might be dead"""
+        return time.monotonic() - self.last_seen > Config.NODE_STALE_SEC
 
     @property
     def is_present(self):
@@ -351,8 +690,8 @@ class Node:
         return node_table.node_present(self.node_name)
 
     def can_accept_jobs(self):
-        # stub for now
-        return True
+        """True if the node has room for another job"""
+        return self.running_jobs < self.capacity
 
     async def submit_job(self,
                          command_string: str,
@@ -363,7 +702,7 @@ class Node:
                          callback=None,
                          tty_spec: tuple[str,int,int]|None=None) -> Job:
         """Submit a job to the node"""
-        job = job_table.new_job(output_message, self.node_name, output_filter, ctx, callback, tty_spec)
+        job = job_table.new_job(output_message, self.node_name, output_filter, ctx, callback, tty_spec, command_string)
         topic = f"{self.node_name}/submit/{job.jid}"
         payload:dict[str,str|dict] = {"script": command_string}
         if tty_spec:
@@ -375,9 +714,10 @@ class Node:
             }
         payload_string = json.dumps(payload)
 
-        logging.debug(f"publishing job {job.jid} to node...")
+        logging.debug("publishing job %d to node...", job.jid)
         await mq_client.publish(topic, payload=payload_string, qos=2)
-        logging.debug(f"job {job.jid} published")
+        metrics.JOBS_SUBMITTED.inc(node=self.node_name)
+        logging.debug("job %d published", job.jid)
 
         return job
 
@@ -405,7 +745,7 @@ class EjectedNode(Node):
     """Represents a node that has been ejected from the grid. Users cannot submit jobs to an ejected node."""
     @classmethod
     def from_node(cls, former: Node):
-        self = cls(former.node_name)
+        self = cls(former.node_name, former.version, former.capacity)
         return self
 
     def can_accept_jobs(self):
@@ -420,10 +760,23 @@ class EjectedNode(Node):
 
 class NodeTable:
 
-    _locus: str | None = None
-
-    def __init__(self):
+    def __init__(self, policy: SchedulingPolicy|None = None):
         self._table: dict[str, Node] = {}
+        # created on first use if not given, since the config isn't loaded at import time
+        self._policy = policy
+        self._ping_count = 0
+        self._last_ping_time: float|None = None
+
+    @property
+    def policy(self) -> SchedulingPolicy:
+        """The policy pick_node uses to place jobs"""
+        if self._policy is None:
+            self._policy = make_policy(Config.SCHEDULER_POLICY)
+        return self._policy
+
+    @policy.setter
+    def policy(self, policy: SchedulingPolicy):
+        self._policy = policy
 
     def get_node(self, node_name: str) -> Node:
         """Return the node with the exact name given, or throw KeyError"""
@@ -476,27 +829,42 @@ class NodeTable:
 
     def pick_node(self) -> Node | None:
         """Select a node that can accept a job. If there are no available nodes, return None"""
-        # Our first crude node selector logic:
-        # * Prefer the last node used
-        # * If that node is gone, pick a node that can accept jobs
-        if self._locus in self._table:
-            return self._table[self._locus]
-        else:
-            for node in self._table.values():
-                if node.can_accept_jobs():
-                    self._locus = node.node_name
-                    return node
-            return None
-
-    def node_seen(self, node_name: str, node_version: str | None = None) -> Node:
+        candidates = [node for node in self._table.values()
+                      if not node.is_stale and not node.is_suspect and node.can_accept_jobs()]
+        return self.policy.choose(candidates)
+
+    def touch(self, node_name: str):
+        """Note that the named node is alive, if it's in the table"""
+        node = self._table.get(node_name)
+        if node is not None:
+            node.touch()
+
+    def ping_sent(self):
+        """Note that a ping just went out to the grid"""
+        self._ping_count += 1
+        self._last_ping_time = time.monotonic()
+
+    def pong(self, node: Node):
+        """Record the round trip time of a node's answer to the latest ping.
+        Connect messages that aren't an answer (or arrive long after the ping) aren't counted."""
+        if self._last_ping_time is None or node.last_ping_answered == self._ping_count:
+            return
+        rtt = time.monotonic() - self._last_ping_time
+        if rtt <= Config.NODE_STALE_SEC:
+            node.ping_rtt = rtt
+            node.last_ping_answered = self._ping_count
+
+    def node_seen(self, node_name: str, node_version: str | None = None, capacity: int | None = None) -> Node:
         """Register the presence of the node with the given name, ensuring its presence in the table"""
         if node_name not in self._table:
-            node = Node(node_name, node_version)
+            node = Node(node_name, node_version, capacity)
             self._table[node_name] = node
         else:
             node = self._table[node_name]
             self._table[node_name].touch()
             node.version = node_version
+            if capacity is not None:
+                node.capacity = capacity
         return node
 
     def node_gone(self, node_name: str):
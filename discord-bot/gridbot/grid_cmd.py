@@ -1,3 +1,4 @@
+import asyncio
 import human_readable as hr
 import datetime as dt
 import time
@@ -5,6 +6,7 @@ import discord.ext.commands as commands
 import discord.ext.tasks as tasks
 from discord.ext.commands import Context
 from .entity import *
+from .admission import admission_queue
 
 
 # noinspection SpellCheckingInspection
@@ -42,6 +44,10 @@ class GridMiiCogBase(commands.Cog):
 # noinspection SpellCheckingInspection
 class UserCommandCog(GridMiiCogBase, name="User Commands"):
     """Cog for GridMii commands regular users can use"""
+    # the largest terminal !term will set up; much more than this won't fit in a message anyway
+    TTY_MAX_COLUMNS = 200
+    TTY_MAX_LINES = 100
+
     @commands.command(name="yougood")
     async def ping(self, ctx: Context):
         """Check connectivity to broker"""
@@ -57,8 +63,18 @@ class UserCommandCog(GridMiiCogBase, name="User Commands"):
     @commands.command()
     async def nodes(self, ctx: Context):
         """View available nodes"""
+        def _line(node: Node):
+            line = f"* {node}: {node.running_jobs}/{node.capacity} jobs"
+            if node.startup_latency is not None:
+                line += f", starts in {node.startup_latency:.2f} s (p95 {node.startup_percentile(95):.2f} s)"
+            if node.ping_rtt is not None:
+                line += f", ping {node.ping_rtt * 1000:.0f} ms"
+            if node.is_stale:
+                line += ", **not responding**"
+            return line
+
         if node_table.has_nodes():
-            message = '\n'.join(f"* {n}" for n in node_table)
+            message = '\n'.join(_line(n) for n in node_table)
         else:
             message = "No nodes are online"
         await ctx.reply(message)
@@ -98,8 +114,8 @@ class UserCommandCog(GridMiiCogBase, name="User Commands"):
         await ctx.reply(content)
 
     @commands.command()
-    async def jobs(self, ctx: Context):
-        """View running jobs"""
+    async def jobs(self, ctx: Context, which: str|None=None):
+        """View running jobs. Say "mine" to see only your jobs, or give a node name to see only that node's jobs."""
         def _line(job: Job):
             output_message = job.output_handler.output_message
             job_ctx = job.output_handler.ctx
@@ -119,12 +135,38 @@ class UserCommandCog(GridMiiCogBase, name="User Commands"):
             # format this information
             return f"* #{job.jid}, started by **{name}**, on `{job.target_node}`, running for **{elapsed}**, see {output_message.jump_url}"
 
-        if job_table.has_jobs():
-            table = '\n'.join(_line(j) for j in job_table)
+        if which is None:
+            jobs = list(job_table)
+        elif which == "mine":
+            jobs = job_table.jobs_for_user(ctx.author.id)
+        else:
+            candidates = node_table.nodes_by_name(which)
+            if len(candidates) != 1:
+                await ctx.reply(f":question: `{which}` doesn't match exactly one node")
+                return
+            jobs = job_table.jobs_on_node(candidates[0].node_name)
+
+        if jobs:
+            table = '\n'.join(_line(j) for j in jobs)
         else:
             table = "No jobs running"
         await ctx.reply(table)
 
+    @commands.command()
+    async def queue(self, ctx: Context):
+        """View jobs waiting for a free node"""
+        def _line(position: int, pending):
+            author = pending.ctx.author
+            name = author.nick if author.nick else author.name
+            waiting = hr.precise_delta(dt.timedelta(seconds=time.monotonic() - pending.enqueue_time))
+            return f"{position}. queued by **{name}** for **{waiting}**, see {pending.reply.jump_url}"
+
+        if admission_queue:
+            content = '\n'.join(_line(position, pending) for position, pending in enumerate(admission_queue, 1))
+        else:
+            content = "No jobs are queued"
+        await ctx.reply(content)
+
     @commands.command()
     async def term(self, ctx: Context, term_name:str|None=None, columns:int=40, lines:int=20):
         prefs = UserPrefs.get_prefs(ctx.author)
@@ -148,6 +190,10 @@ class UserCommandCog(GridMiiCogBase, name="User Commands"):
                 if term_name == "on":
                     # use the defaults if they say !term on
                     term_name = "dumb"
+                if not (1 <= columns <= self.TTY_MAX_COLUMNS and 1 <= lines <= self.TTY_MAX_LINES):
+                    await ctx.reply(f":x: The terminal can be 1 to {self.TTY_MAX_COLUMNS} columns wide "
+                                    f"and 1 to {self.TTY_MAX_LINES} lines tall")
+                    return
                 prefs.tty = (term_name, columns, lines)
                 content = f":+1: tty mode has been turned on\nTERM={term_name}, {columns} x {lines}"
                 await ctx.reply(content)
@@ -238,6 +284,37 @@ class AdminCommandCog(GridMiiCogBase, name="Admin Commands"):
         await job.abandon(self.mq_client)
         await ctx.reply(f":+1: see {job.output_message.jump_url}")
 
+    @commands.command()
+    async def lanes(self, ctx: Context):
+        """Show how many MQTT messages are waiting on each dispatch lane"""
+        depths = self.bot.dispatcher.depths()
+        if not depths:
+            await ctx.reply("All lanes are idle")
+            return
+        lines = []
+        for lane, depth in sorted(depths.items(), key=lambda item: item[1], reverse=True):
+            name = f"job #{lane}" if isinstance(lane, int) else f"`{lane}`"
+            lines.append(f"* {name}: {depth}")
+        await ctx.reply('\n'.join(lines))
+
+    @commands.command()
+    async def trace(self, ctx: Context, state: str|None=None, sample_every: int|None=None, max_bytes: int|None=None):
+        """Turn MQTT tracing on or off, optionally logging only 1 in `sample_every` messages and `max_bytes` of payload"""
+        tracer = self.bot.tracer
+        match state:
+            case None:
+                pass
+            case "on":
+                tracer.configure(True, sample_every, max_bytes)
+            case "off":
+                tracer.configure(False, sample_every, max_bytes)
+            case _:
+                await ctx.reply(":question: say `on` or `off`")
+                return
+        if state is not None:
+            logging.warning(f"MQTT tracing changed by {ctx.author.display_name}: {tracer}")
+        await ctx.reply(f"MQTT {tracer}")
+
     @commands.command()
     async def rollcall(self, ctx: Context):
         """Force a roll call"""
@@ -259,13 +336,7 @@ class JobControlCog(GridMiiCogBase, name="Job Control"):
         msg = ctx.message
         if msg.type != discord.MessageType.reply:
             return None
-        replied_msg_id = msg.reference.message_id
-        # scan for messages
-        for job in job_table:
-            if job.output_handler.output_message.id == replied_msg_id:
-                return job
-        # no message
-        return None
+        return job_table.by_message_id(msg.reference.message_id)
 
     @commands.command()
     async def jobinfo(self, ctx: Context):
@@ -312,13 +383,87 @@ class JobControlCog(GridMiiCogBase, name="Job Control"):
                 output = f"***Output too large***\nThe message would have been {len(output)} characters long, but only 2000 are allowed"
             await ctx.reply(output)
 
+# noinspection SpellCheckingInspection
+class HistoryCog(GridMiiCogBase, name="History"):
+    """Cog for looking back at finished jobs"""
+
+    @commands.command()
+    async def history(self, ctx: Context, which: str="mine", count: int=10):
+        """View recently finished jobs. Say "all" to see everyone's jobs, or give a node name to see that node's."""
+        if job_table.history is None:
+            await ctx.reply(":x: Job history isn't being kept")
+            return
+        count = min(max(count, 1), 25)
+        # the history is read on its own thread, so wait for it there rather than on the event loop
+        if which == "mine":
+            entries = await asyncio.to_thread(job_table.history.recent, user_id=ctx.author.id, limit=count)
+        elif which == "all":
+            entries = await asyncio.to_thread(job_table.history.recent, limit=count)
+        else:
+            entries = await asyncio.to_thread(job_table.history.recent, node=which, limit=count)
+
+        def _line(entry) -> str:
+            line = f"* #{entry.jid} on `{entry.node}` <t:{int(entry.submit_time)}:R>: {entry.outcome}"
+            if entry.exit_status is not None:
+                line += f" ({entry.exit_status})"
+            if entry.runtime is not None:
+                line += f", ran {entry.runtime:.1f} s"
+            if entry.bytes_out:
+                line += f", {hr.file_size(entry.bytes_out, binary=True)} out"
+            return line
+
+        content = '\n'.join(_line(e) for e in entries) if entries else "No jobs in the history"
+        await ctx.reply(content)
+
+    @commands.command()
+    async def stats(self, ctx: Context, node: str|None=None, days: float|None=None):
+        """Job statistics for the whole grid or one node, optionally over the last few days"""
+        if job_table.history is None:
+            await ctx.reply(":x: Job history isn't being kept")
+            return
+        since = time.time() - days * 86400 if days else None
+        stats = await asyncio.to_thread(job_table.history.stats, node=node, since=since)
+        if not stats.count:
+            await ctx.reply("No jobs in the history")
+            return
+
+        def _percentiles(values: dict[int, float]) -> str:
+            if not values:
+                return "n/a"
+            return ", ".join(f"p{p} {v:.2f} s" for p, v in values.items())
+
+        scope = f"`{node}`" if node else "the grid"
+        lines = [
+            f"**{stats.count}** jobs on {scope}, {stats.succeeded} of {stats.exited} that exited succeeded",
+            f"Start latency: {_percentiles(stats.start_latency)}",
+            f"Runtime: {_percentiles(stats.runtime)}",
+            f"Output: {hr.file_size(stats.bytes_out, binary=True)}",
+        ]
+        await ctx.reply('\n'.join(lines))
+
+
 class AutoRollCallCog(GridMiiCogBase):
     def __init__(self, bot: commands.Bot):
         super().__init__(bot)
         self.auto_roll_call.start()
+        self.heartbeat.change_interval(seconds=Config.PING_INTERVAL_SEC)
+        self.heartbeat.start()
 
     def cog_unload(self) -> None:
         self.auto_roll_call.cancel()
+        self.heartbeat.cancel()
+
+    @tasks.loop(seconds=30)
+    async def heartbeat(self):
+        # queued jobs can't wait forever, even if no node ever frees up
+        admission_queue.expire()
+        # Every node answers a ping with a connect message, which keeps its last-seen time fresh.
+        # A node that stops answering goes stale and stops getting new jobs.
+        if self.mq_client and self.bot.broker_connected.is_set():
+            try:
+                await self.bot.ping_grid()
+            except aiomqtt.MqttError:
+                logging.warning("heartbeat ping failed", exc_info=True)
 
     @tasks.loop(hours=1)
     async def auto_roll_call(self):
@@ -10,15 +10,22 @@ from discord import Message
 from discord.ext.commands import errors, Context
 
 from .config import *
-from .entity import Job, Node, UserPrefs, job_table, node_table
-from .grid_cmd import UserCommandCog, AdminCommandCog, JobControlCog, AutoRollCallCog
+from .entity import EjectedNode, Job, Node, UserPrefs, job_table, node_table
+from .grid_cmd import UserCommandCog, AdminCommandCog, JobControlCog, AutoRollCallCog, HistoryCog
 from .xfer import FileTransferCog
 from .neofetch import NeofetchCog
 from .cmd_denylist import permit_command
+from .dispatch import MqttDispatcher
+from .trace import MqttTracer
+from .job_store import JobStore
+from .history import JobHistory
+from . import metrics
+from .admission import PendingJob, admission_queue
+from .edit_scheduler import edit_scheduler
 from .get_version import GIT_VERSION
 
 
-DEFAULT_COGS = (UserCommandCog, AdminCommandCog, JobControlCog, AutoRollCallCog, FileTransferCog)
+DEFAULT_COGS = (UserCommandCog, AdminCommandCog, JobControlCog, AutoRollCallCog, HistoryCog, FileTransferCog)
 
 ## discord part ##
 
@@ -73,10 +80,25 @@ class GridMiiBot(FlexBot):
         self.target_channel: discord.TextChannel|None = None
         self.mq_client: aiomqtt.Client|None = None
         self.mq_sent = set()
+        self.dispatcher = MqttDispatcher(self.handle_mqtt, self.on_mqtt_error)
+        self.metrics_server: metrics.MetricsServer|None = None
+        self.tracer = MqttTracer()
+        job_table.on_delete = self.on_job_deleted
         self.can_announce = False
 
     async def setup_hook(self) -> None:
         logging.info(f"GridMii bot version {GIT_VERSION}")
+        self.tracer.configure(Config.TRACE_MQTT, Config.TRACE_SAMPLE_EVERY, Config.TRACE_MAX_BYTES)
+        # Pick up the job table from before a restart. This has to happen before any JIDs are handed out.
+        if Config.JOB_STORE_PATH:
+            job_table.attach_store(JobStore(Config.JOB_STORE_PATH))
+        if Config.HISTORY_PATH:
+            job_table.history = JobHistory(Config.HISTORY_PATH)
+        # Serve metrics if asked to
+        if Config.METRICS_PORT:
+            self.install_metrics()
+            self.metrics_server = metrics.MetricsServer()
+            await self.metrics_server.start(Config.METRICS_HOST, Config.METRICS_PORT)
         # Install the MQTT task.
         self.mqtt_task = self.loop.create_task(self.do_mqtt_task())
         # Install the "after broker connection" task"
@@ -123,6 +145,8 @@ class GridMiiBot(FlexBot):
             tls_params = None
 
         await self.wait_until_ready()
+        # reattach jobs that were running before a restart, before their output starts arriving
+        restored = self.restore_jobs()
         logging.info("Starting MQTT task") # helpmii
 
         self.mq_client = aiomqtt.Client(Config.BROKER, Config.PORT,
@@ -138,10 +162,15 @@ class GridMiiBot(FlexBot):
                         await self.mq_client.subscribe(topic, qos=2)
                     # send out a ping to enumerate the nodes
                     await self.ping_grid()
+                    if restored:
+                        # find out which of the restored jobs are really still running
+                        await self.mq_client.publish("grid/roll_call", qos=2)
+                        self.loop.create_task(self.sweep_restored(restored))
+                        restored = []
                     # handle messages
                     logging.info("MQTT ready")
                     async for msg in self.mq_client.messages:
-                        await self.on_mqtt(msg)
+                        self.dispatcher.dispatch(msg)
             except aiomqtt.MqttError:
                 self.broker_connected.clear()
                 reconnect_delay = 3
@@ -156,12 +185,43 @@ class GridMiiBot(FlexBot):
                 if self.target_channel:
                     await self.target_channel.send(f":warning: wii messed up: {str(exc)}")
 
+    async def on_mqtt_error(self, msg: aiomqtt.Message, exc: Exception):
+        """Called by the dispatcher when handling a message raised an exception"""
+        if isinstance(exc, discord.DiscordException):
+            # log discord exceptions
+            logging.exception(f"discord.py exception handling {msg.topic}")
+        elif isinstance(exc, aiomqtt.MqttError):
+            # the MQTT task will notice if the connection is actually gone
+            logging.exception(f"MQTT exception handling {msg.topic}")
+        else:
+            # complain in the target channel about exceptions we don't understand
+            logging.exception(f"Unhandled exception handling {msg.topic}")
+            if self.target_channel:
+                await self.target_channel.send(f":warning: wii messed up: {str(exc)}")
+
     async def ping_grid(self):
+        node_table.ping_sent()
         await self.mq_client.publish("grid/ping", qos=2)
 
+    def install_metrics(self):
+        """Point the scrape-time gauges at the bot's state"""
+        metrics.NODES.set_function(lambda: sum(1 for _ in node_table))
+        metrics.NODE_JOBS.set_function(lambda: {(n.node_name,): n.running_jobs for n in node_table})
+        metrics.JOBS_RUNNING.set_function(lambda: sum(1 for _ in job_table))
+        metrics.QUEUED_JOBS.set_function(lambda: len(admission_queue))
+        metrics.DISPATCH_BACKLOG.set_function(lambda: sum(self.dispatcher.depths().values()))
+
+    async def handle_mqtt(self, msg: aiomqtt.Message):
+        """Times and counts each message on its way to on_mqtt"""
+        kind = metrics.topic_kind(str(msg.topic))
+        metrics.MQTT_MESSAGES.inc(kind=kind)
+        with metrics.MQTT_HANDLE_SECONDS.time(kind=kind):
+            await self.on_mqtt(msg)
+
     async def on_mqtt(self, msg: aiomqtt.Message):
         """MQTT message handler, called once per message"""
-        logging.debug("MQTT %s: %s", str(msg.topic), msg.payload)
+        if self.tracer.enabled:
+            self.tracer.trace(msg)
         topic_path = str(msg.topic).split('/')
 
         if not topic_path:
@@ -172,15 +232,18 @@ class GridMiiBot(FlexBot):
             _, jid, event = topic_path
             jid = int(jid)
             if not job_table.jid_present(jid):
-                logging.warning(f"got message for spurious job {jid}")
+                retired_node = job_table.retired_node(jid)
+                if retired_node is None:
+                    logging.warning(f"got message for spurious job {jid}")
+                elif event == "startup":
+                    # the job was resubmitted elsewhere, so this copy has to go
+                    logging.warning(f"retired job {jid} started late on {retired_node}, killing it")
+                    await self.mq_client.publish(f"{retired_node}/signal/{jid}/9", qos=2)
                 return
             job = job_table.by_jid(jid)
+            node_table.touch(job.target_node)
             match event:
-                case "stdout":
-                    logging.debug(f"got job {jid} stdout: {msg.payload}")
-                    await job.write(msg.payload)
-                case "stderr":
-                    logging.debug(f"got job {jid} stderr: {msg.payload}")
+                case "stdout" | "stderr":
                     await job.write(msg.payload)
                 case "startup":
                     logging.info(f"got job start message for {jid}")
@@ -218,6 +281,7 @@ class GridMiiBot(FlexBot):
                         return
                     node_name: str = decoded["node"]
                     job_list: list[int] = decoded["jobs"]
+                    node_table.touch(node_name)
                     await self.on_roll_call_reply(node_name, job_list)
 
     # end async def on_mqtt
@@ -227,14 +291,23 @@ class GridMiiBot(FlexBot):
             message = json.loads(payload)
             node_name = message["node"]
             node_version = message["version"]
+            # node servers that don't report their capacity get the configured default
+            capacity = message.get("capacity")
         except json.JSONDecodeError:
             # legacy non-JSON
             node_name = payload
             node_version = None
-
-        logging.info(f"node present: {node_name} version {node_version}")
-        node_table.node_seen(node_name, node_version)
-        if self.can_announce:
+            capacity = None
+
+        # nodes answer every ping with a connect message, so only the first one is news
+        is_new = not node_table.node_present(node_name)
+        if is_new:
+            logging.info(f"node present: {node_name} version {node_version}")
+        node = node_table.node_seen(node_name, node_version, capacity)
+        node_table.pong(node)
+        if admission_queue:
+            await admission_queue.drain(self.place_pending, self.launch_pending)
+        if is_new and self.can_announce:
             await self.target_channel.send(f":inbox_tray: Node `{node_name}` is connected")
 
     async def announce_node_gone(self, node_name: str):
@@ -248,7 +321,7 @@ class GridMiiBot(FlexBot):
 
     async def on_roll_call_reply(self, node_name: str, job_list: list[int]):
         # set of jobs that belong to the node
-        node_jobs = {j for j in job_table if j.target_node == node_name}
+        node_jobs = set(job_table.jobs_on_node(node_name))
         # known good jobs
         job_set = {job_table.by_jid(jid) for jid in job_list if job_table.jid_present(jid)}
         # jobs that belong to the node, but are not known good and hence should be abandoned
@@ -271,28 +344,135 @@ class GridMiiBot(FlexBot):
             await ctx.message.reply(":octagonal_sign: That command is not allowed")
             return
 
-        # pick a node
-        # try the user's locus
+        if not node_table.has_nodes():
+            await ctx.message.reply(":x: No nodes are available at the moment.")
+            return
+
         prefs = UserPrefs.get_prefs(ctx.author)
-        node = prefs.locus
-        if node is None or not node.is_present:
-            # locus isn't there, so use our pick logic
-            node = node_table.pick_node()
-            if node is None:
-                await ctx.message.reply(":x: No nodes are available at the moment.")
+        if isinstance(prefs.locus, EjectedNode):
+            # the stub turns the job away, rather than it being queued for a node that will never take it
+            reply = await ctx.message.reply(f"Your job is starting on `{prefs.locus.node_name}`...")
+            await prefs.locus.submit_job(command_string, reply, self.mq_client, output_filter, ctx,
+                                         tty_spec=prefs.tty)
+            return
+        reply = None
+        node = self.place_job(ctx)
+        if node is not None and not admission_queue:
+            # Post the reply that job output will go to
+            reply = await ctx.message.reply(f"Your job is starting on `{node.node_name}`...")
+            # Jobs submitted while the reply was being sent may have taken the last slot on the node
+            if node.is_present and node.can_accept_jobs():
+                await self.launch_job(node, ctx, command_string, reply, output_filter, callback, prefs.tty)
                 return
 
-        # Post the reply that job output will go to
-        reply = await ctx.message.reply(f"Your job is starting on `{node.node_name}`...")
+        # The grid is full, or other jobs are already waiting their turn. Get in line.
+        if reply is None:
+            reply = await ctx.message.reply(":hourglass: The grid is busy. Your job is being queued...")
+        pending = PendingJob(ctx, command_string, reply, output_filter, callback, prefs.tty)
+        if admission_queue.enqueue(pending) is None:
+            await edit_scheduler.edit_now(reply, ":x: The grid is busy and the queue is full. Please try again later.")
+            return
+        await edit_scheduler.edit_now(reply, admission_queue.status(pending))
+        # a slot may have opened up while the reply was being sent
+        await admission_queue.drain(self.place_pending, self.launch_pending)
 
-        # Submit the job
+    @staticmethod
+    def place_job(ctx: Context) -> Node|None:
+        """Pick the node to run a user's job on right now, or None if it has to wait"""
+        # try the user's locus
+        node = UserPrefs.get_prefs(ctx.author).locus
+        if isinstance(node, EjectedNode):
+            # the locus was ejected while the job was queued; it waits until it expires rather than going elsewhere
+            return None
+        if node is None or not node.is_present or node.is_stale:
+            # locus isn't there (or might be dead), so use our pick logic
+            return node_table.pick_node()
+        return node if node.can_accept_jobs() else None
+
+    def place_pending(self, pending: PendingJob) -> Node|None:
+        return self.place_job(pending.ctx)
+
+    async def launch_pending(self, pending: PendingJob, node: Node):
+        wait = time.monotonic() - pending.enqueue_time
+        logging.info(f"dispatching queued job for user {pending.user_id} to {node.node_name} after {wait:.1f} s")
+        # Take the slot before awaiting anything, or a new submission could see the empty queue and get there first.
+        # The startup message replaces the queue status, so there's no need to wait on a "starting" edit.
+        edit_scheduler.cancel(pending.reply)
+        await self.launch_job(node, pending.ctx, pending.command_string, pending.reply,
+                              pending.output_filter, pending.callback, pending.tty_spec)
+
+    async def launch_job(self, node: Node, ctx: Context, command_string: str, reply: discord.Message,
+                         output_filter=None, callback=None, tty_spec: tuple[str,int,int]|None=None):
+        """Submit a job to a node that has room for it, with its output going to `reply`"""
         try:
-            job = await node.submit_job(command_string, reply, self.mq_client, output_filter, ctx, callback, prefs.tty)
-            bot.loop.create_task(job.clean_if_unstarted())
+            job = await node.submit_job(command_string, reply, self.mq_client, output_filter, ctx, callback, tty_spec)
+            self.loop.create_task(job.clean_if_unstarted(failover=self.failover_job))
         except aiomqtt.exceptions.MqttError as ex_mq:
             logging.exception("error publishing job submission")
             await reply.edit(content=f"**Couldn't submit job**: {str(ex_mq)}")
 
+    def restore_jobs(self) -> list[Job]:
+        """Put jobs from the job store back in the job table, pointed at their original output messages"""
+        if job_table.store is None:
+            return []
+        restored = []
+        for record in job_table.store.records():
+            channel = self.get_channel(record.channel_id)
+            if channel is None:
+                logging.warning(f"can't restore job {record.jid}: channel {record.channel_id} is gone")
+                job_table.store.remove(record.jid)
+                continue
+            job = job_table.restore_job(record, channel.get_partial_message(record.message_id))
+            job.output_handler.schedule_edit(f":arrows_counterclockwise: The bot restarted while your job was running "
+                                             f"on `{record.node}`. Output will resume here...")
+            restored.append(job)
+        if restored:
+            logging.info(f"restored {len(restored)} jobs from the job store")
+        return restored
+
+    async def sweep_restored(self, restored: list[Job]):
+        """Abandon restored jobs whose node never came back.
+        Roll call replies take care of the ones whose node is back but no longer has the job."""
+        await asyncio.sleep(Config.START_TIMEOUT_SEC)
+        for job in restored:
+            if job_table.jid_present(job.jid) and job_table.by_jid(job.jid) is job \
+                    and not node_table.node_present(job.target_node):
+                logging.warning(f"restored job {job.jid} is lost, node {job.target_node} didn't come back")
+                await job.abandon(self.mq_client)
+
+    async def failover_job(self, job: Job) -> bool:
+        """Resubmit a job that never started to another node, reusing its output message.
+        Returns False if the job shouldn't or can't be retried."""
+        if job.started or job.attempt > Config.FAILOVER_RETRIES or job.script is None:
+            return False
+        if node_table.node_present(job.target_node):
+            node_table.get_node(job.target_node).mark_suspect()
+        node = node_table.pick_node()
+        if node is None:
+            return False
+
+        # Retire the old JID before anything is awaited. From here on, if the first node starts the job after all,
+        # that copy gets killed instead of the startup being taken as this job's.
+        job_table.retire_job(job.jid)
+        handler = job.output_handler
+        logging.info(f"resubmitting job {job.jid} from {job.target_node} to {node.node_name}")
+        await handler.replace_message(f":repeat: Your job didn't start on `{job.target_node}`, trying `{node.node_name}`...")
+        try:
+            new_job = await node.submit_job(job.script, handler.output_message, self.mq_client, handler.filter,
+                                            handler.ctx, job.callback, job.tty_spec)
+        except aiomqtt.exceptions.MqttError as ex_mq:
+            logging.exception("error publishing job resubmission")
+            await handler.output_message.edit(content=f"**Couldn't submit job**: {str(ex_mq)}")
+            return True
+        new_job.attempt = job.attempt + 1
+        self.loop.create_task(new_job.clean_if_unstarted(failover=self.failover_job))
+        return True
+
+    def on_job_deleted(self, job: Job):
+        """Called when a job leaves the job table. Its slot might let a queued job start."""
+        if admission_queue:
+            self.loop.create_task(admission_queue.drain(self.place_pending, self.launch_pending))
+
     async def stdin_post(self, ctx: Context, job: Job):
         body = ctx.message.content
         body += '\n'
@@ -0,0 +1,126 @@
+# record of finished jobs, for sizing the grid and spotting slow nodes
+import hashlib
+import typing
+
+from .sqlite_store import SqliteStore
+
+
+class HistoryEntry(typing.NamedTuple):
+    """What is remembered about a job once it's gone from the job table"""
+    jid: int
+    user_id: int|None
+    node: str
+    command_hash: str|None
+    submit_time: float              # wall clock
+    start_latency: float|None       # submit -> startup, None if it never started
+    runtime: float|None             # startup -> stopped, None if it never started
+    bytes_out: int
+    outcome: str                    # "exited", "abandoned", "rejected" or "unstarted"
+    exit_status: int|None           # waitpid status, if the job exited
+
+
+class Stats(typing.NamedTuple):
+    count: int
+    exited: int
+    succeeded: int
+    bytes_out: int
+    start_latency: dict[int, float]     # percentile -> seconds
+    runtime: dict[int, float]
+
+
+def command_hash(script: str|None) -> str|None:
+    """Short stable digest of a script, so history can group repeat commands without storing them"""
+    if script is None:
+        return None
+    return hashlib.sha256(script.encode(errors="replace")).hexdigest()[:16]
+
+
+class JobHistory(SqliteStore):
+    """SQLite store of finished jobs"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY,
+            jid INTEGER NOT NULL,
+            user_id INTEGER,
+            node TEXT NOT NULL,
+            command_hash TEXT,
+            submit_time REAL NOT NULL,
+            start_latency REAL,
+            runtime REAL,
+            bytes_out INTEGER NOT NULL,
+            outcome TEXT NOT NULL,
+            exit_status INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS history_user ON history (user_id, submit_time);
+        CREATE INDEX IF NOT EXISTS history_node ON history (node, submit_time);
+        CREATE INDEX IF NOT EXISTS history_time ON history (submit_time);
+        -- percentile lookups walk these instead of sorting
+        CREATE INDEX IF NOT EXISTS history_runtime ON history (runtime);
+        CREATE INDEX IF NOT EXISTS history_start_latency ON history (start_latency);
+        CREATE INDEX IF NOT EXISTS history_node_runtime ON history (node, runtime);
+        CREATE INDEX IF NOT EXISTS history_node_start_latency ON history (node, start_latency);
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def record(self, entry: HistoryEntry):
+        self.write(self._record, entry)
+
+    def _record(self, entry: HistoryEntry):
+        with self.db:
+            self.db.execute("INSERT INTO history (jid, user_id, node, command_hash, submit_time, start_latency, "
+                            "runtime, bytes_out, outcome, exit_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", entry)
+
+    def recent(self, user_id: int|None = None, node: str|None = None, limit: int = 10) -> list[HistoryEntry]:
+        """The most recently submitted jobs, newest first, optionally only those of one user or node"""
+        return self.read(self._recent, user_id, node, limit)
+
+    def _recent(self, user_id: int|None, node: str|None, limit: int) -> list[HistoryEntry]:
+        where, params = self._filter(user_id, node, None)
+        rows = self.db.execute(f"SELECT jid, user_id, node, command_hash, submit_time, start_latency, runtime, "
+                               f"bytes_out, outcome, exit_status FROM history {where} "
+                               f"ORDER BY submit_time DESC LIMIT ?", params + [limit])
+        return [HistoryEntry(*row) for row in rows]
+
+    def stats(self, node: str|None = None, since: float|None = None) -> Stats:
+        """Totals and percentiles over the history, optionally for one node or since a wall clock time"""
+        return self.read(self._stats, node, since)
+
+    def _stats(self, node: str|None, since: float|None) -> Stats:
+        where, params = self._filter(None, node, since)
+        count, exited, succeeded, bytes_out = self.db.execute(
+            f"SELECT count(*), count(exit_status), count(exit_status = 0 OR NULL), total(bytes_out) "
+            f"FROM history {where}", params).fetchone()
+        return Stats(count, exited, succeeded, int(bytes_out),
+                     self._percentiles("start_latency", where, params),
+                     self._percentiles("runtime", where, params))
+
+    def _percentiles(self, column: str, where: str, params: list) -> dict[int, float]:
+        # nearest rank, looked up one row at a time through the column's index
+        where = f"{where} AND {column} IS NOT NULL" if where else f"WHERE {column} IS NOT NULL"
+        [count] = self.db.execute(f"SELECT count(*) FROM history {where}", params).fetchone()
+        result = {}
+        if count == 0:
+            return result
+        for percentile in self.PERCENTILES:
+            rank = max(-(-percentile * count // 100), 1)    # ceiling division
+            [value] = self.db.execute(f"SELECT {column} FROM history {where} ORDER BY {column} LIMIT 1 OFFSET ?",
+                                      params + [rank - 1]).fetchone()
+            result[percentile] = value
+        return result
+
+    @staticmethod
+    def _filter(user_id: int|None, node: str|None, since: float|None) -> tuple[str, list]:
+        clauses, params = [], []
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if node is not None:
+            clauses.append("node = ?")
+            params.append(node)
+        if since is not None:
+            clauses.append("submit_time >= ?")
+            params.append(since)
+        return ("WHERE " + " AND ".join(clauses) if clauses else ""), params
+
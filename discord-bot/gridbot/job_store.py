@@ -0,0 +1,97 @@
+# keeps the job table on disk so running jobs survive a bot restart
+import json
+import sqlite3
+import typing
+
+from .sqlite_store import SqliteStore
+
+
+class JobRecord(typing.NamedTuple):
+    """Everything needed to reattach a running job to its output message"""
+    jid: int
+    node: str
+    channel_id: int
+    message_id: int
+    user_id: int|None
+    tty_spec: tuple[str,int,int]|None
+    script: str|None
+    # wall clock times (time.time()), since monotonic clocks don't carry over a restart
+    submitted_at: float|None = None
+    started_at: float|None = None
+
+
+class JobStore(SqliteStore):
+    """SQLite-backed copy of the job table and the JID counter.
+    Rows are written when a job is created and removed when it leaves the job table."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS jobs (
+            jid INTEGER PRIMARY KEY,
+            node TEXT NOT NULL,
+            channel_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            user_id INTEGER,
+            tty_spec TEXT,
+            script TEXT,
+            submitted_at REAL,
+            started_at REAL
+        );
+    """
+    COLUMNS = "jid, node, channel_id, message_id, user_id, tty_spec, script, submitted_at, started_at"
+
+    def upgrade(self, db: sqlite3.Connection):
+        # stores made before the start times were kept don't have their columns yet
+        columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+        for column in ("submitted_at", "started_at"):
+            if column not in columns:
+                db.execute(f"ALTER TABLE jobs ADD COLUMN {column} REAL")
+
+    def last_jid(self) -> int:
+        """The last JID that was handed out, or 0 for a fresh store"""
+        return self.read(self._last_jid)
+
+    def _last_jid(self) -> int:
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'last_jid'").fetchone()
+        return row[0] if row else 0
+
+    def add(self, record: JobRecord):
+        """Record a new job, and advance the JID counter to it"""
+        self.write(self._add, record)
+
+    def _add(self, record: JobRecord):
+        tty_spec = json.dumps(record.tty_spec) if record.tty_spec else None
+        with self.db:
+            self.db.execute(f"INSERT OR REPLACE INTO jobs ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (record.jid, record.node, record.channel_id, record.message_id, record.user_id,
+                             tty_spec, record.script, record.submitted_at, record.started_at))
+            self.db.execute("INSERT INTO meta VALUES ('last_jid', ?) "
+                            "ON CONFLICT(key) DO UPDATE SET value = max(value, excluded.value)", (record.jid,))
+
+    def set_started(self, jid: int, started_at: float):
+        """Record when a job started running on its node"""
+        self.write(self._set_started, jid, started_at)
+
+    def _set_started(self, jid: int, started_at: float):
+        with self.db:
+            self.db.execute("UPDATE jobs SET started_at = ? WHERE jid = ?", (started_at, jid))
+
+    def remove(self, jid: int):
+        self.write(self._remove, jid)
+
+    def _remove(self, jid: int):
+        with self.db:
+            self.db.execute("DELETE FROM jobs WHERE jid = ?", (jid,))
+
+    def records(self) -> list[JobRecord]:
+        """Every job that was running when the store was last written, oldest first"""
+        return self.read(self._records)
+
+    def _records(self) -> list[JobRecord]:
+        records = []
+        for row in self.db.execute(f"SELECT {self.COLUMNS} FROM jobs ORDER BY jid"):
+            jid, node, channel_id, message_id, user_id, tty_spec, script, submitted_at, started_at = row
+            records.append(JobRecord(jid, node, channel_id, message_id, user_id,
+                                     tuple(json.loads(tty_spec)) if tty_spec else None, script,
+                                     submitted_at, started_at))
+        return records
@@ -0,0 +1,237 @@
+# in-process metrics, served in the Prometheus text exposition format
+import bisect
+import contextlib
+import logging
+import math
+import time
+import typing
+
+from aiohttp import web
+
+LabelValues = tuple[str, ...]
+
+
+class Metric:
+    """Base class for a named metric with optional labels"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: typing.Sequence[str] = (),
+                 registry: "Registry|None" = None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict[str, typing.Any]) -> LabelValues:
+        if labels.keys() != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _label_string(self, values: LabelValues, extra: str = "") -> str:
+        pairs = [f'{name}="{escape(value)}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> typing.Iterator[str]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(f"{line}\n" for line in self.samples())
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield f"{self.name}{self._label_string(key)} {format_value(value)}"
+
+
+class Gauge(Metric):
+    """A value that is read when the metrics are scraped"""
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[LabelValues, float] = {}
+        self._function: typing.Callable[[], float|dict[LabelValues, float]]|None = None
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: typing.Callable[[], float|dict[LabelValues, float]]):
+        """Compute the gauge at scrape time. With labels, the function returns a dict of label values -> value."""
+        self._function = function
+
+    def samples(self):
+        values = self._values
+        if self._function is not None:
+            result = self._function()
+            values = result if isinstance(result, dict) else {(): result}
+        for key, value in values.items():
+            yield f"{self.name}{self._label_string(key)} {format_value(value)}"
+
+
+class Histogram(Metric):
+    """Counts observations into cumulative buckets"""
+    kind = "histogram"
+
+    # seconds, suited to handler and HTTP latencies
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, *args, buckets: typing.Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count in each bucket (not cumulative) + overflow, sum]
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes, in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self):
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = self._label_string(key, f'le="{format_value(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{self._label_string(key)} {format_value(self._sums[key])}"
+            yield f"{self.name}_count{self._label_string(key)} {cumulative}"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Registry:
+    """The set of metrics that get exposed together"""
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def expose(self) -> str:
+        parts = []
+        for metric in self._metrics.values():
+            try:
+                parts.append(metric.expose())
+            except Exception:
+                # one broken gauge function shouldn't take the whole page down
+                logging.exception(f"couldn't collect metric {metric.name}")
+        return "".join(parts)
+
+
+REGISTRY = Registry()
+
+
+class MetricsServer:
+    """Serves a registry at /metrics from the running event loop"""
+
+    def __init__(self, registry: Registry = REGISTRY):
+        self.registry = registry
+        self.runner: web.AppRunner|None = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.expose(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self, host: str, port: int):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logging.info(f"serving metrics on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+# the events GridMiiBot.handle_message knows; anything else a node publishes is counted as "other"
+JOB_EVENTS = frozenset({"stdout", "stderr", "startup", "reject", "stopped"})
+NODE_EVENTS = frozenset({"connect", "disconnect", "announce", "roll_call"})
+
+
+def topic_kind(topic: str) -> str:
+    """Bounded label for an MQTT topic, e.g. "job/12/stdout" -> "job_stdout" """
+    topic_path = topic.split('/')
+    if topic_path[0] == "job" and len(topic_path) == 3 and topic_path[2] in JOB_EVENTS:
+        return f"job_{topic_path[2]}"
+    elif topic_path[0] == "node" and len(topic_path) == 2 and topic_path[1] in NODE_EVENTS:
+        return f"node_{topic_path[1]}"
+    return "other"
+
+
+BYTE_BUCKETS = tuple(4 ** n for n in range(2, 14))      # 16 B to 64 MiB
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+MQTT_MESSAGES = Counter("gridmii_mqtt_messages_total", "MQTT messages handled", ["kind"])
+MQTT_HANDLE_SECONDS = Histogram("gridmii_mqtt_handle_seconds", "Time spent handling an MQTT message", ["kind"])
+DISCORD_EDIT_SECONDS = Histogram("gridmii_discord_edit_seconds", "Latency of output message edits", ["mode"])
+DISCORD_EDIT_ERRORS = Counter("gridmii_discord_edit_errors_total", "Output message edits that failed", ["mode"])
+JOBS_SUBMITTED = Counter("gridmii_jobs_submitted_total", "Jobs submitted to nodes", ["node"])
+JOBS_FINISHED = Counter("gridmii_jobs_finished_total", "Jobs that left the job table", ["outcome"])
+JOB_START_SECONDS = Histogram("gridmii_job_start_seconds", "Time from submitting a job to it starting", [],
+                              buckets=DURATION_BUCKETS)
+JOB_RUNTIME_SECONDS = Histogram("gridmii_job_runtime_seconds", "Time from a job starting to it stopping", [],
+                                buckets=DURATION_BUCKETS)
+JOB_OUTPUT_BYTES = Histogram("gridmii_job_output_bytes", "Bytes of output written by each job", [],
+                             buckets=BYTE_BUCKETS)
+NODES = Gauge("gridmii_nodes", "Nodes in the node table")
+NODE_JOBS = Gauge("gridmii_node_jobs", "Jobs running on each node", ["node"])
+JOBS_RUNNING = Gauge("gridmii_jobs_running", "Jobs in the job table")
+QUEUED_JOBS = Gauge("gridmii_queued_jobs", "Jobs waiting in the admission queue")
+DISPATCH_BACKLOG = Gauge("gridmii_dispatch_backlog", "MQTT messages waiting to be handled")
+RELAY_DOWNLOADS = Counter("gridmii_relay_downloads_total", "Files fetched from the relay for !download", ["outcome"])
+RELAY_DOWNLOAD_BYTES = Counter("gridmii_relay_download_bytes_total", "Bytes fetched from the relay")
+RELAY_DOWNLOAD_SECONDS = Histogram("gridmii_relay_download_seconds", "Time to fetch a file from the relay", [],
+                                   buckets=DURATION_BUCKETS)
+RELAY_PAR_POOL = Counter("gridmii_relay_par_pool_total", "Relay URLs handed out, by whether one was ready",
+                         ["result"])
@@ -0,0 +1,198 @@
+# object storage for the file relay, kept off the event loop
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import logging
+import os
+import secrets
+import threading
+import time
+import typing
+
+from .config import Config
+
+try:
+    import oci
+except ModuleNotFoundError:
+    oci = None
+
+RELAY_BUCKET = "relay_bucket"
+# what the OCI SDK raises when a request fails
+OCI_ERRORS = (oci.exceptions.ServiceError, oci.exceptions.ClientError, oci.exceptions.RequestException) if oci else ()
+
+
+class ObjectStoreError(Exception):
+    """An object storage operation failed or took too long"""
+
+
+class PreauthenticatedRequest(typing.NamedTuple):
+    """A URL that can read and write one object without credentials, until it expires"""
+    id: str
+    object_name: str
+    url: str
+    expires: datetime.datetime
+
+
+class ObjectStore:
+    """Blocking interface to an object store. These methods do network or disk I/O, so the bot only calls them
+    through AsyncObjectStore."""
+
+    def check(self):
+        """Make sure the store is reachable and the relay bucket exists. Raises ObjectStoreError if not."""
+        raise NotImplementedError
+
+    def create_par(self, object_name: str, expires: datetime.datetime) -> PreauthenticatedRequest:
+        raise NotImplementedError
+
+    def delete_par(self, par_id: str):
+        raise NotImplementedError
+
+    def delete_object(self, object_name: str):
+        raise NotImplementedError
+
+
+class OciObjectStore(ObjectStore):
+    """A bucket in Oracle Cloud object storage"""
+
+    def __init__(self, oci_config: dict):
+        self.oci_config = oci_config
+        self.bucket_name = oci_config[RELAY_BUCKET]
+        self.client = oci.object_storage.ObjectStorageClient(oci_config)
+        self.namespace: str|None = None
+
+    @classmethod
+    def from_config_file(cls, path: str|None) -> "OciObjectStore|None":
+        """Load the OCI config. Returns None if OCI isn't installed or configured."""
+        if oci is None or path is None:
+            return None
+        try:
+            cfg = oci.config.from_file(path)
+            oci.config.validate_config(cfg)
+        except oci.exceptions.ClientError as exc:
+            raise ObjectStoreError(f"failed to load OCI config: {exc}") from exc
+        if RELAY_BUCKET not in cfg:
+            logging.warning("please specify `relay_bucket` in the OCI config")
+            return None
+        return cls(cfg)
+
+    def _request(self, method: typing.Callable, *args):
+        try:
+            return method(*args)
+        except oci.exceptions.ServiceError as se:
+            raise ObjectStoreError(f"{se.code}: {se.message}") from se
+        except OCI_ERRORS as exc:
+            raise ObjectStoreError(str(exc)) from exc
+
+    def check(self):
+        self.namespace = self._request(self.client.get_namespace).data
+        # While we're here, let's make sure the OCI bucket actually exists
+        self._request(self.client.get_bucket, self.namespace, self.bucket_name)
+
+    def create_par(self, object_name: str, expires: datetime.datetime) -> PreauthenticatedRequest:
+        par_params = oci.object_storage.models.CreatePreauthenticatedRequestDetails(
+            name="par_" + object_name,
+            object_name=object_name,
+            access_type="ObjectReadWrite",
+            time_expires=expires
+        )
+        par = self._request(self.client.create_preauthenticated_request,
+                            self.namespace, self.bucket_name, par_params).data
+        return PreauthenticatedRequest(par.id, object_name, par.full_path, par.time_expires)
+
+    def delete_par(self, par_id: str):
+        self._request(self.client.delete_preauthenticated_request, self.namespace, self.bucket_name, par_id)
+
+    def delete_object(self, object_name: str):
+        self._request(self.client.delete_object, self.namespace, self.bucket_name, object_name)
+
+
+class FilesystemObjectStore(ObjectStore):
+    """Keeps objects as files in a directory. This backs the local relay, and stands in for a cloud object store in
+    tests and benchmarks. Its URLs only work if something serves the directory at `base_url`, as LocalRelay does.
+    Every call sleeps for `latency` seconds first, to imitate a round trip to the cloud."""
+
+    def __init__(self, root: str, base_url: str = "http://127.0.0.1", latency: float = 0.0):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        self.latency = latency
+        self.pars: dict[str, PreauthenticatedRequest] = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def object_path(self, object_name: str) -> str:
+        if not object_name or "/" in object_name or object_name.startswith("."):
+            raise ObjectStoreError(f"bad object name {object_name!r}")
+        return os.path.join(self.root, object_name)
+
+    def check(self):
+        self._round_trip()
+        if not os.path.isdir(self.root):
+            raise ObjectStoreError(f"{self.root} is not a directory")
+
+    def create_par(self, object_name: str, expires: datetime.datetime) -> PreauthenticatedRequest:
+        self._round_trip()
+        self.object_path(object_name)
+        par_id = secrets.token_urlsafe()
+        par = PreauthenticatedRequest(par_id, object_name, f"{self.base_url}/p/{par_id}/o/{object_name}", expires)
+        with self._lock:
+            self.pars[par_id] = par
+        return par
+
+    def lookup(self, par_id: str) -> PreauthenticatedRequest|None:
+        """The request with this ID, if it exists and hasn't expired"""
+        with self._lock:
+            par = self.pars.get(par_id)
+        if par is None or par.expires <= datetime.datetime.now(datetime.timezone.utc):
+            return None
+        return par
+
+    def delete_par(self, par_id: str):
+        self._round_trip()
+        with self._lock:
+            self.pars.pop(par_id, None)
+
+    def delete_object(self, object_name: str):
+        self._round_trip()
+        try:
+            os.remove(self.object_path(object_name))
+        except FileNotFoundError:
+            pass
+
+
+class AsyncObjectStore:
+    """Runs object store calls on a small pool of threads, so a slow round trip doesn't hold up the event loop.
+    Calls that take longer than `timeout` seconds raise ObjectStoreError. The thread can't be interrupted, so a
+    hung call keeps its worker busy until it returns, but the pool is bounded so they can't pile up forever."""
+
+    def __init__(self, store: ObjectStore, max_workers: int|None = None, timeout: float|None = None):
+        self.store = store
+        self.timeout = timeout if timeout is not None else Config.OBJECT_STORE_TIMEOUT_SEC
+        max_workers = max_workers if max_workers is not None else Config.OBJECT_STORE_THREADS
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="object-store")
+
+    async def call(self, function: typing.Callable, *args):
+        future = asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(function, *args))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except TimeoutError:
+            raise ObjectStoreError(f"{function.__name__} timed out after {self.timeout} s") from None
+
+    async def check(self):
+        await self.call(self.store.check)
+
+    async def create_par(self, object_name: str, expires: datetime.datetime) -> PreauthenticatedRequest:
+        return await self.call(self.store.create_par, object_name, expires)
+
+    async def delete_par(self, par_id: str):
+        await self.call(self.store.delete_par, par_id)
+
+    async def delete_object(self, object_name: str):
+        await self.call(self.store.delete_object, object_name)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
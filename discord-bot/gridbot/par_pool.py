@@ -0,0 +1,106 @@
+# relay URLs made ahead of time, so !download doesn't wait on the cloud
+import asyncio
+import collections
+import datetime
+import logging
+import secrets
+
+from . import metrics
+from .config import Config
+from .object_store import AsyncObjectStore, ObjectStoreError, PreauthenticatedRequest
+
+
+class ParPool:
+    """Keeps up to `size` pre-authenticated requests ready to hand out. A background task tops the pool back up
+    after each one is taken, and throws out the ones with less than `min_remaining` seconds left before they expire,
+    since a download could still be running when they did. Unused requests are deleted when the pool is closed."""
+
+    def __init__(self, store: AsyncObjectStore, size: int|None = None, lifetime: float|None = None,
+                 min_remaining: float|None = None, refill_interval: float|None = None):
+        self.store = store
+        self.size = size if size is not None else Config.PAR_POOL_SIZE
+        self.lifetime = lifetime if lifetime is not None else Config.PAR_LIFETIME_SEC
+        self.min_remaining = min_remaining if min_remaining is not None else Config.PAR_MIN_REMAINING_SEC
+        self.refill_interval = refill_interval if refill_interval is not None else Config.PAR_REFILL_INTERVAL_SEC
+        self._pars: collections.deque[PreauthenticatedRequest] = collections.deque()
+        # stale requests taken out of the pool by `get`, for the refill task to delete
+        self._stale: list[PreauthenticatedRequest] = []
+        self._wanted = asyncio.Event()
+        self._task: asyncio.Task|None = None
+
+    def __len__(self):
+        return len(self._pars)
+
+    @staticmethod
+    def _now() -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def _usable(self, par: PreauthenticatedRequest) -> bool:
+        return (par.expires - self._now()).total_seconds() >= self.min_remaining
+
+    async def create(self) -> PreauthenticatedRequest:
+        """Make a new request for a fresh object name"""
+        expires = self._now() + datetime.timedelta(seconds=self.lifetime)
+        return await self.store.create_par(secrets.token_urlsafe(), expires)
+
+    async def get(self) -> PreauthenticatedRequest:
+        """Take a request from the pool, or make one on the spot if the pool has run dry"""
+        self._wanted.set()
+        while self._pars:
+            par = self._pars.popleft()
+            if self._usable(par):
+                metrics.RELAY_PAR_POOL.inc(result="hit")
+                return par
+            # deleting it is a round trip to the cloud, so leave that to the refill task woken up above
+            self._stale.append(par)
+        metrics.RELAY_PAR_POOL.inc(result="miss")
+        return await self.create()
+
+    async def _discard(self, par: PreauthenticatedRequest):
+        try:
+            await self.store.delete_par(par.id)
+        except ObjectStoreError:
+            logging.exception(f"couldn't delete unused relay request {par.id}")
+
+    async def evict(self):
+        """Delete requests that are about to expire, and the ones `get` passed over"""
+        stale, self._stale = self._stale, []
+        usable = collections.deque()
+        for par in self._pars:
+            (usable if self._usable(par) else stale).append(par)
+        self._pars = usable
+        for par in stale:
+            await self._discard(par)
+
+    async def refill(self):
+        """Evict stale requests, then make new ones until the pool is full"""
+        await self.evict()
+        while len(self._pars) < self.size:
+            self._pars.append(await self.create())
+
+    async def _run(self):
+        while True:
+            self._wanted.clear()
+            try:
+                await self.refill()
+            except ObjectStoreError:
+                # try again next time around
+                logging.exception("couldn't refill the relay request pool")
+            try:
+                await asyncio.wait_for(self._wanted.wait(), self.refill_interval)
+            except TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """Stop refilling and delete the requests nobody used"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stale.extend(self._pars)
+        self._pars.clear()
+        while self._stale:
+            await self._discard(self._stale.pop())
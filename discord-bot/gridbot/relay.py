@@ -0,0 +1,233 @@
+# where files from !download pass through on their way from a node to Discord
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import tempfile
+import time
+import typing
+
+import aiohttp
+from aiohttp import web
+
+from . import metrics
+from .config import Config
+from .object_store import (AsyncObjectStore, FilesystemObjectStore, ObjectStore, ObjectStoreError, OciObjectStore,
+                           PreauthenticatedRequest)
+from .par_pool import ParPool
+
+
+class RelayError(Exception):
+    """A file couldn't be fetched from the relay. The message is meant for the user;
+    `outcome` labels the failure in the metrics."""
+    def __init__(self, message: str, outcome: str = "error"):
+        super().__init__(message)
+        self.outcome = outcome
+
+
+class RelayBackend:
+    """A place nodes can upload a file to with a plain HTTP PUT, and the bot can fetch it back from"""
+
+    async def start(self):
+        """Get ready to hand out URLs. Raises ObjectStoreError or OSError if the relay can't be used."""
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    async def upload_url(self) -> PreauthenticatedRequest:
+        """A URL for the node to PUT the file to"""
+        raise NotImplementedError
+
+    async def fetch(self, par: PreauthenticatedRequest, cap: int|None = None) -> typing.BinaryIO:
+        """Return the uploaded file, rewound. Raises RelayError if it can't be fetched or is bigger than `cap` bytes."""
+        raise NotImplementedError
+
+    async def delete(self, par: PreauthenticatedRequest):
+        """Throw away the uploaded file and its URL. Errors are logged, not raised."""
+        raise NotImplementedError
+
+
+class ObjectStoreRelay(RelayBackend):
+    """Relays files through an object store bucket, using pre-authenticated requests as the URLs"""
+
+    # chunks are read from the relay this many bytes at a time
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, store: ObjectStore):
+        self.store = AsyncObjectStore(store)
+        self.par_pool = ParPool(self.store)
+        self._session: aiohttp.ClientSession|None = None
+
+    async def start(self):
+        await self.store.check()
+        if self.par_pool.size > 0:
+            self.par_pool.start()
+
+    async def close(self):
+        await self.par_pool.close()
+        self.store.close()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """HTTP session shared by every download, so connections to the relay are reused.
+        It's created on first use because it has to be made inside the running event loop."""
+        if self._session is None or self._session.closed:
+            timeout = aiohttp.ClientTimeout(total=Config.DOWNLOAD_TIMEOUT_SEC)
+            self._session = aiohttp.ClientSession(timeout=timeout)
+        return self._session
+
+    async def upload_url(self) -> PreauthenticatedRequest:
+        return await self.par_pool.get()
+
+    async def fetch(self, par: PreauthenticatedRequest, cap: int|None = None) -> typing.BinaryIO:
+        """Stream the file into a temporary file. Small files stay in memory; larger ones go to disk."""
+        cap = cap if cap is not None else Config.DOWNLOAD_CAP_BYTES
+        body = tempfile.SpooledTemporaryFile(max_size=Config.SPOOL_HEAD_BYTES, prefix="gridmii-download-")
+        start = time.monotonic()
+        size = 0
+        try:
+            try:
+                async with self.session.get(par.url) as response:
+                    if response.status != 200:
+                        logging.error(f"HTTP {response.status} fetching {par.object_name} from the relay")
+                        raise RelayError(f"HTTP {response.status}", "http_error")
+                    if response.content_length is not None and response.content_length > cap:
+                        raise RelayError(f"the file is larger than {cap} bytes", "too_large")
+                    async for chunk in response.content.iter_chunked(self.CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > cap:
+                            raise RelayError(f"the file is larger than {cap} bytes", "too_large")
+                        body.write(chunk)
+            except (aiohttp.ClientError, TimeoutError) as exc:
+                raise RelayError(str(exc) or type(exc).__name__) from exc
+        except RelayError as exc:
+            body.close()
+            metrics.RELAY_DOWNLOADS.inc(outcome=exc.outcome)
+            raise
+        record_download(size, start)
+        body.seek(0)
+        return body
+
+    async def delete(self, par: PreauthenticatedRequest):
+        try:
+            await self.store.delete_object(par.object_name)
+            await self.store.delete_par(par.id)
+        except ObjectStoreError:
+            logging.exception(f"couldn't clean up relay object {par.object_name}")
+
+
+class LocalRelay(ObjectStoreRelay):
+    """The bot is the relay. Nodes upload to an HTTP server in the bot, which keeps the files in a directory,
+    and the bot reads them straight off the disk. There's no cloud hop and no egress to pay for."""
+
+    def __init__(self, root: str, host: str, port: int, public_url: str):
+        self.files = FilesystemObjectStore(root, public_url)
+        super().__init__(self.files)
+        self.host = host
+        self.port = port
+        self.runner: web.AppRunner|None = None
+
+    async def start(self):
+        await super().start()
+        app = web.Application()
+        app.router.add_put("/p/{par_id}/o/{object_name}", self.handle_put)
+        app.router.add_get("/p/{par_id}/o/{object_name}", self.handle_get)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logging.info(f"relaying files at {self.files.base_url}, listening on {self.host}:{self.port}")
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+        await super().close()
+
+    def _object_path(self, request: web.Request) -> str:
+        """Path of the object a request is for, if the request's URL is valid"""
+        par = self.files.lookup(request.match_info["par_id"])
+        if par is None or par.object_name != request.match_info["object_name"]:
+            raise web.HTTPNotFound()
+        return self.files.object_path(par.object_name)
+
+    async def handle_put(self, request: web.Request) -> web.Response:
+        path = self._object_path(request)
+        cap = Config.DOWNLOAD_CAP_BYTES
+        if request.content_length is not None and request.content_length > cap:
+            raise web.HTTPRequestEntityTooLarge(max_size=cap, actual_size=request.content_length)
+        # write under a temporary name, so a half-uploaded file is never fetched
+        partial = f"{path}.{secrets.token_hex(4)}.part"
+        size = 0
+        # the disk is only touched from a worker thread, so a slow disk doesn't hold up the event loop
+        f = await asyncio.to_thread(open, partial, "wb")
+        try:
+            try:
+                async for chunk in request.content.iter_chunked(self.CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > cap:
+                        raise web.HTTPRequestEntityTooLarge(max_size=cap, actual_size=size)
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.replace, partial, path)
+        finally:
+            await asyncio.to_thread(self._remove_partial, partial)
+        return web.Response(text="OK\n")
+
+    @staticmethod
+    def _remove_partial(partial: str):
+        try:
+            os.remove(partial)
+        except FileNotFoundError:
+            pass
+
+    async def handle_get(self, request: web.Request) -> web.StreamResponse:
+        path = self._object_path(request)
+        if not os.path.exists(path):
+            raise web.HTTPNotFound()
+        return web.FileResponse(path)
+
+    async def fetch(self, par: PreauthenticatedRequest, cap: int|None = None) -> typing.BinaryIO:
+        """Open the uploaded file where it lies"""
+        cap = cap if cap is not None else Config.DOWNLOAD_CAP_BYTES
+        start = time.monotonic()
+        try:
+            path = self.files.object_path(par.object_name)
+            body = await asyncio.get_running_loop().run_in_executor(None, open, path, "rb")
+        except (FileNotFoundError, ObjectStoreError):
+            metrics.RELAY_DOWNLOADS.inc(outcome="http_error")
+            raise RelayError("the file never arrived", "http_error")
+        size = os.fstat(body.fileno()).st_size
+        if size > cap:
+            body.close()
+            metrics.RELAY_DOWNLOADS.inc(outcome="too_large")
+            raise RelayError(f"the file is larger than {cap} bytes", "too_large")
+        record_download(size, start)
+        return body
+
+
+def record_download(size: int, start: float):
+    metrics.RELAY_DOWNLOADS.inc(outcome="ok")
+    metrics.RELAY_DOWNLOAD_BYTES.inc(size)
+    metrics.RELAY_DOWNLOAD_SECONDS.observe(time.monotonic() - start)
+
+
+def make_relay() -> RelayBackend|None:
+    """Set up the relay backend named in the config. Returns None if it isn't configured."""
+    match Config.RELAY_BACKEND:
+        case "oci":
+            store = OciObjectStore.from_config_file(Config.OCI_CONFIG_FILE)
+            if store is None:
+                return None
+            logging.info(f"Using OCI object bucket {store.bucket_name} as the file relay")
+            return ObjectStoreRelay(store)
+        case "local":
+            public_url = Config.RELAY_URL or f"http://{socket.getfqdn()}:{Config.RELAY_PORT}"
+            return LocalRelay(Config.RELAY_DIR, Config.RELAY_HOST, Config.RELAY_PORT, public_url)
+        case other:
+            raise ValueError(f"unknown relay backend {other!r}")
@@ -0,0 +1,95 @@
+# node selection policies for new jobs
+import random
+import typing
+
+
+class SchedulableNode(typing.Protocol):
+    """What a policy needs to know about a node. `Node` satisfies this, and so can a simulated node in a test."""
+    node_name: str
+    capacity: int
+    startup_latency: float|None
+
+    @property
+    def running_jobs(self) -> int: ...
+
+    def can_accept_jobs(self) -> bool: ...
+
+
+N = typing.TypeVar("N", bound=SchedulableNode)
+
+
+class SchedulingPolicy:
+    """Picks one node out of the nodes that can accept a job.
+    Subclasses implement `choose`; the candidates passed to it all have room for another job."""
+
+    name = "base"
+
+    def choose(self, candidates: typing.Sequence[N]) -> N|None:
+        raise NotImplementedError
+
+    @staticmethod
+    def score(node: SchedulableNode) -> tuple[float, float]:
+        """Sort key for a node, lower is better: the fraction of its capacity in use,
+        then how long jobs have recently taken to start on it"""
+        load = node.running_jobs / node.capacity if node.capacity > 0 else 1.0
+        latency = node.startup_latency if node.startup_latency is not None else 0.0
+        return load, latency
+
+
+class LeastLoadedPolicy(SchedulingPolicy):
+    """Always picks the node with the lowest score. Ties go to the node that joined the grid first."""
+
+    name = "least-loaded"
+
+    def choose(self, candidates: typing.Sequence[N]) -> N|None:
+        if not candidates:
+            return None
+        return min(candidates, key=self.score)
+
+
+class PowerOfTwoPolicy(SchedulingPolicy):
+    """Samples two nodes at random and picks the better of them.
+    This spreads bursts of jobs out even when the load figures are a little stale."""
+
+    name = "power-of-two"
+
+    def __init__(self, rng: random.Random|None = None):
+        self.rng = rng if rng is not None else random.Random()
+
+    def choose(self, candidates: typing.Sequence[N]) -> N|None:
+        if len(candidates) <= 2:
+            return min(candidates, key=self.score, default=None)
+        return min(self.rng.sample(candidates, 2), key=self.score)
+
+
+class StickyPolicy(SchedulingPolicy):
+    """Keeps using the last node it picked for as long as that node can take jobs.
+    This was the original behavior of `NodeTable.pick_node`."""
+
+    name = "sticky"
+
+    def __init__(self, fallback: SchedulingPolicy|None = None):
+        self.fallback = fallback if fallback is not None else LeastLoadedPolicy()
+        self.last_node: str|None = None
+
+    def choose(self, candidates: typing.Sequence[N]) -> N|None:
+        for node in candidates:
+            if node.node_name == self.last_node:
+                return node
+        node = self.fallback.choose(candidates)
+        if node is not None:
+            self.last_node = node.node_name
+        return node
+
+
+POLICIES: dict[str, type[SchedulingPolicy]] = {
+    policy.name: policy for policy in (LeastLoadedPolicy, PowerOfTwoPolicy, StickyPolicy)
+}
+
+
+def make_policy(name: str) -> SchedulingPolicy:
+    """Instantiate a policy by name, or throw ValueError if there is no such policy"""
+    try:
+        return POLICIES[name]()
+    except KeyError:
+        raise ValueError(f"unknown scheduling policy {name!r}, expected one of {', '.join(POLICIES)}") from None
@@ -0,0 +1,110 @@
+# bounded-memory storage for job output
+import contextlib
+import io
+import mmap
+import tempfile
+import typing
+
+from .config import Config
+
+
+class OutputSpool:
+    """Byte buffer for job output.
+    The first `head_size` bytes are kept in RAM. Once the output outgrows that, everything is spilled to an
+    anonymous temporary file and only the last `tail_size` bytes are kept in RAM alongside the head.
+    Writes past the per-job cap, or past the cap shared by every live spool, are dropped and counted."""
+
+    # bytes held by all spools that haven't been closed yet
+    global_bytes = 0
+
+    def __init__(self, head_size: int|None = None, tail_size: int|None = None,
+                 job_cap: int|None = None, global_cap: int|None = None):
+        self.head_size = head_size if head_size is not None else Config.SPOOL_HEAD_BYTES
+        self.tail_size = tail_size if tail_size is not None else Config.SPOOL_TAIL_BYTES
+        self.job_cap = job_cap if job_cap is not None else Config.JOB_OUTPUT_CAP
+        self.global_cap = global_cap if global_cap is not None else Config.GLOBAL_OUTPUT_CAP
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.spill: typing.BinaryIO|None = None
+        self.size = 0
+        self.dropped = 0
+        self.closed = False
+
+    @property
+    def spilled(self) -> bool:
+        """True if the output has been moved to disk"""
+        return self.spill is not None
+
+    def write(self, data: bytes) -> int:
+        """Append data to the spool. Returns how many bytes were kept."""
+        if self.closed:
+            raise ValueError("write to closed spool")
+        room = min(self.job_cap - self.size, self.global_cap - OutputSpool.global_bytes)
+        if room < len(data):
+            room = max(room, 0)
+            self.dropped += len(data) - room
+            data = data[:room]
+        if not data:
+            return 0
+
+        if self.spill is None and self.size + len(data) <= self.head_size:
+            self.head += data
+        else:
+            if self.spill is None:
+                self.spill = tempfile.TemporaryFile(prefix="gridmii-spool-")
+                self.spill.write(self.head)
+                self.tail += self.head
+            self.spill.write(data)
+            self.tail += data
+            if len(self.tail) > self.tail_size:
+                del self.tail[:len(self.tail) - self.tail_size]
+
+        self.size += len(data)
+        OutputSpool.global_bytes += len(data)
+        return len(data)
+
+    @contextlib.contextmanager
+    def mapped(self) -> typing.Iterator[memoryview]:
+        """Read-only view of everything in the spool. Spilled output is memory-mapped rather than read in."""
+        if self.spill is None:
+            with memoryview(self.head) as view:
+                yield view
+            return
+        self.spill.flush()
+        with mmap.mmap(self.spill.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                yield view
+
+    def getvalue(self) -> bytes:
+        """Everything in the spool, as one bytes object. Prefer `mapped` for large output."""
+        with self.mapped() as view:
+            return bytes(view)
+
+    def tail_bytes(self, count: int) -> bytes:
+        """The last `count` bytes of the spool"""
+        if self.spill is None:
+            return bytes(self.head[-count:])
+        elif count <= len(self.tail):
+            return bytes(self.tail[-count:])
+        with self.mapped() as view:
+            return bytes(view[-count:])
+
+    def open_for_read(self) -> typing.BinaryIO:
+        """File object positioned at the start of the output, suitable for `discord.File`.
+        Spilled output is streamed from the spill file, so the spool must not be written to afterward."""
+        if self.spill is None:
+            return io.BytesIO(self.head)
+        self.spill.flush()
+        self.spill.seek(0)
+        return self.spill
+
+    def close(self):
+        """Discard the spool and release its share of the global cap"""
+        if self.closed:
+            return
+        self.closed = True
+        OutputSpool.global_bytes -= self.size
+        if self.spill is not None:
+            self.spill.close()
+        self.head = bytearray()
+        self.tail = bytearray()
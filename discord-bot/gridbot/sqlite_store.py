@@ -0,0 +1,56 @@
+# SQLite databases worked on by a thread of their own, so the event loop doesn't wait on the disk
+import concurrent.futures
+import logging
+import sqlite3
+import typing
+
+
+class SqliteStore:
+    """A SQLite database whose statements all run, in order, on one worker thread.
+    Writes are queued and return straight away; reads wait for the writes queued before them."""
+
+    SCHEMA = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.closed = False
+        self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=type(self).__name__)
+        self.db: sqlite3.Connection = self.read(self._open)
+
+    def _open(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path)
+        # WAL keeps the file consistent if we crash, and NORMAL keeps commits cheap
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(self.SCHEMA)
+        self.upgrade(db)
+        db.commit()
+        return db
+
+    def upgrade(self, db: sqlite3.Connection):
+        """Bring a database made by an older version up to date. Runs after the schema is applied."""
+        pass
+
+    def write(self, function: typing.Callable, *args) -> concurrent.futures.Future:
+        """Queue `function(*args)` to run on the worker thread. Errors are logged, not raised."""
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(self._log_error)
+        return future
+
+    def read(self, function: typing.Callable, *args):
+        """Run `function(*args)` on the worker thread and wait for its result.
+        This blocks, so from the event loop, call it with asyncio.to_thread."""
+        return self.executor.submit(function, *args).result()
+
+    @staticmethod
+    def _log_error(future: concurrent.futures.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error("database write failed", exc_info=future.exception())
+
+    def close(self):
+        """Finish the queued writes and close the database"""
+        if self.closed:
+            return
+        self.read(self.db.close)
+        self.executor.shutdown()
+        self.closed = True
@@ -0,0 +1,187 @@
+import asyncio
+import unittest
+import unittest.mock as mock
+
+from ..admission import AdmissionQueue, PendingJob
+from ..entity import EjectedNode, JobTable, NodeTable, UserPrefs
+from ..gridbot import GridMiiBot, bot_intents
+from .simulacra import *
+
+
+def pending_for(user_id: int, command: str = "true") -> PendingJob:
+    ctx = mock_context()
+    ctx.author.id = user_id
+    return PendingJob(ctx, command, mock_message())
+
+
+class AdmissionQueueTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = mock.patch("gridbot.admission.edit_scheduler")
+        self.edit_scheduler = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_round_robin_order(self):
+        queue = AdmissionQueue(limit=10, per_user_limit=5)
+        a1, a2, a3 = pending_for(1), pending_for(1), pending_for(1)
+        b1 = pending_for(2)
+        c1, c2 = pending_for(3), pending_for(3)
+        for pending in (a1, a2, a3, b1, c1, c2):
+            queue.enqueue(pending)
+        self.assertEqual(list(queue), [a1, b1, c1, a2, c2, a3])
+        self.assertEqual([p.position for p in (a1, b1, c1, a2, c2, a3)], [1, 2, 3, 4, 5, 6])
+
+    def test_limits(self):
+        queue = AdmissionQueue(limit=3, per_user_limit=2)
+        self.assertEqual(queue.enqueue(pending_for(1)), 1)
+        self.assertEqual(queue.enqueue(pending_for(1)), 2)
+        self.assertIsNone(queue.enqueue(pending_for(1)))
+        self.assertEqual(queue.enqueue(pending_for(2)), 2)
+        self.assertIsNone(queue.enqueue(pending_for(3)))
+        self.assertEqual(len(queue), 3)
+
+    async def test_drain(self):
+        queue = AdmissionQueue(limit=10, per_user_limit=5)
+        a1, a2, b1 = pending_for(1), pending_for(1), pending_for(2)
+        for pending in (a1, a2, b1):
+            queue.enqueue(pending)
+        slots = 2
+        launched = []
+        def place(pending):
+            return "node" if slots - len(launched) > 0 else None
+        async def launch(pending, node):
+            launched.append(pending)
+        await queue.drain(place, launch)
+        self.assertEqual(launched, [a1, b1])
+        self.assertEqual(list(queue), [a2])
+        self.assertEqual(a2.position, 1)
+        self.edit_scheduler.submit.assert_called_once_with(a2.reply, queue.status(a2))
+
+    async def test_blocked_job_passed_over(self):
+        queue = AdmissionQueue(limit=10, per_user_limit=5)
+        pinned, free = pending_for(1, "pinned"), pending_for(2, "free")
+        queue.enqueue(pinned)
+        queue.enqueue(free)
+        launched = []
+        def place(pending):
+            return None if pending.command_string == "pinned" else "node"
+        async def launch(pending, node):
+            launched.append(pending)
+        await queue.drain(place, launch)
+        self.assertEqual(launched, [free])
+        self.assertEqual(list(queue), [pinned])
+
+    async def test_users_take_turns(self):
+        queue = AdmissionQueue(limit=10, per_user_limit=5)
+        a1, a2, b1, b2 = pending_for(1), pending_for(1), pending_for(2), pending_for(2)
+        for pending in (a1, a2, b1, b2):
+            queue.enqueue(pending)
+        launched = []
+        async def launch(pending, node):
+            launched.append(pending)
+        # one slot frees up at a time
+        for _ in range(4):
+            budget = [1]
+            def place(pending):
+                if budget[0]:
+                    budget[0] -= 1
+                    return "node"
+                return None
+            await queue.drain(place, launch)
+        self.assertEqual(launched, [a1, b1, a2, b2])
+        self.assertEqual(len(queue), 0)
+
+    async def test_expiry(self):
+        queue = AdmissionQueue(limit=10, per_user_limit=5, timeout=60)
+        old, new = pending_for(1), pending_for(2)
+        queue.enqueue(old)
+        queue.enqueue(new)
+        old.enqueue_time -= 61
+        launched = []
+        async def launch(pending, node):
+            launched.append(pending)
+        await queue.drain(lambda pending: None, launch)
+        self.assertEqual(list(queue), [new])
+        self.assertEqual(new.position, 1)
+        self.edit_scheduler.submit.assert_any_call(new.reply, queue.status(new))
+        expired_content = self.edit_scheduler.submit.call_args_list[0].args
+        self.assertIs(expired_content[0], old.reply)
+        self.assertIn("waited too long", expired_content[1])
+        self.assertEqual(queue.expire(), [])
+
+
+class SubmitTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.jobs = JobTable()
+        self.nodes = NodeTable()
+        self.queue = AdmissionQueue(limit=10, per_user_limit=5)
+        for patcher in (mock.patch("gridbot.entity.job_table", self.jobs),
+                        mock.patch("gridbot.entity.node_table", self.nodes),
+                        mock.patch("gridbot.gridbot.job_table", self.jobs),
+                        mock.patch("gridbot.gridbot.node_table", self.nodes),
+                        mock.patch("gridbot.gridbot.admission_queue", self.queue),
+                        mock.patch("gridbot.gridbot.edit_scheduler", mock.AsyncMock()),
+                        mock.patch("gridbot.admission.edit_scheduler")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.bot = GridMiiBot(intents=bot_intents)
+        self.bot.loop = mock.Mock()
+        self.bot.mq_client = mock_mqtt()
+        self.nodes.node_seen("hal", "test", capacity=1)
+
+    async def test_concurrent_submissions(self):
+        # both submissions pick the node before either reply has been sent
+        async def slow_reply(content):
+            await asyncio.sleep(0)
+            return mock_message()
+        contexts = [mock_context(), mock_context()]
+        for user_id, ctx in enumerate(contexts):
+            ctx.author.id = user_id
+            ctx.message.reply = slow_reply
+        await asyncio.gather(*(self.bot.submit_job(ctx, "true") for ctx in contexts))
+        self.assertEqual(len(self.jobs.jobs_on_node("hal")), 1)
+        self.assertEqual(len(self.queue), 1)
+        self.bot.mq_client.publish.assert_called_once()
+        self.bot.loop.create_task.call_args.args[0].close()
+
+    async def test_queued_job_keeps_its_turn(self):
+        # a new submission arrives while the queued job is being launched and the edit budget is spent
+        running = self.jobs.new_job(mock_message(), "hal")
+        queued = pending_for(1)
+        self.queue.enqueue(queued)
+        release = asyncio.Event()
+        async def slow_edit(message, content):
+            await release.wait()
+        newcomer = mock_context()
+        newcomer.author.id = 2
+        with mock.patch("gridbot.gridbot.edit_scheduler", mock.Mock(edit_now=slow_edit)):
+            # the finished job frees the slot and drains the queue
+            self.jobs.delete_job(running.jid)
+            drain = asyncio.create_task(self.bot.loop.create_task.call_args.args[0])
+            submit = asyncio.create_task(self.bot.submit_job(newcomer, "true"))
+            await asyncio.sleep(0.01)
+            release.set()
+            await asyncio.wait_for(asyncio.gather(drain, submit), 1.0)
+        [job] = self.jobs.jobs_on_node("hal")
+        self.assertIs(job.output_handler.output_message, queued.reply)
+        self.assertEqual([pending.user_id for pending in self.queue], [2])
+        self.bot.mq_client.publish.assert_called_once()
+        self.bot.loop.create_task.call_args.args[0].close()
+
+    async def test_ejected_locus_refused(self):
+        ctx = mock_context()
+        ctx.author.id = 42
+        prefs = UserPrefs.get_prefs(ctx.author)
+        prefs.locus = "hal"
+        self.addCleanup(setattr, prefs, "locus", None)
+        self.nodes._table["hal"] = EjectedNode.from_node(self.nodes.get_node("hal"))
+        self.nodes.node_seen("dave", "test", capacity=1)
+        await self.bot.submit_job(ctx, "true")
+        reply = ctx.message.reply.return_value
+        self.assertIn("has been ejected", reply.edit.call_args.kwargs["content"])
+        self.assertEqual(len(self.queue), 0)
+        self.assertFalse(self.jobs.has_jobs())
+        self.bot.mq_client.publish.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
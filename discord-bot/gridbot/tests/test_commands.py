@@ -3,7 +3,7 @@ import unittest.mock as mock
 
 from ..config import Config
 from ..grid_cmd import UserCommandCog, GridMiiCogBase
-from ..entity import NodeTable, JobTable
+from ..entity import NodeTable, JobTable, UserPrefs
 from .simulacra import *
 
 
@@ -34,7 +34,7 @@ class UserCommandTest(unittest.IsolatedAsyncioTestCase):
     async def test_nodes_nonempty(self):
         NAMES = ("node1", "node2", "node3")
         VERSION = "unit-test"
-        EXPECTED = '\n'.join(f"* {n} (version {VERSION})" for n in NAMES)
+        EXPECTED = '\n'.join(f"* {n} (version {VERSION}): 0/4 jobs" for n in NAMES)
         table = NodeTable()
         for name in NAMES:
             table.node_seen(name, VERSION)
@@ -44,6 +44,17 @@ class UserCommandTest(unittest.IsolatedAsyncioTestCase):
             await cog.nodes(cog, ctx)
             ctx.reply.assert_called_with(EXPECTED)
 
+    async def test_nodes_latency(self):
+        table = NodeTable()
+        node = table.node_seen("node1", "unit-test")
+        node.record_startup(0.5)
+        node.ping_rtt = 0.042
+        cog = self.cog()
+        ctx = mock_context()
+        with mock.patch("gridbot.grid_cmd.node_table", table):
+            await cog.nodes(cog, ctx)
+            ctx.reply.assert_called_with("* node1 (version unit-test): 0/4 jobs, starts in 0.50 s (p95 0.50 s), ping 42 ms")
+
     @unittest.expectedFailure
     async def test_locus_read_unset(self):
         self.assertTrue(None, "need to rewrite UserPrefs to support easier injection")
@@ -80,6 +91,31 @@ class UserCommandTest(unittest.IsolatedAsyncioTestCase):
             await cog.jobs(cog, ctx)
             ctx.reply.assert_called()
 
+    async def test_jobs_mine(self):
+        cog = self.cog()
+        ctx, other_ctx = mock_context(), mock_context()
+        table = JobTable()
+        table.new_job(mock_message(), "dummy-node", ctx=other_ctx)
+        with mock.patch("gridbot.grid_cmd.job_table", table):
+            await cog.jobs(cog, ctx, "mine")
+            ctx.reply.assert_called_with("No jobs running")
+            table.new_job(mock_message(), "dummy-node", ctx=ctx)
+            await cog.jobs(cog, ctx, "mine")
+            self.assertIn("#2", ctx.reply.call_args.args[0])
+            self.assertNotIn("#1", ctx.reply.call_args.args[0])
+
+    async def test_term_bad_size(self):
+        cog = self.cog()
+        ctx = mock_context()
+        prefs = UserPrefs.get_prefs(ctx.author)
+        self.addCleanup(setattr, prefs, "tty", None)
+        for columns, lines in ((0, 20), (40, -1), (100_000, 20)):
+            await cog.term(cog, ctx, "xterm", columns, lines)
+            self.assertIn(":x:", ctx.reply.call_args.args[0])
+            self.assertIsNone(prefs.tty)
+        await cog.term(cog, ctx, "xterm", 1, 1)
+        self.assertEqual(prefs.tty, ("xterm", 1, 1))
+
     @unittest.expectedFailure
     async def test_rules(self):
         self.assertTrue(None, "TODO")
@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+import unittest.mock as mock
+
+from ..dispatch import MqttDispatcher
+
+
+def fake_message(topic: str, payload: bytes = b''):
+    return mock.Mock(topic=topic, payload=payload)
+
+
+class LaneTests(unittest.TestCase):
+    def test_lane_for(self):
+        self.assertEqual(MqttDispatcher.lane_for("job/12/stdout"), 12)
+        self.assertEqual(MqttDispatcher.lane_for("job/12/stopped"), 12)
+        self.assertEqual(MqttDispatcher.lane_for("node/connect"), MqttDispatcher.NODE_LANE)
+        self.assertEqual(MqttDispatcher.lane_for("job/spam/stdout"), MqttDispatcher.MISC_LANE)
+        self.assertEqual(MqttDispatcher.lane_for("grid/ping"), MqttDispatcher.MISC_LANE)
+
+
+class DispatcherTests(unittest.IsolatedAsyncioTestCase):
+    async def test_per_job_ordering(self):
+        seen = []
+        async def handler(msg):
+            await asyncio.sleep(0)
+            seen.append((msg.topic, msg.payload))
+        dispatcher = MqttDispatcher(handler)
+        for i in range(10):
+            dispatcher.dispatch(fake_message("job/1/stdout", bytes([i])))
+            dispatcher.dispatch(fake_message("job/2/stdout", bytes([i])))
+        await dispatcher.join()
+        for jid in (1, 2):
+            payloads = [p for t, p in seen if t == f"job/{jid}/stdout"]
+            self.assertEqual(payloads, [bytes([i]) for i in range(10)])
+        self.assertEqual(dispatcher.depths(), {})
+
+    async def test_slow_job_does_not_block_others(self):
+        release = asyncio.Event()
+        handled = []
+        async def handler(msg):
+            if msg.topic == "job/1/stdout":
+                await release.wait()
+            handled.append(msg.topic)
+        dispatcher = MqttDispatcher(handler)
+        dispatcher.dispatch(fake_message("job/1/stdout"))
+        dispatcher.dispatch(fake_message("job/1/stopped"))
+        dispatcher.dispatch(fake_message("job/2/stdout"))
+        dispatcher.dispatch(fake_message("node/connect"))
+        await asyncio.sleep(0.01)
+        self.assertEqual(set(handled), {"job/2/stdout", "node/connect"})
+        self.assertEqual(dispatcher.depths(), {1: 2})
+        release.set()
+        await dispatcher.join()
+        self.assertEqual(handled[-2:], ["job/1/stdout", "job/1/stopped"])
+
+    async def test_error_handler(self):
+        async def handler(msg):
+            raise ValueError(msg.topic)
+        errors = []
+        async def error_handler(msg, exc):
+            errors.append(exc)
+        dispatcher = MqttDispatcher(handler, error_handler)
+        dispatcher.dispatch(fake_message("job/1/stdout"))
+        dispatcher.dispatch(fake_message("job/1/stopped"))
+        await dispatcher.join()
+        self.assertEqual(len(errors), 2)
+        self.assertIsInstance(errors[0], ValueError)
+
+    async def test_failing_error_handler(self):
+        # a lane keeps going even if reporting an error fails
+        handled = []
+        async def handler(msg):
+            handled.append(msg.topic)
+            raise ValueError(msg.topic)
+        async def error_handler(msg, exc):
+            raise RuntimeError("can't report")
+        dispatcher = MqttDispatcher(handler, error_handler)
+        dispatcher.dispatch(fake_message("job/1/stdout"))
+        dispatcher.dispatch(fake_message("job/1/stopped"))
+        with self.assertLogs(level="ERROR"):
+            await dispatcher.join()
+        self.assertEqual(handled, ["job/1/stdout", "job/1/stopped"])
+
+
+if __name__ == '__main__':
+    unittest.main()
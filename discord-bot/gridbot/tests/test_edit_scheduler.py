@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+
+from ..edit_scheduler import EditScheduler, TokenBucket
+from .simulacra import *
+
+
+class TokenBucketTests(unittest.IsolatedAsyncioTestCase):
+    async def test_burst(self):
+        bucket = TokenBucket(rate=1.0, burst=3)
+        for _ in range(3):
+            self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+    async def test_acquire_waits(self):
+        bucket = TokenBucket(rate=50.0, burst=1)
+        await bucket.acquire()
+        loop = asyncio.get_running_loop()
+        before = loop.time()
+        await bucket.acquire()
+        self.assertGreater(loop.time() - before, 0.01)
+
+
+class EditSchedulerTests(unittest.IsolatedAsyncioTestCase):
+    WINDOW = 0.02
+
+    def scheduler(self, rate=1000.0, burst=100):
+        return EditScheduler(window=self.WINDOW, rate=rate, burst=burst)
+
+    async def test_coalesce(self):
+        sched = self.scheduler()
+        message = mock_message()
+        for i in range(50):
+            sched.submit(message, f"edit {i}")
+        self.assertTrue(sched.pending(message))
+        await asyncio.sleep(self.WINDOW * 5)
+        message.edit.assert_called_once_with(content="edit 49")
+        self.assertFalse(sched.pending(message))
+
+    async def test_separate_messages(self):
+        sched = self.scheduler()
+        messages = [mock_message() for _ in range(3)]
+        for message in messages:
+            sched.submit(message, "a")
+            sched.submit(message, "b")
+        await asyncio.sleep(self.WINDOW * 5)
+        for message in messages:
+            message.edit.assert_called_once_with(content="b")
+
+    async def test_edit_now_supersedes(self):
+        sched = self.scheduler()
+        message = mock_message()
+        sched.submit(message, "running")
+        await sched.edit_now(message, "done")
+        await asyncio.sleep(self.WINDOW * 5)
+        message.edit.assert_called_once_with(content="done")
+
+    async def test_global_budget(self):
+        # only one edit fits in the budget, so the second message has to wait for a refill
+        sched = self.scheduler(rate=10.0, burst=1)
+        first, second = mock_message(), mock_message()
+        sched.submit(first, "first")
+        sched.submit(second, "second")
+        await asyncio.sleep(self.WINDOW * 2)
+        first.edit.assert_called_once()
+        second.edit.assert_not_called()
+        await asyncio.sleep(0.15)
+        second.edit.assert_called_once_with(content="second")
+
+
+if __name__ == '__main__':
+    unittest.main()
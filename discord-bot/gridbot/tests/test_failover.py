@@ -0,0 +1,118 @@
+import asyncio
+import unittest
+import unittest.mock as mock
+
+from ..config import Config
+from ..entity import JobTable, NodeTable
+from ..gridbot import GridMiiBot, bot_intents
+from .simulacra import *
+
+
+class RetireTests(unittest.TestCase):
+    def test_retire_job(self):
+        table = JobTable()
+        job = table.new_job(mock_message(), "flaky")
+        table.retire_job(job.jid)
+        self.assertFalse(table.jid_present(job.jid))
+        self.assertEqual(table.retired_node(job.jid), "flaky")
+        self.assertIsNone(table.retired_node(job.jid + 1))
+        self.assertEqual(table.jobs_on_node("flaky"), [])
+
+
+class FailoverTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.jobs = JobTable()
+        self.nodes = NodeTable()
+        for patcher in (mock.patch("gridbot.entity.job_table", self.jobs),
+                        mock.patch("gridbot.entity.node_table", self.nodes),
+                        mock.patch("gridbot.gridbot.job_table", self.jobs),
+                        mock.patch("gridbot.gridbot.node_table", self.nodes),
+                        mock.patch.object(Config, "FAILOVER_RETRIES", 1)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.bot = GridMiiBot(intents=bot_intents)
+        self.bot.loop = asyncio.get_running_loop()
+        self.bot.mq_client = mock_mqtt()
+        self.nodes.node_seen("flaky", "test")
+        self.nodes.node_seen("steady", "test")
+        self.reply = mock_message()
+
+    async def submit(self, node_name: str):
+        node = self.nodes.get_node(node_name)
+        return await node.submit_job("echo hi", self.reply, self.bot.mq_client, ctx=mock_context(), tty_spec=("xterm", 40, 20))
+
+    async def test_resubmits_to_another_node(self):
+        job = await self.submit("flaky")
+        with mock.patch.object(self.bot.loop, "create_task") as create_task:
+            self.assertTrue(await self.bot.failover_job(job))
+            create_task.call_args.args[0].close()
+        self.assertTrue(self.nodes.get_node("flaky").is_suspect)
+        self.assertEqual(self.jobs.retired_node(job.jid), "flaky")
+        [new_job] = self.jobs.jobs_on_node("steady")
+        self.assertEqual(new_job.script, "echo hi")
+        self.assertEqual(new_job.tty_spec, ("xterm", 40, 20))
+        self.assertEqual(new_job.attempt, 2)
+        self.assertIs(new_job.output_handler.output_message, self.reply)
+        self.assertIs(self.jobs.by_message_id(self.reply.id), new_job)
+        # out of retries
+        self.assertFalse(await self.bot.failover_job(new_job))
+
+    async def test_no_other_node(self):
+        self.nodes.node_gone("steady")
+        job = await self.submit("flaky")
+        self.assertFalse(await self.bot.failover_job(job))
+
+    async def test_disabled_by_default(self):
+        job = await self.submit("flaky")
+        with mock.patch.object(Config, "FAILOVER_RETRIES", 0):
+            self.assertFalse(await self.bot.failover_job(job))
+        self.assertTrue(self.jobs.jid_present(job.jid))
+
+    async def test_startup_during_failover_edit(self):
+        # the job starts on the first node while the "trying another node" edit waits for the edit budget
+        job = await self.submit("flaky")
+        edit_started = asyncio.Event()
+        finish_edit = asyncio.Event()
+        async def slow_edit(message, content):
+            edit_started.set()
+            await finish_edit.wait()
+        self.bot.loop = mock.Mock()
+        with mock.patch("gridbot.entity.edit_scheduler", mock.Mock(edit_now=slow_edit)):
+            failover = asyncio.create_task(self.bot.failover_job(job))
+            await asyncio.wait_for(edit_started.wait(), 1.0)
+            self.bot.mq_client.publish.reset_mock()
+            await self.bot.on_mqtt(mock.Mock(topic=f"job/{job.jid}/startup", payload=b''))
+            self.assertFalse(job.started)
+            self.bot.mq_client.publish.assert_called_once_with(f"flaky/signal/{job.jid}/9", qos=2)
+            finish_edit.set()
+            self.assertTrue(await asyncio.wait_for(failover, 1.0))
+        self.bot.loop.create_task.call_args.args[0].close()
+        [new_job] = self.jobs.jobs_on_node("steady")
+        self.assertIs(self.jobs.by_message_id(self.reply.id), new_job)
+
+    async def test_started_job_not_failed_over(self):
+        job = await self.submit("flaky")
+        job.started = True
+        self.assertFalse(await self.bot.failover_job(job))
+        self.assertTrue(self.jobs.jid_present(job.jid))
+        self.assertIsNone(self.jobs.retired_node(job.jid))
+
+    async def test_give_up_retires(self):
+        # with nowhere to fail over to, a startup during the "did not start" edit still gets the copy killed
+        self.nodes.node_gone("steady")
+        job = await self.submit("flaky")
+        with mock.patch("gridbot.entity.edit_scheduler", mock.AsyncMock()):
+            await job.clean_if_unstarted(delay=0, failover=self.bot.failover_job)
+        self.assertFalse(self.jobs.jid_present(job.jid))
+        self.assertEqual(self.jobs.retired_node(job.jid), "flaky")
+
+    async def test_late_startup_killed(self):
+        job = await self.submit("flaky")
+        self.jobs.retire_job(job.jid)
+        self.bot.mq_client.publish.reset_mock()
+        await self.bot.on_mqtt(mock.Mock(topic=f"job/{job.jid}/startup", payload=b''))
+        self.bot.mq_client.publish.assert_called_once_with(f"flaky/signal/{job.jid}/9", qos=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import unittest.mock as mock
+
+from ..entity import JobTable
+from ..grid_cmd import HistoryCog
+from ..history import HistoryEntry, JobHistory, command_hash
+from .simulacra import *
+
+
+def entry(jid: int, node: str = "hal", user_id: int = 1, runtime: float|None = 1.0, start_latency: float|None = 0.1,
+          outcome: str = "exited", exit_status: int|None = 0, submit_time: float = 1000.0) -> HistoryEntry:
+    return HistoryEntry(jid, user_id, node, command_hash("true"), submit_time, start_latency, runtime, 10,
+                        outcome, exit_status)
+
+
+class JobHistoryTests(unittest.TestCase):
+    def setUp(self):
+        self.history = JobHistory(":memory:")
+        self.addCleanup(self.history.close)
+
+    def test_recent(self):
+        for jid in range(1, 6):
+            self.history.record(entry(jid, user_id=jid % 2, submit_time=1000.0 + jid))
+        self.assertEqual([e.jid for e in self.history.recent(limit=3)], [5, 4, 3])
+        self.assertEqual([e.jid for e in self.history.recent(user_id=0)], [4, 2])
+        self.assertEqual(self.history.recent(node="AM"), [])
+
+    def test_stats(self):
+        for jid in range(1, 101):
+            self.history.record(entry(jid, runtime=float(jid), start_latency=jid / 100,
+                                      exit_status=0 if jid % 4 else 256))
+        self.history.record(entry(101, runtime=None, start_latency=None, outcome="unstarted", exit_status=None))
+        self.history.record(entry(102, node="AM", runtime=500.0))
+        stats = self.history.stats(node="hal")
+        self.assertEqual(stats.count, 101)
+        self.assertEqual(stats.exited, 100)
+        self.assertEqual(stats.succeeded, 75)
+        self.assertEqual(stats.bytes_out, 1010)
+        self.assertEqual(stats.runtime, {50: 50.0, 90: 90.0, 99: 99.0})
+        self.assertEqual(stats.start_latency[50], 0.5)
+        self.assertEqual(self.history.stats().runtime[99], 100.0)
+        self.assertEqual(self.history.stats(since=2000.0).count, 0)
+
+    def test_command_hash(self):
+        self.assertEqual(command_hash("uptime"), command_hash("uptime"))
+        self.assertNotEqual(command_hash("uptime"), command_hash("uname"))
+        self.assertIsNone(command_hash(None))
+
+
+class JobLifecycleTests(unittest.IsolatedAsyncioTestCase):
+    async def test_jobs_recorded(self):
+        table = JobTable()
+        table.history = JobHistory(":memory:")
+        self.addCleanup(table.history.close)
+        ctx = mock_context()
+        ctx.author.id = 42
+        with mock.patch("gridbot.entity.job_table", table):
+            job = table.new_job(mock_message(), "hal", ctx=ctx, script="echo hi")
+            await job.startup()
+            await job.write(b"hi\n")
+            await job.stopped(b"0")
+            rejected = table.new_job(mock_message(), "hal", ctx=ctx, script="echo hi")
+            await rejected.reject(b"busy")
+
+        [second, first] = table.history.recent(user_id=42)
+        self.assertEqual(first.outcome, "exited")
+        self.assertEqual(first.exit_status, 0)
+        self.assertEqual(first.bytes_out, 3)
+        self.assertIsNotNone(first.runtime)
+        self.assertEqual(first.command_hash, command_hash("echo hi"))
+        self.assertEqual(second.outcome, "rejected")
+        self.assertIsNone(second.runtime)
+
+
+class HistoryCommandTests(unittest.IsolatedAsyncioTestCase):
+    async def test_without_history(self):
+        cog = HistoryCog(mock_bot())
+        ctx = mock_context()
+        with mock.patch("gridbot.grid_cmd.job_table", JobTable()):
+            await cog.stats(cog, ctx)
+        ctx.reply.assert_called_with(":x: Job history isn't being kept")
+
+    async def test_stats(self):
+        cog = HistoryCog(mock_bot())
+        ctx = mock_context()
+        table = JobTable()
+        table.history = JobHistory(":memory:")
+        self.addCleanup(table.history.close)
+        table.history.record(entry(1, runtime=2.0))
+        with mock.patch("gridbot.grid_cmd.job_table", table):
+            await cog.stats(cog, ctx, "hal")
+            self.assertIn("Runtime: p50 2.00 s", ctx.reply.call_args.args[0])
+            await cog.history(cog, ctx, "all")
+            self.assertIn("#1 on `hal`", ctx.reply.call_args.args[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,9 @@
+import asyncio
 import unittest
 
 import time
 
-from ..entity import Job, JobTable
+from ..entity import Job, JobTable, NodeTable, PipeOutputHandler, PtyOutputHandler
 from .simulacra import *
 
 # Please do not import job_table
@@ -62,6 +63,38 @@ class JobTableTests(unittest.TestCase):
         table.new_job(mock_message(), self.TARGET)
         self.assertTrue(table.has_jobs())
 
+    def test_indexes(self):
+        table = JobTable()
+        alice, bob = mock_context(), mock_context()
+        first = table.new_job(mock_message(), "node-a", ctx=alice)
+        second = table.new_job(mock_message(), "node-b", ctx=bob)
+        third = table.new_job(mock_message(), "node-a", ctx=alice)
+        anonymous = table.new_job(mock_message(), "node-b")
+
+        self.assertIs(table.by_message_id(second.output_handler.output_message.id), second)
+        self.assertIsNone(table.by_message_id(mock_message().id))
+        self.assertEqual(table.jobs_on_node("node-a"), [first, third])
+        self.assertEqual(table.jobs_on_node("node-b"), [second, anonymous])
+        self.assertEqual(table.jobs_on_node("node-c"), [])
+        self.assertEqual(table.jobs_for_user(alice.author.id), [first, third])
+        self.assertEqual(table.jobs_for_user(bob.author.id), [second])
+
+        table.delete_job(first.jid)
+        table.delete_job(second.jid)
+        self.assertIsNone(table.by_message_id(first.output_handler.output_message.id))
+        self.assertEqual(table.jobs_on_node("node-a"), [third])
+        self.assertEqual(table.jobs_for_user(bob.author.id), [])
+        self.assertNotIn(bob.author.id, table._by_user)
+
+    def test_delete_closes_spool(self):
+        table = JobTable()
+        for leave in (table.delete_job, table.retire_job):
+            job = table.new_job(mock_message(), self.TARGET)
+            job.output_handler.output_buffer.write(b"output")
+            leave(job.jid)
+            self.assertTrue(job.output_handler.output_buffer.closed)
+
+
 class JobTests(unittest.IsolatedAsyncioTestCase):
     async def test_startup(self):
         table = JobTable()
@@ -93,6 +126,167 @@ class JobTests(unittest.IsolatedAsyncioTestCase):
             await job.stopped(status)
             self.assertTrue(callback_fired)
 
+    async def test_stopped_twice(self):
+        # a roll call can abandon a job while its own stopped message is being handled
+        table = JobTable()
+        callback = mock.AsyncMock()
+        edit_started = asyncio.Event()
+        finish_edit = asyncio.Event()
+        async def slow_edit(message, content):
+            edit_started.set()
+            await finish_edit.wait()
+        scheduler = mock.Mock(edit_now=slow_edit)
+        with mock.patch("gridbot.entity.job_table", new=table), \
+                mock.patch("gridbot.entity.edit_scheduler", new=scheduler):
+            job = table.new_job(mock_message(), "test-node", callback=callback)
+            job.started = True
+            stopped = asyncio.create_task(job.stopped(b'0'))
+            await edit_started.wait()
+            await asyncio.wait_for(job.abandon(mock_mqtt()), 1.0)
+            finish_edit.set()
+            await stopped
+        self.assertFalse(table.jid_present(job.jid))
+        callback.assert_awaited_once_with(job, 0)
+
+    async def test_start_timeout_follows_node(self):
+        table = JobTable()
+        nodes = NodeTable()
+        node = nodes.node_seen("test-node", "test")
+        with mock.patch("gridbot.entity.job_table", new=table), \
+                mock.patch("gridbot.entity.node_table", new=nodes), \
+                mock.patch("gridbot.entity.edit_scheduler", new=mock.AsyncMock()), \
+                mock.patch("asyncio.sleep") as sleep:
+            for _ in range(10):
+                job = table.new_job(mock_message(), "test-node")
+                job.start_time -= 2.0     # pretend it took 2 seconds to start
+                await job.startup()
+            self.assertAlmostEqual(node.startup_latency, 2.0, places=1)
+            job = table.new_job(mock_message(), "test-node")
+            await job.clean_if_unstarted()
+            delay = sleep.call_args.args[0]
+            self.assertAlmostEqual(delay, node.startup_timeout())
+            self.assertLess(delay, 20.0)
+            self.assertFalse(table.jid_present(job.jid))
+            self.assertTrue(job.output_handler.output_buffer.closed)
+
+    async def test_reject_closes_spool(self):
+        table = JobTable()
+        with mock.patch("gridbot.entity.job_table", new=table):
+            job = table.new_job(mock_message(), "test-node")
+            await job.reject(b"no room")
+        self.assertFalse(table.jid_present(job.jid))
+        self.assertTrue(job.output_handler.output_buffer.closed)
+
+    async def test_start_timeout_during_slow_edit(self):
+        # the start timeout can fire while the "has started" edit waits for the edit budget
+        table = JobTable()
+        edit_started = asyncio.Event()
+        finish_edit = asyncio.Event()
+        async def slow_edit(message, content):
+            edit_started.set()
+            await finish_edit.wait()
+        scheduler = mock.Mock(edit_now=slow_edit)
+        with mock.patch("gridbot.entity.job_table", new=table), \
+                mock.patch("gridbot.entity.edit_scheduler", new=scheduler):
+            job = table.new_job(mock_message(), "test-node")
+            startup = asyncio.create_task(job.startup())
+            await edit_started.wait()
+            await asyncio.wait_for(job.clean_if_unstarted(delay=0), 1.0)
+            self.assertTrue(table.jid_present(job.jid))
+            finish_edit.set()
+            await startup
+
+class OutputHandlerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_split_multibyte(self):
+        handler = PipeOutputHandler(mock_message())
+        encoded = "pokémon🤔".encode()
+        for i in range(len(encoded)):
+            await handler.write(encoded[i:i+1])
+        self.assertEqual(handler.buffer_contents(), "pokémon🤔")
+
+    async def test_filter_cached(self):
+        calls = 0
+        def counting_filter(s: str) -> str:
+            nonlocal calls
+            calls += 1
+            return s.upper()
+        handler = PipeOutputHandler(mock_message(), counting_filter)
+        await handler.write(b"abc")
+        calls = 0
+        self.assertEqual(handler.buffer_contents(), "ABC")
+        self.assertEqual(handler.buffer_contents(), "ABC")
+        self.assertLessEqual(calls, 1)
+        await handler.write(b"def")
+        self.assertEqual(handler.buffer_contents(), "ABCDEF")
+
+    async def test_large_output_bounded(self):
+        handler = PipeOutputHandler(mock_message())
+        line = b"y\n"
+        for _ in range(40_000):
+            await handler.write(line)
+        self.assertTrue(handler.output_buffer.spilled)
+        self.assertTrue(handler.text_truncated)
+        self.assertLessEqual(len(handler.buffer_contents()), handler.output_buffer.tail_size)
+        self.assertEqual(handler.output_buffer.size, 40_000 * len(line))
+        handler.output_buffer.close()
+
+    async def test_pty_skips_unchanged_screen(self):
+        handler = PtyOutputHandler(mock_message(), columns=10, lines=3)
+        with mock.patch.object(handler, "schedule_edit") as schedule_edit:
+            await handler.write(b"abc")
+            self.assertEqual(schedule_edit.call_count, 1)
+            await handler.write(b"\r")
+            await handler.write(b"abc")
+            self.assertEqual(schedule_edit.call_count, 1)
+            await handler.write(b"d")
+            self.assertEqual(schedule_edit.call_count, 2)
+
+    async def test_pty_attaches_history(self):
+        handler = PtyOutputHandler(mock_message(), columns=10, lines=3)
+        for i in range(5):
+            await handler.write(b"line %d\r\n" % i)
+        self.assertEqual(handler.output_buffer.size, 0)
+        self.assertEqual(handler.buffer_contents(), "\n".join(f"line {i}" for i in range(5)))
+        await handler.stopped("exited with status 0", 1)
+        self.assertTrue(handler.will_attach)
+        attachment = handler.output_message.add_files.call_args.args[0]
+        self.assertEqual(attachment.fp.read().decode(), handler.tty.history())
+
+    async def test_pty_colour_fits_message(self):
+        # every cell in a different colour renders to far more than the screen's size
+        handler = PtyOutputHandler(mock_message(), columns=40, lines=20)
+        with mock.patch.object(handler, "schedule_edit") as schedule_edit:
+            for line in range(20):
+                await handler.write(b"".join(b"\x1b[3%dmx" % (i % 8) for i in range(40)))
+                if line < 19:
+                    await handler.write(b"\r\n")
+            content = schedule_edit.call_args.args[0]
+        self.assertGreater(len(handler.tty.render()), Job.MESSAGE_LIMIT)
+        self.assertLessEqual(len(content), Job.MESSAGE_LIMIT)
+        self.assertIn("x" * 40, content)
+        self.assertLessEqual(len(handler.screen_message(suffix="\n" + "status " * 100)), Job.MESSAGE_LIMIT)
+
+    async def test_stopped_when_final_edit_fails(self):
+        table = JobTable()
+        callback = mock.AsyncMock()
+        scheduler = mock.Mock(edit_now=mock.AsyncMock(side_effect=RuntimeError("400 Bad Request")))
+        with mock.patch("gridbot.entity.job_table", new=table), \
+                mock.patch("gridbot.entity.edit_scheduler", new=scheduler):
+            job = table.new_job(mock_message(), "test-node", callback=callback)
+            job.started = True
+            with self.assertLogs(level="ERROR"):
+                await job.stopped(b'0')
+        self.assertFalse(table.jid_present(job.jid))
+        self.assertTrue(job.output_handler.output_buffer.closed)
+        callback.assert_awaited_once_with(job, 0)
+
+    async def test_tail(self):
+        table = JobTable()
+        job = table.new_job(mock_message(), "test-node")
+        await job.startup()
+        await job.write(b"one\ntwo\nthree\n")
+        self.assertEqual(job.tail(3), ["two", "three", ""])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,172 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock as mock
+
+import discord
+
+from ..entity import JobTable, NodeTable, PtyOutputHandler
+from ..gridbot import GridMiiBot, bot_intents
+from ..job_store import JobRecord, JobStore
+from .simulacra import *
+
+
+def fake_message(message_id: int, channel_id: int = 100):
+    message = mock_message()
+    message.id = message_id
+    message.channel.id = channel_id
+    return message
+
+
+class JobStoreTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "jobs.sqlite")
+
+    def open_store(self) -> JobStore:
+        store = JobStore(self.path)
+        self.addCleanup(store.close)
+        return store
+
+    def test_round_trip(self):
+        store = self.open_store()
+        self.assertEqual(store.last_jid(), 0)
+        store.add(JobRecord(1, "hal", 100, 200, 300, None, "uptime"))
+        store.add(JobRecord(2, "hal", 100, 201, None, ("xterm", 40, 20), "top"))
+        store.remove(1)
+        store.close()
+
+        store = self.open_store()
+        self.assertEqual(store.last_jid(), 2)
+        self.assertEqual(store.records(), [JobRecord(2, "hal", 100, 201, None, ("xterm", 40, 20), "top")])
+
+    def test_writes_queued(self):
+        store = self.open_store()
+        # hold up the store's thread; adding a job still returns straight away
+        release = threading.Event()
+        store.write(release.wait)
+        store.add(JobRecord(1, "hal", 100, 200, 300, None, "uptime"))
+        release.set()
+        self.assertEqual([record.jid for record in store.records()], [1])
+        with self.assertLogs(level="ERROR"):
+            store.write(store.db.execute, "not sql")
+            store.read(lambda: None)
+
+    def test_start_times(self):
+        store = self.open_store()
+        store.add(JobRecord(1, "hal", 100, 200, 300, None, "uptime", 1000.0))
+        store.set_started(1, 1002.5)
+        [record] = store.records()
+        self.assertEqual((record.submitted_at, record.started_at), (1000.0, 1002.5))
+
+    def test_old_store_upgraded(self):
+        db = sqlite3.connect(self.path)
+        db.executescript("""
+            CREATE TABLE jobs (jid INTEGER PRIMARY KEY, node TEXT NOT NULL, channel_id INTEGER NOT NULL,
+                               message_id INTEGER NOT NULL, user_id INTEGER, tty_spec TEXT, script TEXT);
+            INSERT INTO jobs VALUES (4, 'hal', 100, 200, 300, NULL, 'uptime');
+        """)
+        db.close()
+        store = self.open_store()
+        self.assertEqual(store.records(), [JobRecord(4, "hal", 100, 200, 300, None, "uptime")])
+        store.set_started(4, 1000.0)
+        self.assertEqual(store.records()[0].started_at, 1000.0)
+
+    def test_run_time_survives_restart(self):
+        table = JobTable()
+        table.attach_store(self.open_store())
+        job = table.new_job(fake_message(1), "hal", script="sleep 1000")
+        table.job_started(job)
+
+        table = JobTable()
+        table.attach_store(self.open_store())
+        [record] = table.store.records()
+        # pretend the bot was down for ten minutes after the job started
+        record = record._replace(submitted_at=record.submitted_at - 601, started_at=record.started_at - 600)
+        restored = table.restore_job(record, fake_message(1))
+        self.assertAlmostEqual(time.monotonic() - restored.start_time, 600, delta=5)
+        self.assertAlmostEqual(restored.start_latency, 1, delta=0.5)
+        self.assertEqual(restored.submit_time, record.submitted_at)
+
+    def test_jid_counter_survives_restart(self):
+        table = JobTable()
+        table.attach_store(self.open_store())
+        first = table.new_job(fake_message(1), "hal", script="sleep 100")
+        second = table.new_job(fake_message(2), "hal", tty_spec=("xterm", 40, 20), script="top")
+        table.delete_job(first.jid)
+
+        table = JobTable()
+        table.attach_store(self.open_store())
+        [record] = table.store.records()
+        self.assertEqual(record.jid, second.jid)
+        self.assertEqual(record.script, "top")
+        job = table.restore_job(record, fake_message(2))
+        self.assertTrue(job.started)
+        self.assertIsInstance(job.output_handler, PtyOutputHandler)
+        self.assertIs(table.by_jid(second.jid), job)
+        self.assertEqual(table.jobs_on_node("hal"), [job])
+        # new jobs don't reuse JIDs from before the restart
+        self.assertGreater(table.new_job(fake_message(3), "hal").jid, second.jid)
+
+
+class RestoreTests(unittest.IsolatedAsyncioTestCase):
+    async def test_restore_and_sweep(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = JobStore(os.path.join(tmp.name, "jobs.sqlite"))
+        self.addCleanup(store.close)
+        store.add(JobRecord(7, "hal", 100, 200, 300, None, "sleep 100"))
+        store.add(JobRecord(8, "gone", 100, 201, 300, None, "sleep 100"))
+        store.add(JobRecord(9, "hal", 999, 202, 300, None, "sleep 100"))    # channel was deleted
+
+        jobs, nodes = JobTable(), NodeTable()
+        jobs.attach_store(store)
+        nodes.node_seen("hal", "test")
+        with mock.patch("gridbot.gridbot.job_table", jobs), mock.patch("gridbot.gridbot.node_table", nodes), \
+                mock.patch("gridbot.entity.job_table", jobs), mock.patch("gridbot.entity.edit_scheduler", new=mock.Mock(edit_now=mock.AsyncMock())), \
+                mock.patch("asyncio.sleep"):
+            bot = GridMiiBot(intents=bot_intents)
+            bot.mq_client = mock_mqtt()
+            channel = mock.Mock()
+            with mock.patch.object(bot, "get_channel", lambda channel_id: channel if channel_id == 100 else None):
+                restored = bot.restore_jobs()
+            self.assertEqual([job.jid for job in restored], [7, 8])
+            self.assertEqual([record.jid for record in store.records()], [7, 8])
+            self.assertEqual(jobs.by_jid(7).user_id, 300)
+            self.assertEqual(len(jobs.jobs_for_user(300)), 2)
+
+            await bot.sweep_restored(restored)
+            self.assertTrue(jobs.jid_present(7))
+            self.assertFalse(jobs.jid_present(8))
+            self.assertEqual([record.jid for record in store.records()], [7])
+
+    async def test_restored_job_attaches_output(self):
+        # a restored job only has a PartialMessage, which has no add_files
+        jobs = JobTable()
+        partial = mock.AsyncMock(spec=discord.PartialMessage)
+        partial.id = 200
+        full = mock.AsyncMock(spec=discord.Message)
+        partial.fetch.return_value = full
+        channel = mock.Mock()
+        channel.get_partial_message.return_value = partial
+        scheduler = mock.Mock(edit_now=mock.AsyncMock())
+        with mock.patch("gridbot.gridbot.job_table", jobs), mock.patch("gridbot.entity.job_table", jobs), \
+                mock.patch("gridbot.entity.edit_scheduler", new=scheduler):
+            jobs.attach_store(mock.Mock(records=lambda: [JobRecord(7, "hal", 100, 200, 300, None, "yes")],
+                                        last_jid=lambda: 7))
+            bot = GridMiiBot(intents=bot_intents)
+            with mock.patch.object(bot, "get_channel", return_value=channel):
+                [job] = bot.restore_jobs()
+            await job.write(b"y\n" * 2000)
+            await job.stopped(b'0')
+        full.add_files.assert_awaited_once()
+        self.assertIs(scheduler.edit_now.call_args.args[0], full)
+        self.assertFalse(jobs.jid_present(7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+import aiohttp
+
+from .. import metrics
+
+
+class MetricTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = metrics.Counter("test_total", "A counter", ["kind"], registry=self.registry)
+        counter.inc(kind="a")
+        counter.inc(2, kind="a")
+        counter.inc(kind='b"c')
+        self.assertEqual(counter.value(kind="a"), 3)
+        self.assertEqual(self.registry.expose(),
+                         '# HELP test_total A counter\n'
+                         '# TYPE test_total counter\n'
+                         'test_total{kind="a"} 3\n'
+                         'test_total{kind="b\\"c"} 1\n')
+        with self.assertRaises(ValueError):
+            counter.inc(wrong="label")
+
+    def test_gauge_function(self):
+        gauge = metrics.Gauge("test_jobs", "A gauge", ["node"], registry=self.registry)
+        gauge.set_function(lambda: {("hal",): 2, ("AM",): 0})
+        self.assertIn('test_jobs{node="hal"} 2\n', self.registry.expose())
+        unlabeled = metrics.Gauge("test_nodes", "Another gauge", registry=self.registry)
+        unlabeled.set_function(lambda: 3)
+        self.assertIn('test_nodes 3\n', self.registry.expose())
+
+    def test_histogram(self):
+        histogram = metrics.Histogram("test_seconds", "A histogram", buckets=(0.1, 1.0), registry=self.registry)
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.count(), 4)
+        lines = self.registry.expose().splitlines()[2:]
+        self.assertEqual(lines, [
+            'test_seconds_bucket{le="0.1"} 2',
+            'test_seconds_bucket{le="1"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 5.65',
+            'test_seconds_count 4',
+        ])
+
+    def test_duplicate_name(self):
+        metrics.Counter("test_total", "A counter", registry=self.registry)
+        with self.assertRaises(ValueError):
+            metrics.Counter("test_total", "A counter", registry=self.registry)
+
+    def test_broken_gauge_skipped(self):
+        gauge = metrics.Gauge("test_broken", "A gauge", registry=self.registry)
+        gauge.set_function(lambda: 1 / 0)
+        metrics.Counter("test_total", "A counter", registry=self.registry).inc()
+        with self.assertLogs(level="ERROR"):
+            self.assertIn("test_total 1", self.registry.expose())
+
+    def test_topic_kind(self):
+        self.assertEqual(metrics.topic_kind("job/12/stdout"), "job_stdout")
+        self.assertEqual(metrics.topic_kind("node/connect"), "node_connect")
+        self.assertEqual(metrics.topic_kind("grid/ping"), "other")
+        # nodes can publish anything, which mustn't turn into a new label
+        self.assertEqual(metrics.topic_kind("job/12/made-up-event"), "other")
+        self.assertEqual(metrics.topic_kind("node/made-up-event"), "other")
+
+
+class MetricsServerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_serve(self):
+        registry = metrics.Registry()
+        metrics.Counter("test_total", "A counter", registry=registry).inc()
+        server = metrics.MetricsServer(registry)
+        await server.start("127.0.0.1", 0)
+        self.addAsyncCleanup(server.stop)
+        host, port = server.runner.addresses[0][:2]
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://{host}:{port}/metrics") as response:
+                self.assertEqual(response.status, 200)
+                self.assertIn("test_total 1", await response.text())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import asyncio
+import datetime
+import os
+import tempfile
+import time
+import unittest
+
+from ..object_store import AsyncObjectStore, FilesystemObjectStore, ObjectStoreError
+
+
+def tomorrow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+
+
+class FilesystemObjectStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.store = FilesystemObjectStore(self.root.name, "http://relay.invalid/")
+
+    def test_pars(self):
+        par = self.store.create_par("thing", tomorrow())
+        self.assertEqual(par.url, f"http://relay.invalid/p/{par.id}/o/thing")
+        self.assertIs(self.store.pars[par.id], par)
+        self.store.delete_par(par.id)
+        self.assertNotIn(par.id, self.store.pars)
+
+    def test_objects(self):
+        with open(self.store.object_path("thing"), "wb") as f:
+            f.write(b"hi")
+        self.store.delete_object("thing")
+        self.assertFalse(os.path.exists(self.store.object_path("thing")))
+        self.store.delete_object("thing")
+        for bad_name in ("", "../etc", "a/b", ".hidden"):
+            with self.assertRaises(ObjectStoreError):
+                self.store.object_path(bad_name)
+
+
+class AsyncObjectStoreTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+
+    def make_store(self, latency: float, **kwargs) -> AsyncObjectStore:
+        store = AsyncObjectStore(FilesystemObjectStore(self.root.name, latency=latency), **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    async def test_loop_not_blocked(self):
+        store = self.make_store(0.2, max_workers=2, timeout=5)
+        ticks = 0
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        ticker = asyncio.create_task(tick())
+        start = time.monotonic()
+        pars = await asyncio.gather(*(store.create_par(f"obj{i}", tomorrow()) for i in range(2)))
+        elapsed = time.monotonic() - start
+        ticker.cancel()
+        self.assertEqual(len({par.id for par in pars}), 2)
+        # both calls ran at once, and the loop kept going while they did
+        self.assertLess(elapsed, 0.35)
+        self.assertGreater(ticks, 5)
+
+    async def test_timeout(self):
+        store = self.make_store(0.5, max_workers=1, timeout=0.05)
+        with self.assertRaises(ObjectStoreError):
+            await store.check()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import asyncio
+import datetime
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from .. import metrics
+from ..object_store import AsyncObjectStore, FilesystemObjectStore
+from ..par_pool import ParPool
+
+
+class ParPoolTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.backing = FilesystemObjectStore(root.name)
+        self.store = AsyncObjectStore(self.backing, max_workers=2, timeout=5)
+        self.addCleanup(self.store.close)
+        self.pool = ParPool(self.store, size=3, lifetime=3600, min_remaining=60, refill_interval=60)
+        self.addAsyncCleanup(self.pool.close)
+
+    async def wait_full(self):
+        for _ in range(100):
+            if len(self.pool) == self.pool.size:
+                return
+            await asyncio.sleep(0.01)
+        self.fail("pool never filled")
+
+    async def test_refill(self):
+        self.pool.start()
+        await self.wait_full()
+        hits = metrics.RELAY_PAR_POOL.value(result="hit")
+        par = await self.pool.get()
+        self.assertEqual(metrics.RELAY_PAR_POOL.value(result="hit"), hits + 1)
+        self.assertIn(par.id, self.backing.pars)
+        # taking one wakes the refill task up
+        await self.wait_full()
+        self.assertNotIn(par, list(self.pool._pars))
+
+    async def test_empty_pool(self):
+        misses = metrics.RELAY_PAR_POOL.value(result="miss")
+        par = await self.pool.get()
+        self.assertEqual(metrics.RELAY_PAR_POOL.value(result="miss"), misses + 1)
+        self.assertIn(par.id, self.backing.pars)
+
+    async def test_near_expiry_evicted(self):
+        await self.pool.refill()
+        soon = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=30)
+        stale = self.pool._pars[0] = self.pool._pars[0]._replace(expires=soon)
+        with mock.patch.object(self.store, "delete_par", wraps=self.store.delete_par) as delete_par:
+            par = await self.pool.get()
+            # the stale request is left for the refill task to delete, rather than making get wait for it
+            delete_par.assert_not_called()
+        self.assertNotEqual(par, stale)
+        self.assertIn(stale.id, self.backing.pars)
+        await self.pool.refill()
+        self.assertNotIn(stale.id, self.backing.pars)
+        self.assertEqual(len(self.pool), 3)
+
+    async def test_close_deletes_unused(self):
+        await self.pool.refill()
+        taken = await self.pool.get()
+        await self.pool.close()
+        self.assertEqual(list(self.backing.pars), [taken.id])
+
+
+if __name__ == '__main__':
+    unittest.main()
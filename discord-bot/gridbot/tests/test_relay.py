@@ -0,0 +1,186 @@
+import asyncio
+import datetime
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+import aiohttp
+from aiohttp import web
+
+from .. import metrics
+from ..config import Config
+from ..object_store import FilesystemObjectStore, PreauthenticatedRequest
+from ..relay import LocalRelay, ObjectStoreRelay, RelayError
+from ..xfer import FileTransferCog
+from .simulacra import *
+
+
+def tomorrow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+
+
+class RelayTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        # make relay URLs on demand, so tests control exactly which ones exist
+        patcher = mock.patch.object(Config, "PAR_POOL_SIZE", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ObjectStoreRelayTests(RelayTestCase):
+    async def asyncSetUp(self):
+        async def serve_file(request: web.Request):
+            return web.Response(body=b"x" * int(request.match_info["size"]))
+        async def serve_stream(request: web.Request):
+            # no Content-Length, so the cap has to be enforced while streaming
+            response = web.StreamResponse()
+            await response.prepare(request)
+            for _ in range(int(request.match_info["chunks"])):
+                await response.write(b"y" * 1024)
+            await response.write_eof()
+            return response
+        app = web.Application()
+        app.router.add_get("/file/{size}", serve_file)
+        app.router.add_get("/stream/{chunks}", serve_stream)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        self.addAsyncCleanup(self.runner.cleanup)
+        host, port = self.runner.addresses[0][:2]
+        self.base = f"http://{host}:{port}"
+        self.relay = ObjectStoreRelay(FilesystemObjectStore(self.root))
+        self.addAsyncCleanup(self.relay.close)
+
+    def par(self, path: str) -> PreauthenticatedRequest:
+        return PreauthenticatedRequest("id", "object", f"{self.base}{path}", tomorrow())
+
+    async def test_fetch(self):
+        before = metrics.RELAY_DOWNLOAD_BYTES.value()
+        with mock.patch.object(Config, "SPOOL_HEAD_BYTES", 1024):
+            body = await self.relay.fetch(self.par("/file/5000"))
+        with body:
+            self.assertEqual(body.read(), b"x" * 5000)
+        self.assertEqual(metrics.RELAY_DOWNLOAD_BYTES.value() - before, 5000)
+        # the session is kept for the next download
+        session = self.relay.session
+        (await self.relay.fetch(self.par("/file/10"))).close()
+        self.assertIs(self.relay.session, session)
+
+    async def test_cap(self):
+        with self.assertRaises(RelayError) as caught:
+            await self.relay.fetch(self.par("/file/5000"), cap=4096)
+        self.assertEqual(caught.exception.outcome, "too_large")
+        with self.assertRaises(RelayError) as caught:
+            await self.relay.fetch(self.par("/stream/8"), cap=4096)
+        self.assertEqual(caught.exception.outcome, "too_large")
+        (await self.relay.fetch(self.par("/stream/4"), cap=4096)).close()
+
+    async def test_attach(self):
+        cog = FileTransferCog(mock_bot())
+        cog.relay = self.relay
+        ctx = mock_context()
+        sent = []
+        async def reply(content=None, *, file=None):
+            sent.append(content if file is None else file.fp.read())
+        ctx.reply = reply
+        with self.assertLogs(level="WARNING"):
+            await cog.download_and_attach(ctx, self.par("/missing"), "nope.txt")
+        await cog.download_and_attach(ctx, self.par("/file/3"), "x.txt")
+        self.assertEqual(sent, [":x: Couldn't download the file from the relay: HTTP 404", b"xxx"])
+
+
+class LocalRelayTests(RelayTestCase):
+    async def asyncSetUp(self):
+        self.relay = LocalRelay(self.root, "127.0.0.1", 0, "http://unused")
+        await self.relay.start()
+        self.addAsyncCleanup(self.relay.close)
+        host, port = self.relay.runner.addresses[0][:2]
+        self.relay.files.base_url = f"http://{host}:{port}"
+        self.session = aiohttp.ClientSession()
+        self.addAsyncCleanup(self.session.close)
+
+    async def test_round_trip(self):
+        par = await self.relay.upload_url()
+        async with self.session.put(par.url, data=b"results") as response:
+            self.assertEqual(response.status, 200)
+        async with self.session.get(par.url) as response:
+            self.assertEqual(await response.read(), b"results")
+        with await self.relay.fetch(par) as body:
+            self.assertEqual(body.read(), b"results")
+        await self.relay.delete(par)
+        self.assertFalse(os.path.exists(self.relay.files.object_path(par.object_name)))
+        async with self.session.put(par.url, data=b"again") as response:
+            self.assertEqual(response.status, 404)
+
+    async def test_upload_written_off_loop(self):
+        par = await self.relay.upload_url()
+        with mock.patch("gridbot.relay.asyncio.to_thread", wraps=asyncio.to_thread) as to_thread:
+            async with self.session.put(par.url, data=b"x" * 200_000) as response:
+                self.assertEqual(response.status, 200)
+        functions = [call.args[0] for call in to_thread.call_args_list]
+        self.assertIn(open, functions)
+        self.assertIn(os.replace, functions)
+        self.assertTrue(any(getattr(function, "__name__", None) == "write" for function in functions))
+        with await self.relay.fetch(par) as body:
+            self.assertEqual(len(body.read()), 200_000)
+
+    async def test_bad_uploads(self):
+        par = await self.relay.upload_url()
+        async with self.session.put(par.url.replace(par.id, "forged"), data=b"x") as response:
+            self.assertEqual(response.status, 404)
+        with mock.patch.object(Config, "DOWNLOAD_CAP_BYTES", 4):
+            async with self.session.put(par.url, data=b"too big") as response:
+                self.assertEqual(response.status, 413)
+        self.assertEqual(os.listdir(self.root), [])
+        with self.assertRaises(RelayError):
+            await self.relay.fetch(par)
+
+
+class DownloadCommandTests(RelayTestCase):
+    async def test_download(self):
+        backing = FilesystemObjectStore(self.root, "http://relay.invalid")
+        bot = mock_bot()
+        bot.submit_job = mock.AsyncMock()
+        cog = FileTransferCog(bot)
+        cog.relay = ObjectStoreRelay(backing)
+        self.addAsyncCleanup(cog.cog_unload)
+        ctx = mock_context()
+        await cog.download(cog, ctx, "results.txt")
+        [par] = backing.pars.values()
+        script = bot.submit_job.call_args.args[1]
+        self.assertIn(par.url, script)
+        self.assertIn("results.txt", script)
+        self.assertIn(f"-gt {Config.DOWNLOAD_CAP_BYTES} ]", script)
+        # the relay URL is cleaned up when the job ends, whether or not the file was fetched
+        callback = bot.submit_job.call_args.kwargs["callback"]
+        await callback(None, 1)
+        self.assertEqual(backing.pars, {})
+
+    async def test_download_cleaned_up_after_error(self):
+        backing = FilesystemObjectStore(self.root, "http://relay.invalid")
+        bot = mock_bot()
+        bot.submit_job = mock.AsyncMock()
+        cog = FileTransferCog(bot)
+        cog.relay = ObjectStoreRelay(backing)
+        self.addAsyncCleanup(cog.cog_unload)
+        ctx = mock_context()
+        await cog.download(cog, ctx, "results.txt")
+        ctx.reply.side_effect = RuntimeError("Discord is down")
+        callback = bot.submit_job.call_args.kwargs["callback"]
+        with self.assertRaises(RuntimeError), self.assertLogs(level="WARNING"):
+            await callback(None, 0)
+        self.assertEqual(backing.pars, {})
+
+    async def test_download_unavailable(self):
+        cog = FileTransferCog(mock_bot())
+        ctx = mock_context()
+        await cog.download(cog, ctx, "results.txt")
+        ctx.reply.assert_called_with(":x: File downloads are not currently available")
+
+
+if __name__ == '__main__':
+    unittest.main()
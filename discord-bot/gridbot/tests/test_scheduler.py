@@ -0,0 +1,210 @@
+import random
+import unittest
+import unittest.mock as mock
+
+from ..config import Config
+from ..entity import JobTable, NodeTable
+from ..scheduler import LeastLoadedPolicy, PowerOfTwoPolicy, StickyPolicy, make_policy
+from .simulacra import *
+
+
+class FakeNode:
+    """A node in a simulated grid, with its load tracked by the simulation instead of a job table"""
+    def __init__(self, node_name: str, capacity: int = 4, startup_latency: float|None = None):
+        self.node_name = node_name
+        self.capacity = capacity
+        self.startup_latency = startup_latency
+        self.running_jobs = 0
+
+    def can_accept_jobs(self):
+        return self.running_jobs < self.capacity
+
+    def __repr__(self):
+        return f"<FakeNode {self.node_name} {self.running_jobs}/{self.capacity}>"
+
+
+class SimulatedGrid:
+    """Submits one job per step through a policy. Each job runs for a random number of steps."""
+    def __init__(self, policy, nodes: list[FakeNode], seed=0):
+        self.policy = policy
+        self.nodes = nodes
+        self.rng = random.Random(seed)
+        self.running: list[tuple[int, FakeNode]] = []    # (step the job finishes, node it's on)
+        self.placed = {node.node_name: 0 for node in nodes}
+        self.peak = {node.node_name: 0 for node in nodes}
+        self.refused = 0
+
+    def submit(self, step: int, max_duration: int):
+        candidates = [node for node in self.nodes if node.can_accept_jobs()]
+        node = self.policy.choose(candidates)
+        if node is None:
+            self.refused += 1
+            return
+        node.running_jobs += 1
+        self.running.append((step + self.rng.randint(1, max_duration), node))
+        self.placed[node.node_name] += 1
+        self.peak[node.node_name] = max(self.peak[node.node_name], node.running_jobs)
+
+    def finish(self, step: int):
+        still_running = []
+        for finish_step, node in self.running:
+            if finish_step <= step:
+                node.running_jobs -= 1
+            else:
+                still_running.append((finish_step, node))
+        self.running = still_running
+
+    def run(self, steps: int, max_duration: int):
+        for step in range(steps):
+            self.finish(step)
+            self.submit(step, max_duration)
+
+
+class PolicyTests(unittest.TestCase):
+    def test_empty(self):
+        for policy in (LeastLoadedPolicy(), PowerOfTwoPolicy(random.Random(0)), StickyPolicy()):
+            self.assertIsNone(policy.choose([]))
+
+    def test_least_loaded(self):
+        a, b, c = FakeNode("a"), FakeNode("b"), FakeNode("c")
+        a.running_jobs, b.running_jobs, c.running_jobs = 3, 1, 2
+        self.assertIs(LeastLoadedPolicy().choose([a, b, c]), b)
+
+    def test_least_loaded_uses_capacity(self):
+        small, big = FakeNode("small", capacity=2), FakeNode("big", capacity=8)
+        small.running_jobs, big.running_jobs = 1, 2
+        self.assertIs(LeastLoadedPolicy().choose([small, big]), big)
+
+    def test_latency_breaks_ties(self):
+        slow, fast = FakeNode("slow", startup_latency=5.0), FakeNode("fast", startup_latency=0.2)
+        self.assertIs(LeastLoadedPolicy().choose([slow, fast]), fast)
+
+    def test_sticky(self):
+        a, b = FakeNode("a"), FakeNode("b")
+        policy = StickyPolicy()
+        self.assertIs(policy.choose([a, b]), a)
+        a.running_jobs = 3
+        self.assertIs(policy.choose([a, b]), a)
+        # a is full, so it isn't a candidate anymore
+        self.assertIs(policy.choose([b]), b)
+        self.assertIs(policy.choose([a, b]), b)
+
+    def test_make_policy(self):
+        self.assertIsInstance(make_policy("power-of-two"), PowerOfTwoPolicy)
+        with self.assertRaises(ValueError):
+            make_policy("round-robin")
+
+
+class SimulatedGridTests(unittest.TestCase):
+    def grid(self):
+        return [FakeNode("a"), FakeNode("b"), FakeNode("c", capacity=8), FakeNode("d", capacity=2)]
+
+    def test_capacity_respected(self):
+        # overloaded: jobs arrive faster than the grid can run them
+        for policy in (LeastLoadedPolicy(), PowerOfTwoPolicy(random.Random(1)), StickyPolicy()):
+            nodes = self.grid()
+            sim = SimulatedGrid(policy, nodes)
+            sim.run(1000, max_duration=40)
+            self.assertGreater(sim.refused, 0, policy.name)
+            for node in nodes:
+                self.assertLessEqual(sim.peak[node.node_name], node.capacity, policy.name)
+
+    def test_load_spread(self):
+        # with light load, sticky piles everything onto one node while the balancing policies use the whole grid
+        for policy in (LeastLoadedPolicy(), PowerOfTwoPolicy(random.Random(2))):
+            sim = SimulatedGrid(policy, self.grid())
+            sim.run(1000, max_duration=8)
+            self.assertTrue(all(sim.placed.values()), policy.name)
+            self.assertEqual(sim.refused, 0, policy.name)
+        sim = SimulatedGrid(StickyPolicy(), self.grid())
+        sim.run(1000, max_duration=3)
+        self.assertEqual(sim.placed["a"], 1000)
+
+
+class NodeTableTests(unittest.TestCase):
+    def test_pick_node_counts_jobs(self):
+        jobs = JobTable()
+        nodes = NodeTable(LeastLoadedPolicy())
+        with mock.patch("gridbot.entity.job_table", jobs):
+            nodes.node_seen("a", "test", capacity=1)
+            nodes.node_seen("b", "test", capacity=2)
+            self.assertEqual(nodes.pick_node().node_name, "a")
+            jobs.new_job(mock_message(), "a")
+            self.assertFalse(nodes.get_node("a").can_accept_jobs())
+            self.assertEqual(nodes.pick_node().node_name, "b")
+            jobs.new_job(mock_message(), "b")
+            jobs.new_job(mock_message(), "b")
+            self.assertIsNone(nodes.pick_node())
+
+    def test_record_startup(self):
+        nodes = NodeTable()
+        node = nodes.node_seen("a", "test")
+        self.assertIsNone(node.startup_latency)
+        node.record_startup(1.0)
+        self.assertEqual(node.startup_latency, 1.0)
+        node.record_startup(2.0)
+        self.assertAlmostEqual(node.startup_latency, 1.25)
+
+
+class StartTimeoutTests(unittest.TestCase):
+    def test_default_until_enough_samples(self):
+        node = NodeTable().node_seen("a", "test")
+        self.assertIsNone(node.startup_percentile())
+        for _ in range(node.STARTUP_MIN_SAMPLES - 1):
+            node.record_startup(0.1)
+            self.assertEqual(node.startup_timeout(), Config.START_TIMEOUT_SEC)
+
+    def test_fast_node(self):
+        node = NodeTable().node_seen("a", "test")
+        for _ in range(20):
+            node.record_startup(0.1)
+        self.assertEqual(node.startup_timeout(), Config.START_TIMEOUT_MIN_SEC)
+
+    def test_slow_tail(self):
+        node = NodeTable().node_seen("a", "test")
+        for latency in [1.0] * 18 + [9.0] * 2:
+            node.record_startup(latency)
+        self.assertEqual(node.startup_percentile(95), 9.0)
+        self.assertEqual(node.startup_percentile(50), 1.0)
+        self.assertEqual(node.startup_timeout(), 9.0 * Config.START_TIMEOUT_FACTOR)
+
+    def test_capped(self):
+        node = NodeTable().node_seen("a", "test")
+        for _ in range(10):
+            node.record_startup(100.0)
+        self.assertEqual(node.startup_timeout(), Config.START_TIMEOUT_MAX_SEC)
+
+class LivenessTests(unittest.TestCase):
+    def test_stale_node_not_picked(self):
+        nodes = NodeTable(LeastLoadedPolicy())
+        with mock.patch("gridbot.entity.job_table", JobTable()):
+            quiet = nodes.node_seen("quiet", "test")
+            chatty = nodes.node_seen("chatty", "test")
+            quiet.last_seen -= Config.NODE_STALE_SEC + 1
+            self.assertTrue(quiet.is_stale)
+            self.assertIs(nodes.pick_node(), chatty)
+            nodes.touch("quiet")
+            self.assertFalse(quiet.is_stale)
+            self.assertIs(nodes.pick_node(), quiet)
+            # touching a node that isn't in the table is harmless
+            nodes.touch("ghost")
+
+    def test_ping_rtt(self):
+        nodes = NodeTable()
+        node = nodes.node_seen("a", "test")
+        # a connect message with no ping outstanding isn't an answer
+        nodes.pong(node)
+        self.assertIsNone(node.ping_rtt)
+        with mock.patch("time.monotonic", return_value=100.0):
+            nodes.ping_sent()
+        with mock.patch("time.monotonic", return_value=100.25):
+            nodes.pong(node)
+        self.assertEqual(node.ping_rtt, 0.25)
+        # a second answer to the same ping is ignored
+        with mock.patch("time.monotonic", return_value=105.0):
+            nodes.pong(node)
+        self.assertEqual(node.ping_rtt, 0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import unittest.mock as mock
+
+from ..spool import OutputSpool
+
+
+class SpoolTests(unittest.TestCase):
+    def setUp(self):
+        # each test starts with an empty global tally
+        patcher = mock.patch.object(OutputSpool, "global_bytes", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def spool(self, **kwargs):
+        params = dict(head_size=16, tail_size=8, job_cap=1024, global_cap=4096)
+        params.update(kwargs)
+        spool = OutputSpool(**params)
+        self.addCleanup(spool.close)
+        return spool
+
+    def test_in_memory(self):
+        spool = self.spool()
+        spool.write(b"hello ")
+        spool.write(b"world")
+        self.assertFalse(spool.spilled)
+        self.assertEqual(spool.getvalue(), b"hello world")
+        self.assertEqual(spool.open_for_read().read(), b"hello world")
+
+    def test_spill(self):
+        spool = self.spool()
+        data = bytes(range(100))
+        for i in range(0, len(data), 7):
+            spool.write(data[i:i+7])
+        self.assertTrue(spool.spilled)
+        self.assertEqual(spool.size, len(data))
+        self.assertEqual(spool.getvalue(), data)
+        self.assertEqual(bytes(spool.tail), data[-8:])
+        self.assertEqual(spool.tail_bytes(4), data[-4:])
+        self.assertEqual(spool.tail_bytes(20), data[-20:])
+        with spool.mapped() as view:
+            self.assertEqual(view[10:20].tobytes(), data[10:20])
+        self.assertEqual(spool.open_for_read().read(), data)
+
+    def test_job_cap(self):
+        spool = self.spool(job_cap=10)
+        self.assertEqual(spool.write(b"12345678"), 8)
+        self.assertEqual(spool.write(b"abcd"), 2)
+        self.assertEqual(spool.write(b"efgh"), 0)
+        self.assertEqual(spool.getvalue(), b"12345678ab")
+        self.assertEqual(spool.dropped, 6)
+
+    def test_global_cap(self):
+        first = self.spool(global_cap=10)
+        second = self.spool(global_cap=10)
+        first.write(b"1234567")
+        self.assertEqual(second.write(b"abcdef"), 3)
+        self.assertEqual(OutputSpool.global_bytes, 10)
+        first.close()
+        self.assertEqual(OutputSpool.global_bytes, 3)
+        self.assertEqual(second.write(b"ghi"), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import unittest.mock as mock
+
+from ..gridbot import GridMiiBot, bot_intents
+from ..trace import MqttTracer
+
+
+def fake_message(topic: str, payload: bytes):
+    return mock.Mock(topic=topic, payload=payload)
+
+
+class TracerTests(unittest.TestCase):
+    def test_sampling(self):
+        tracer = MqttTracer(True, sample_every=3)
+        with self.assertLogs("gridbot.trace") as logs:
+            for i in range(9):
+                tracer.trace(fake_message("job/1/stdout", b"%d" % i))
+        self.assertEqual(len(logs.records), 3)
+        self.assertIn("b'2'", logs.output[0])
+
+    def test_truncation(self):
+        tracer = MqttTracer(True, max_bytes=4)
+        with self.assertLogs("gridbot.trace") as logs:
+            tracer.trace(fake_message("job/1/stdout", b"0123456789"))
+        self.assertIn("(10 bytes): b'0123'...", logs.output[0])
+
+    def test_configure(self):
+        tracer = MqttTracer()
+        tracer.configure(True, sample_every=0)
+        self.assertTrue(tracer.enabled)
+        self.assertEqual(tracer.sample_every, 1)
+        tracer.configure(False)
+        self.assertFalse(tracer.enabled)
+        self.assertEqual(tracer.sample_every, 1)
+        self.assertIn("off", str(tracer))
+
+
+class BotTracingTests(unittest.IsolatedAsyncioTestCase):
+    async def test_disabled_tracer_untouched(self):
+        # the bot's hot path only calls trace when the tracer is enabled
+        bot = GridMiiBot(intents=bot_intents)
+        with mock.patch.object(bot.tracer, "trace") as trace:
+            await bot.on_mqtt(fake_message("job/999/stdout", b"spam"))
+            trace.assert_not_called()
+            bot.tracer.configure(True)
+            await bot.on_mqtt(fake_message("job/999/stdout", b"spam"))
+            trace.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import random
 import unittest
 from ..tty_model import TtyModel
 
@@ -74,6 +75,141 @@ class BasicTtyTests(unittest.TestCase):
             actual = tty.render().strip()
             self.assertEqual(test_string, actual)
 
+class FastPathTests(unittest.TestCase):
+    @staticmethod
+    def slow_write(tty: TtyModel, data: bytes):
+        for code in data:
+            tty.write_one_char(code)
+
+    def assertSameAsSlowPath(self, chunks: list[bytes], columns=13, lines=4):
+        fast = TtyModel(columns=columns, lines=lines)
+        slow = TtyModel(columns=columns, lines=lines)
+        for chunk in chunks:
+            fast.write(chunk)
+            self.slow_write(slow, chunk)
+        self.assertEqual(fast.render(), slow.render())
+        self.assertEqual((fast.cursor_line, fast.cursor_column), (slow.cursor_line, slow.cursor_column))
+        self.assertEqual(fast.state, slow.state)
+
+    def test_long_run(self):
+        self.assertSameAsSlowPath([b"The quick brown fox jumps over the lazy dog\r\n" * 5])
+
+    def test_utf8_split_across_writes(self):
+        data = "é🤔é☉☉🤔 pokémon".encode()
+        self.assertSameAsSlowPath([data[:2], data[2:5], data[5:]])
+
+    def test_bad_utf8(self):
+        # overlong, surrogate, out of range and stray continuation bytes
+        self.assertSameAsSlowPath([b"ab\xe0\x80\x80cd\xed\xa0\x80ef\xf4\x90\x80\x80gh\x80ij"])
+
+    def test_random_bytes(self):
+        rng = random.Random(1234)
+        alphabet = b"abc \r\n\t\x08\x07" + "é☉🤔".encode() + bytes([0x80, 0xc3, 0xe2, 0xf0, 0xff])
+        for _ in range(50):
+            data = bytes(rng.choice(alphabet) for _ in range(200))
+            cut = rng.randrange(len(data))
+            self.assertSameAsSlowPath([data[:cut], data[cut:]])
+
+    def test_narrow_screen(self):
+        rng = random.Random(1234)
+        alphabet = b"ab \r\n\t\x08" + "é🤔".encode()
+        for columns in (1, 2):
+            for _ in range(20):
+                tty = TtyModel(columns=columns, lines=3)
+                tty.write(bytes(rng.choice(alphabet) for _ in range(100)))
+                self.assertEqual(len(tty.cells), columns * 3)
+                self.assertEqual(len(tty.attrs), columns * 3)
+                self.assertIn(tty.cursor_column, range(columns))
+
+class RenderCacheTests(unittest.TestCase):
+    def test_unchanged_screen_is_cached(self):
+        tty = TtyModel(columns=10, lines=3)
+        tty.write(b"abc")
+        first = tty.render()
+        self.assertFalse(tty.changed)
+        tty.write(b"\r")    # cursor movement doesn't change the screen
+        self.assertIs(tty.render(), first)
+
+    def test_only_dirty_rows_rebuilt(self):
+        tty = TtyModel(columns=10, lines=3)
+        tty.write(b"one\r\ntwo\r\nthree")
+        tty.render()
+        tty.write(b"!")
+        self.assertEqual(tty.dirty_rows, {2})
+        self.assertEqual(tty.render().split('\n')[2].rstrip(), "three!")
+
+    def test_scroll_tracking(self):
+        tty = TtyModel(columns=10, lines=3)
+        tty.write(b"one\r\ntwo\r\nthree")
+        tty.render()
+        tty.write(b"\r\nfour")
+        self.assertEqual(tty.scroll_count, 1)
+        self.assertEqual(tty.dirty_rows, {2})
+        rendered_lines = tty.render().split('\n')
+        self.assertEqual([line.rstrip() for line in rendered_lines], ["two", "three", "four"])
+        self.assertEqual(tty.scroll_count, 0)
+
+class PlaneTests(unittest.TestCase):
+    def test_scroll_reuses_planes(self):
+        tty = TtyModel(columns=4, lines=3)
+        cells, attrs = tty.cells, tty.attrs
+        for i in range(10):
+            tty.write(b"%d\r\n" % i)
+        self.assertIs(tty.cells, cells)
+        self.assertIs(tty.attrs, attrs)
+        self.assertEqual(len(tty.cells), 4 * 3)
+        self.assertEqual([line.rstrip() for line in tty.render().split('\n')], ["8", "9", ""])
+
+    def test_region_scroll_after_ring_rotation(self):
+        tty = TtyModel(columns=4, lines=4)
+        tty.write(b"a\r\nb\r\nc\r\nd\r\ne")    # rotates the ring by one
+        tty.write(b"\x1b[2;3r\x1b[3;1H\r\nf")   # then scroll rows 2-3 only
+        self.assertEqual([line.rstrip() for line in tty.render().split('\n')], ["b", "d", "f", "e"])
+
+class ScrollbackTests(unittest.TestCase):
+    def test_history(self):
+        tty = TtyModel(columns=4, lines=3, scrollback=100)
+        for i in range(6):
+            tty.write(b"%d\r\n" % i)
+        self.assertEqual(list(tty.scrollback), ["0", "1", "2", "3"])
+        self.assertEqual(tty.history(), "0\n1\n2\n3\n4\n5")
+
+    def test_bounded(self):
+        tty = TtyModel(columns=4, lines=2, scrollback=3)
+        for i in range(10):
+            tty.write(b"%d\r\n" % i)
+        self.assertEqual(list(tty.scrollback), ["6", "7", "8"])
+        self.assertEqual(tty.scrollback_dropped, 6)
+
+    def test_disabled_by_default(self):
+        tty = TtyModel(columns=4, lines=2)
+        tty.write(b"a\r\nb\r\nc")
+        self.assertEqual(len(tty.scrollback), 0)
+        self.assertEqual(tty.history(), "b\nc")
+
+    def test_region_scroll(self):
+        tty = TtyModel(columns=4, lines=4, scrollback=100)
+        tty.write(b"a\r\nb\r\nc\r\nd")
+        tty.write(b"\x1b[2;4r\x1b[4;1H\r\n")    # region below the top row
+        self.assertEqual(len(tty.scrollback), 0)
+        tty.write(b"\x1b[1;3r\x1b[3;1H\r\n")    # region at the top of the screen
+        self.assertEqual(list(tty.scrollback), ["a"])
+
+    def test_alternate_screen_not_recorded(self):
+        tty = TtyModel(columns=4, lines=2, scrollback=100)
+        tty.write(b"\x1b[?1049h")
+        for i in range(5):
+            tty.write(b"%d\r\n" % i)
+        tty.write(b"\x1b[?1049l")
+        self.assertEqual(len(tty.scrollback), 0)
+
+    def test_erase_scrollback(self):
+        tty = TtyModel(columns=4, lines=2, scrollback=100)
+        tty.write(b"a\r\nb\r\nc")
+        tty.write(b"\x1b[3J")
+        self.assertEqual(len(tty.scrollback), 0)
+
+
 class ControlC0Tests(unittest.TestCase):
     def test_backspace(self):
         BS_SEQ = b"ono\x08e"
@@ -113,4 +249,104 @@ class ControlC1Tests(unittest.TestCase):
         raise NotImplementedError
 
 class ControlSequenceTests(unittest.TestCase):
-    pass
\ No newline at end of file
+    @staticmethod
+    def lines_of(tty: TtyModel) -> list[str]:
+        return [line.rstrip() for line in tty.render().split('\n')]
+
+    def test_cursor_position(self):
+        tty = TtyModel(columns=10, lines=3)
+        tty.write(b"\x1b[2;4Hx\x1b[Hy\x1b[3;10Hz")
+        self.assertEqual(self.lines_of(tty), ["y", "   x", "         z"])
+
+    def test_cursor_relative(self):
+        tty = TtyModel(columns=10, lines=3)
+        tty.write(b"ab\x1b[Bc\x1b[2Dd\x1b[Ae\x1b[5Cf")
+        self.assertEqual(self.lines_of(tty), ["abe     f", " dc", ""])
+
+    def test_erase_line(self):
+        tty = TtyModel(columns=10, lines=2)
+        tty.write(b"0123456789\x1b[1;5H\x1b[K")
+        self.assertEqual(self.lines_of(tty), ["0123", ""])
+        tty.write(b"\x1b[2K")
+        self.assertEqual(self.lines_of(tty), ["", ""])
+
+    def test_erase_display(self):
+        tty = TtyModel(columns=5, lines=3)
+        tty.write(b"aaaaabbbbbccccc\x1b[2;3H\x1b[J")
+        self.assertEqual(self.lines_of(tty), ["aaaaa", "bb", ""])
+        tty.write(b"\x1b[1J")
+        self.assertEqual(self.lines_of(tty), ["", "", ""])
+
+    def test_no_scroll_at_last_cell(self):
+        # writing the bottom right cell must not scroll the screen (full screen programs rely on this)
+        tty = TtyModel(columns=3, lines=2)
+        tty.write(b"abcdef")
+        self.assertEqual(self.lines_of(tty), ["abc", "def"])
+        tty.write(b"g")
+        self.assertEqual(self.lines_of(tty), ["def", "g"])
+
+    def test_repaint_converges(self):
+        # a progress display that repaints in place should end up as one stable frame
+        tty = TtyModel(columns=20, lines=3)
+        for i in range(100):
+            tty.write(b"\x1b[H\x1b[2J" + b"progress: %d%%\r\n" % i + b"\x1b[1mstatus\x1b[0m")
+        self.assertEqual(self.lines_of(tty)[0], "progress: 99%")
+        self.assertEqual(tty.render().count('\n'), 2)
+
+    def test_scroll_region(self):
+        tty = TtyModel(columns=5, lines=4)
+        tty.write(b"head\x1b[2;3r\x1b[2;1Ha\r\nb\r\nc\x1b[4;1Hfoot")
+        self.assertEqual(self.lines_of(tty), ["head", "b", "c", "foot"])
+
+    def test_insert_delete_lines(self):
+        tty = TtyModel(columns=5, lines=3)
+        tty.write(b"one\r\ntwo\r\nthree\x1b[2;1H\x1b[L")
+        self.assertEqual(self.lines_of(tty), ["one", "", "two"])
+        tty.write(b"\x1b[M")
+        self.assertEqual(self.lines_of(tty), ["one", "two", ""])
+
+    def test_insert_delete_chars(self):
+        tty = TtyModel(columns=6, lines=1)
+        tty.write(b"abcdef\x1b[1;2H\x1b[2@")
+        self.assertEqual(self.lines_of(tty), ["a  bcd"])
+        tty.write(b"\x1b[3P")
+        self.assertEqual(self.lines_of(tty), ["acd"])
+
+    def test_reverse_index(self):
+        tty = TtyModel(columns=5, lines=2)
+        tty.write(b"one\r\ntwo\x1b[H\x1bM")
+        self.assertEqual(self.lines_of(tty), ["", "one"])
+
+    def test_sgr(self):
+        tty = TtyModel(columns=5, lines=1)
+        tty.write(b"a\x1b[1;31mb\x1b[0mc")
+        self.assertEqual(tty.render(), "a\x1b[0;1;31mb\x1b[0mc  ")
+
+    def test_sgr_extended_color(self):
+        tty = TtyModel(columns=3, lines=1)
+        tty.write(b"\x1b[38;2;1;2;3;4mx\x1b[38;5;2my\x1b[mz")
+        self.assertEqual(tty.render(), "\x1b[0;4mx\x1b[0;4;32my\x1b[0mz")
+
+    def test_alternate_screen(self):
+        tty = TtyModel(columns=5, lines=2)
+        tty.write(b"shell")
+        tty.write(b"\x1b[?1049h\x1b[Htop")
+        self.assertEqual(self.lines_of(tty), ["top", ""])
+        tty.write(b"\x1b[?1049l")
+        self.assertEqual(self.lines_of(tty), ["shell", ""])
+
+    def test_autowrap_off(self):
+        tty = TtyModel(columns=5, lines=2)
+        tty.write(b"\x1b[?7labcdefgh")
+        self.assertEqual(self.lines_of(tty), ["abcdh", ""])
+
+    def test_ignored_sequences(self):
+        tty = TtyModel(columns=10, lines=1)
+        tty.write(b"\x1b]0;window title\x07\x1b(Ba\x1b[?25lb\x1b[>1cc\x1b[!pd")
+        self.assertEqual(self.lines_of(tty), ["abcd"])
+
+    def test_sequence_split_across_writes(self):
+        tty = TtyModel(columns=10, lines=2)
+        for byte in b"\x1b[2;3Hx":
+            tty.write(bytes([byte]))
+        self.assertEqual(self.lines_of(tty), ["", "  x"])
\ No newline at end of file
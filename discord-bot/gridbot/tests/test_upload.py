@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import types
+import unittest
+import unittest.mock as mock
+
+from aiohttp import web
+
+from ..config import Config
+from ..xfer import FileTransferCog
+from .simulacra import *
+
+
+class UploadTestCase(unittest.IsolatedAsyncioTestCase):
+    FILES = {"tool.bin": b"\x7fELF" + b"x" * 100_000, "notes.txt": b"hello\n"}
+
+    async def asyncSetUp(self):
+        # requests from the bot, and from the upload script's curl
+        self.requests = 0
+        self.node_requests = 0
+        async def serve_file(request: web.Request):
+            if request.headers.get("User-Agent", "").startswith("curl/"):
+                self.node_requests += 1
+            else:
+                self.requests += 1
+            if request.match_info["name"] not in self.FILES:
+                raise web.HTTPNotFound()
+            return web.Response(body=self.FILES[request.match_info["name"]])
+        app = web.Application()
+        app.router.add_get("/attachments/{name}", serve_file)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        self.addAsyncCleanup(self.runner.cleanup)
+        host, port = self.runner.addresses[0][:2]
+        self.base = f"http://{host}:{port}"
+        self.bot = mock_bot()
+        self.bot.submit_job = mock.AsyncMock()
+        self.cog = FileTransferCog(self.bot)
+        self.addAsyncCleanup(self.cog.cog_unload)
+
+    def attachment(self, name: str):
+        return types.SimpleNamespace(url=f"{self.base}/attachments/{name}", filename=name,
+                                     size=len(self.FILES.get(name, b"")))
+
+    def context(self, *names: str):
+        ctx = mock_context()
+        ctx.message.attachments = [self.attachment(name) for name in names]
+        return ctx
+
+    async def upload(self, *names: str) -> str:
+        """Run !upload with these attachments and return the job's script"""
+        await self.cog.upload(self.cog, self.context(*names))
+        return self.bot.submit_job.call_args.args[1]
+
+
+class UploadCommandTests(UploadTestCase):
+    async def test_no_attachments(self):
+        ctx = self.context()
+        await self.cog.upload(self.cog, ctx)
+        ctx.reply.assert_called_with(":x: You need to attach one or more files")
+        self.bot.submit_job.assert_not_called()
+
+    async def test_first_upload_not_hashed(self):
+        # no file of these sizes was uploaded before, so no node can have them cached
+        script = await self.upload("tool.bin", "notes.txt")
+        self.assertEqual(self.requests, 0)
+        for name in self.FILES:
+            self.assertIn(f"fetch {self.base}/attachments/{name} {name} '' &", script)
+
+    async def test_several_attachments(self):
+        await self.upload("tool.bin", "notes.txt")
+        script = await self.upload("tool.bin", "notes.txt")
+        for name, content in self.FILES.items():
+            self.assertIn(f"fetch {self.base}/attachments/{name} {name} {hashlib.sha256(content).hexdigest()} &",
+                          script)
+
+    async def test_hash_failure(self):
+        attachment = self.attachment("missing")
+        self.assertIsNone(await self.cog.hash_attachment(attachment))
+
+    async def test_large_attachment_not_hashed(self):
+        await self.upload("tool.bin", "notes.txt")
+        with mock.patch.object(Config, "UPLOAD_CACHE_MAX_BYTES", 1000):
+            script = await self.upload("tool.bin", "notes.txt")
+        # only the small file is read by the bot
+        self.assertEqual(self.requests, 1)
+        self.assertIn(f"fetch {self.base}/attachments/tool.bin tool.bin '' &", script)
+        # a file that turns out to be bigger than Discord said is given up on part way
+        attachment = self.attachment("tool.bin")
+        attachment.size = 10
+        with mock.patch.object(Config, "UPLOAD_CACHE_MAX_BYTES", 1000):
+            self.assertIsNone(await self.cog.hash_attachment(attachment))
+
+    async def test_cache_disabled(self):
+        with mock.patch.object(Config, "UPLOAD_CACHE_DAYS", 0):
+            script = await self.upload("notes.txt")
+        self.assertEqual(self.requests, 0)
+        self.assertIn(f"fetch {self.base}/attachments/notes.txt notes.txt '' &", script)
+
+
+@unittest.skipUnless(shutil.which("curl") and shutil.which("sh"), "needs curl and a shell")
+class UploadScriptTests(UploadTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        work = tempfile.TemporaryDirectory()
+        self.addCleanup(work.cleanup)
+        self.work = work.name
+        self.cache = os.path.join(self.work, "cache")
+
+    async def run_script(self, script: str, cwd: str) -> tuple[int, str]:
+        os.makedirs(cwd, exist_ok=True)
+        env = dict(os.environ, XDG_CACHE_HOME=self.cache)
+        proc = await asyncio.create_subprocess_exec("sh", "-c", script, cwd=cwd, env=env,
+                                                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        output, _ = await asyncio.wait_for(proc.communicate(), 30)
+        return proc.returncode, output.decode()
+
+    def assert_files(self, directory: str):
+        for name, content in self.FILES.items():
+            with open(os.path.join(directory, name), "rb") as f:
+                self.assertEqual(f.read(), content)
+
+    async def test_repeat_upload_uses_cache(self):
+        script = await self.upload("tool.bin", "notes.txt")
+        status, output = await self.run_script(script, os.path.join(self.work, "first"))
+        self.assertEqual(status, 0, output)
+        self.assert_files(os.path.join(self.work, "first"))
+        if not shutil.which("sha256sum"):
+            self.skipTest("needs sha256sum to fill the cache")
+
+        self.assertEqual((self.requests, self.node_requests), (0, 2))
+
+        # the second time around, the bot reads each file once to hash it, and the node fetches nothing
+        self.requests = self.node_requests = 0
+        script = await self.upload("tool.bin", "notes.txt")
+        status, output = await self.run_script(script, os.path.join(self.work, "second"))
+        self.assertEqual(status, 0, output)
+        self.assertEqual((self.requests, self.node_requests), (2, 0))
+        self.assertIn("tool.bin (cached)", output)
+        self.assert_files(os.path.join(self.work, "second"))
+
+    async def test_failed_fetch(self):
+        script = self.cog.upload_script([self.attachment("notes.txt"), self.attachment("missing")], [None, None])
+        status, output = await self.run_script(script, self.work)
+        self.assertNotEqual(status, 0)
+        with open(os.path.join(self.work, "notes.txt"), "rb") as f:
+            self.assertEqual(f.read(), self.FILES["notes.txt"])
+
+
+if __name__ == '__main__':
+    unittest.main()
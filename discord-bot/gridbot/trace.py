@@ -0,0 +1,43 @@
+# sampled logging of MQTT traffic that costs nothing while it's off
+import logging
+
+import aiomqtt
+
+
+class MqttTracer:
+    """Logs inbound MQTT messages, truncating payloads and sampling 1 in `sample_every` messages.
+    Callers check `enabled` before calling `trace`, so a disabled tracer costs one attribute lookup per message
+    and payloads are never formatted."""
+
+    logger = logging.getLogger("gridbot.trace")
+
+    def __init__(self, enabled: bool = False, sample_every: int = 1, max_bytes: int = 64):
+        self.enabled = enabled
+        self.sample_every = sample_every
+        self.max_bytes = max_bytes
+        self._seen = 0
+
+    def configure(self, enabled: bool|None = None, sample_every: int|None = None, max_bytes: int|None = None):
+        """Change the tracer's settings at runtime. Settings that aren't given are left alone."""
+        if sample_every is not None:
+            self.sample_every = max(sample_every, 1)
+        if max_bytes is not None:
+            self.max_bytes = max(max_bytes, 0)
+        if enabled is not None:
+            self.enabled = enabled
+            self._seen = 0
+
+    def trace(self, msg: aiomqtt.Message):
+        self._seen += 1
+        if self._seen % self.sample_every:
+            return
+        payload = msg.payload if isinstance(msg.payload, (bytes, bytearray)) else str(msg.payload).encode()
+        # slice before formatting, so big payloads aren't copied into the log line
+        shown = payload[:self.max_bytes]
+        ellipsis = "..." if len(payload) > len(shown) else ""
+        self.logger.info("MQTT %s (%d bytes): %r%s", msg.topic, len(payload), shown, ellipsis)
+
+    def __str__(self):
+        state = "on" if self.enabled else "off"
+        return f"tracing is {state}, logging 1 in {self.sample_every} messages, up to {self.max_bytes} bytes of payload"
+
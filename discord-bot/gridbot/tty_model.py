@@ -1,56 +1,406 @@
 # back end for the tty emulation
+import collections
 import enum
+import functools
+import itertools
+import re
+from array import array
 
-
-def make_row(columns, fill=' '):
-    return [fill for _ in range(columns)]
-
-def make_plane(rows, columns, fill=' '):
-    return [make_row(columns, fill) for _ in range(rows)]
+# A run of printable ASCII and complete UTF-8 sequences. These can be copied into the plane wholesale
+# instead of going through the state machine one byte at a time.
+PRINTABLE_RUN = re.compile(
+    rb'(?:[\x20-\x7f]|[\xc2-\xdf][\x80-\xbf]|[\xe0-\xef][\x80-\xbf]{2}|[\xf0-\xf4][\x80-\xbf]{3})+')
 
 class TtyState(enum.Enum):
     NORMAL = 0,         # normal ASCII processing
     UTF8_THREE = 1,     # three bytes remaining in the UTF-8 character
     UTF8_TWO = 2,       # two bytes remaining in the UTF-8 character
     UTF8_ONE = 3,       # one byte remaining in the UTF-8 character
-    #ESC = 4,           # ESC mode
-    #CSI = 5            # CSI mode
+    ESC = 4,            # ESC mode
+    CSI = 5,            # CSI mode
+    OSC = 6,            # operating system command; swallowed until BEL or ST
+    CHARSET = 7,        # ESC ( and friends designate a character set with the next byte, which we ignore
+
+## SGR attributes ##
+# Each cell's attributes are packed into an int. 0 is the default rendition.
+ATTR_BOLD = 1 << 0
+ATTR_UNDERLINE = 1 << 1
+# colors are 5 bit fields: 0 = default, 1-8 = colors 30-37/40-47, 9-16 = bright colors 90-97/100-107
+ATTR_FG_SHIFT = 2
+ATTR_BG_SHIFT = 7
+ATTR_COLOR_MASK = 0x1F
+
+def attr_with_color(attr: int, shift: int, color: int) -> int:
+    return (attr & ~(ATTR_COLOR_MASK << shift)) | (color << shift)
+
+@functools.cache
+def sgr_for_attr(attr: int) -> str:
+    """The escape sequence that selects these attributes, starting from a reset.
+    Discord's ansi code blocks only understand bold, underline and the eight basic colors,
+    so bright colors are approximated."""
+    params = ["0"]
+    fg = (attr >> ATTR_FG_SHIFT) & ATTR_COLOR_MASK
+    bg = (attr >> ATTR_BG_SHIFT) & ATTR_COLOR_MASK
+    if attr & ATTR_BOLD or fg > 8:
+        params.append("1")
+    if attr & ATTR_UNDERLINE:
+        params.append("4")
+    if fg:
+        params.append(str(30 + (fg - 1) % 8))
+    if bg:
+        params.append(str(40 + (bg - 1) % 8))
+    return f"\x1b[{';'.join(params)}m"
+
+def arg(params: list[int], index: int, default: int = 1) -> int:
+    """Fetch a numeric CSI parameter. Missing and zero parameters take the default."""
+    if index < len(params) and params[index]:
+        return params[index]
+    return default
+
+## dispatch tables ##
+# These map a byte to the name of the TtyModel method that handles it. Bytes that aren't listed are ignored.
+
+# C0 control codes. These are acted on in every state except OSC.
+# Not listed: NUL, SOH-ACK, SO/SI, DLE, DC1-DC4 (XON/XOFF), NAK-ETB, EM, FS-US
+C0_ACTIONS = {
+    0x07: "bell",               # BEL
+    0x08: "backspace",          # BS
+    0x09: "horizontal_tab",     # HT
+    0x0A: "line_feed",          # LF
+    0x0B: "vertical_tab",       # VT
+    0x0C: "form_feed",          # FF
+    0x0D: "carriage_return",    # CR
+    0x18: "cancel",             # CAN
+    0x1A: "cancel",             # SUB
+    0x1B: "escape",             # ESC
+}
+
+# final byte of ESC sequences
+ESC_ACTIONS = {
+    ord('['): "control_sequence",
+    ord(']'): "operating_system_command",
+    ord('('): "designate_charset",
+    ord(')'): "designate_charset",
+    ord('*'): "designate_charset",
+    ord('+'): "designate_charset",
+    ord('D'): "index",
+    ord('E'): "next_line",
+    ord('M'): "reverse_index",
+    ord('7'): "save_cursor",
+    ord('8'): "restore_cursor",
+    ord('c'): "reset",
+}
+
+# final byte of CSI sequences. Handlers take the list of numeric parameters.
+CSI_ACTIONS = {
+    ord('@'): "insert_chars",               # ICH
+    ord('A'): "cursor_up",                  # CUU
+    ord('B'): "cursor_down",                # CUD
+    ord('C'): "cursor_forward",             # CUF
+    ord('D'): "cursor_back",                # CUB
+    ord('E'): "cursor_next_line",           # CNL
+    ord('F'): "cursor_previous_line",       # CPL
+    ord('G'): "cursor_column_absolute",     # CHA
+    ord('`'): "cursor_column_absolute",     # HPA
+    ord('H'): "cursor_position",            # CUP
+    ord('f'): "cursor_position",            # HVP
+    ord('J'): "erase_display",              # ED
+    ord('K'): "erase_line",                 # EL
+    ord('L'): "insert_lines",               # IL
+    ord('M'): "delete_lines",               # DL
+    ord('P'): "delete_chars",               # DCH
+    ord('S'): "scroll_up",                  # SU
+    ord('T'): "scroll_down",                # SD
+    ord('X'): "erase_chars",                # ECH
+    ord('d'): "line_position_absolute",     # VPA
+    ord('m'): "select_graphic_rendition",   # SGR
+    ord('r'): "set_scroll_region",          # DECSTBM
+    ord('s'): "save_cursor",                # SCOSC
+    ord('u'): "restore_cursor",             # SCORC
+}
+
+# DEC private modes (CSI ? n h/l) that switch to the alternate screen
+ALT_SCREEN_MODES = {47, 1047, 1049}
+# DEC private mode for autowrap
+AUTOWRAP_MODE = 7
 
 class TtyModel:
-    def __init__(self, columns=40, lines=20):
+    def __init__(self, columns=40, lines=20, scrollback=0):
         self.columns = columns
         self.lines = lines
-        self.char_plane = make_plane(lines, columns)
+        # Rows that scrolled off the top of the screen, as plain text with trailing blanks removed.
+        # Once it's full, the oldest rows are dropped.
+        self.scrollback: collections.deque[str] = collections.deque(maxlen=scrollback)
+        self.scrollback_dropped = 0
+        # The character and attribute planes are flat arrays holding one physical row after another.
+        # Screen rows map to physical rows through a ring (row_start) over row_index, so scrolling the
+        # whole screen just blanks a row and advances row_start. Scroll regions permute row_index.
+        self.cells = array('w', ' ' * (lines * columns))
+        self.attrs = array('H', [0]) * (lines * columns)
+        self.row_index = list(range(lines))
+        self.row_start = 0
+        # physical rows that may contain non-default attributes
+        self.row_styled = [False] * lines
+        self.blank_cells = array('w', ' ' * columns)
+        self.blank_attrs = array('H', [0]) * columns
         self.cursor_line = 0
         self.cursor_column = 0
+        # Like a VT100, writing to the last column leaves the cursor there until the next printable character
+        self.wrap_pending = False
+        self.autowrap = True
+        self.attr = 0
+        self.top_margin = 0
+        self.bottom_margin = lines - 1
+        self.saved_cursor: tuple[int, int, int] = (0, 0, 0)
+        self.saved_screen: tuple[array, array, list[int], int, list[bool]]|None = None
         self.state = TtyState.NORMAL
         self.utf8_buffer: list[int] = []
+        self.csi_params = bytearray()
+        self.csi_intermediates = bytearray()
+        # render cache, indexed by physical row: each row's string, or None if the row changed since it was
+        # last rendered. Since the cache follows physical rows, scrolling doesn't disturb it.
+        self.row_cache: list[str|None] = [None] * lines
+        self.screen_cache: str|None = None
+        # scroll events since the last render
+        self.scroll_count = 0
+        # bind the dispatch tables to this instance
+        self.state_table = {
+            TtyState.NORMAL: self.write_normal,
+            TtyState.UTF8_THREE: self.write_utf8,
+            TtyState.UTF8_TWO: self.write_utf8,
+            TtyState.UTF8_ONE: self.write_utf8,
+            TtyState.ESC: self.write_esc,
+            TtyState.CSI: self.write_csi,
+            TtyState.OSC: self.write_osc,
+            TtyState.CHARSET: self.write_charset,
+        }
+        self.c0_table = {code: getattr(self, name) for code, name in C0_ACTIONS.items()}
+        self.esc_table = {code: getattr(self, name) for code, name in ESC_ACTIONS.items()}
+        self.csi_table = {code: getattr(self, name) for code, name in CSI_ACTIONS.items()}
+
+    ## rendering ##
+
+    @property
+    def changed(self) -> bool:
+        """True if the screen may have changed since the last render"""
+        return self.screen_cache is None
+
+    @property
+    def dirty_rows(self) -> set[int]:
+        """Screen rows that changed since the last render"""
+        return {line for line in range(self.lines) if self.row_cache[self.physical_row(line)] is None}
+
+    def physical_row(self, line: int) -> int:
+        """The physical row that holds the given screen row"""
+        return self.row_index[(self.row_start + line) % self.lines]
+
+    def row_offset(self, line: int) -> int:
+        """Index of the first cell of the given screen row in the planes"""
+        return self.row_index[(self.row_start + line) % self.lines] * self.columns
+
+    def touch_row(self, line: int):
+        """Mark a row as needing to be rendered again"""
+        self.row_cache[self.physical_row(line)] = None
+        self.screen_cache = None
+
+    def render_physical_row(self, row: int) -> str:
+        """Convert one physical row to a string, with escape sequences for any attributes"""
+        start = row * self.columns
+        end = start + self.columns
+        text = self.cells[start:end].tounicode()
+        if not self.row_styled[row]:
+            return text
+        parts = []
+        current = 0
+        for char, attr in zip(text, self.attrs[start:end]):
+            if attr != current:
+                parts.append(sgr_for_attr(attr))
+                current = attr
+            parts.append(char)
+        if current:
+            parts.append(sgr_for_attr(0))
+        return ''.join(parts)
+
+    def render_row(self, line: int) -> str:
+        """Convert one screen row to a string, with escape sequences for any attributes"""
+        return self.render_physical_row(self.physical_row(line))
+
+    def plain_row(self, line: int) -> str:
+        """One screen row as plain text, without attributes or trailing blanks"""
+        start = self.row_offset(line)
+        return self.cells[start:start+self.columns].tounicode().rstrip()
+
+    def history(self) -> str:
+        """The scrollback followed by the screen, as plain text.
+        Blank rows at the bottom of the screen are left out."""
+        screen = [self.plain_row(line) for line in range(self.lines)]
+        while screen and not screen[-1]:
+            screen.pop()
+        return '\n'.join(itertools.chain(self.scrollback, screen))
+
+    def save_to_scrollback(self, row: int):
+        """Record a physical row that is about to scroll off the top of the screen"""
+        if self.scrollback.maxlen == 0 or self.saved_screen is not None:
+            # no scrollback, or the alternate screen is up (which doesn't have any)
+            return
+        if len(self.scrollback) == self.scrollback.maxlen:
+            self.scrollback_dropped += 1
+        start = row * self.columns
+        self.scrollback.append(self.cells[start:start+self.columns].tounicode().rstrip())
 
     def render(self) -> str:
-        """Convert the character plane to a single string"""
-        return '\n'.join(''.join(c for c in line) for line in self.char_plane)
+        """Convert the character plane to a single string.
+        Only rows that changed since the last render are rebuilt."""
+        if self.screen_cache is None:
+            index, start, lines = self.row_index, self.row_start, self.lines
+            order = [index[(start + line) % lines] for line in range(lines)]
+            cache = self.row_cache
+            for row in order:
+                if cache[row] is None:
+                    cache[row] = self.render_physical_row(row)
+            self.scroll_count = 0
+            self.screen_cache = '\n'.join([cache[row] for row in order])
+        return self.screen_cache
+
+    ## plane manipulation ##
+
+    def clear_cells(self, line: int, start: int, end: int):
+        """Blank the cells of a row from start up to (but not including) end"""
+        end = min(end, self.columns)
+        if start >= end:
+            return
+        if start == 0 and end == self.columns:
+            self.blank_physical_row(self.physical_row(line))
+            self.screen_cache = None
+            return
+        offset = self.row_offset(line)
+        self.cells[offset+start:offset+end] = self.blank_cells[start:end]
+        self.attrs[offset+start:offset+end] = self.blank_attrs[start:end]
+        self.touch_row(line)
+
+    def blank_physical_row(self, row: int):
+        """Blank a whole physical row, copying from preallocated blanks"""
+        start = row * self.columns
+        self.cells[start:start+self.columns] = self.blank_cells
+        self.attrs[start:start+self.columns] = self.blank_attrs
+        self.row_styled[row] = False
+        self.row_cache[row] = None
+
+    def scroll_rows_up(self, top: int, bottom: int, count: int = 1):
+        """Move rows top through bottom up by `count`, blanking the rows that open up at the bottom"""
+        count = min(count, bottom - top + 1)
+        if count <= 0:
+            return
+        if top == 0 and bottom == self.lines - 1:
+            # the whole screen scrolls, so rotate the ring: the top row becomes the new, blank, bottom row
+            for _ in range(count):
+                row = self.physical_row(0)
+                self.save_to_scrollback(row)
+                self.blank_physical_row(row)
+                self.row_start = (self.row_start + 1) % self.lines
+        else:
+            slots = [(self.row_start + line) % self.lines for line in range(top, bottom + 1)]
+            rows = [self.row_index[slot] for slot in slots]
+            if top == 0:
+                # a region at the top of the screen scrolls into the scrollback too
+                for row in rows[:count]:
+                    self.save_to_scrollback(row)
+            rows = rows[count:] + rows[:count]
+            for slot, row in zip(slots, rows):
+                self.row_index[slot] = row
+            for row in rows[-count:]:
+                self.blank_physical_row(row)
+        self.screen_cache = None
+        self.scroll_count += count
+
+    def scroll_rows_down(self, top: int, bottom: int, count: int = 1):
+        """Move rows top through bottom down by `count`, blanking the rows that open up at the top"""
+        count = min(count, bottom - top + 1)
+        if count <= 0:
+            return
+        if top == 0 and bottom == self.lines - 1:
+            for _ in range(count):
+                self.row_start = (self.row_start - 1) % self.lines
+                self.blank_physical_row(self.physical_row(0))
+        else:
+            slots = [(self.row_start + line) % self.lines for line in range(top, bottom + 1)]
+            rows = [self.row_index[slot] for slot in slots]
+            rows = rows[-count:] + rows[:-count]
+            for slot, row in zip(slots, rows):
+                self.row_index[slot] = row
+            for row in rows[:count]:
+                self.blank_physical_row(row)
+        self.screen_cache = None
+        self.scroll_count += count
+
+    def scroll(self):
+        """Scroll the scroll region up one line"""
+        self.scroll_rows_up(self.top_margin, self.bottom_margin)
+
+    ## printing ##
 
     def put_one_char(self, char: str):
-        self.char_plane[self.cursor_line][self.cursor_column] = char
-        self.cursor_column += 1
-        if self.cursor_column >= self.columns:
-            # wrap
+        if self.wrap_pending:
             self.carriage_return()
             self.line_feed()
+        row = self.physical_row(self.cursor_line)
+        index = row * self.columns + self.cursor_column
+        self.cells[index] = char
+        self.attrs[index] = self.attr
+        if self.attr:
+            self.row_styled[row] = True
+        self.row_cache[row] = None
+        self.screen_cache = None
+        if self.cursor_column < self.columns - 1:
+            self.cursor_column += 1
+        else:
+            self.wrap_pending = self.autowrap
+
+    def put_run(self, text: str):
+        """Write a run of printable characters, copying as much as fits on the current line at once"""
+        pos = 0
+        while pos < len(text):
+            if self.wrap_pending:
+                self.carriage_return()
+                self.line_feed()
+            room = self.columns - self.cursor_column
+            if not self.autowrap and len(text) - pos > room:
+                # without autowrap, everything past the margin lands on the last column
+                chunk = text[pos:pos+room-1] + text[-1]
+                pos = len(text)
+            else:
+                chunk = text[pos:pos+room]
+                pos += len(chunk)
+            start = self.cursor_column
+            end = start + len(chunk)
+            row = self.physical_row(self.cursor_line)
+            offset = row * self.columns
+            self.cells[offset+start:offset+end] = array('w', chunk)
+            if self.attr:
+                self.attrs[offset+start:offset+end] = array('H', [self.attr]) * len(chunk)
+                self.row_styled[row] = True
+            else:
+                self.attrs[offset+start:offset+end] = self.blank_attrs[start:end]
+            self.row_cache[row] = None
+            self.screen_cache = None
+            if end < self.columns:
+                self.cursor_column = end
+            else:
+                self.cursor_column = self.columns - 1
+                self.wrap_pending = self.autowrap
+
+    ## C0 controls ##
 
     def carriage_return(self):
         self.cursor_column = 0
+        self.wrap_pending = False
 
     def line_feed(self):
-        self.cursor_line += 1
-        if self.cursor_line >= self.lines:
+        self.wrap_pending = False
+        if self.cursor_line == self.bottom_margin:
             self.scroll()
-
-    def scroll(self):
-        new_row = make_row(self.columns)
-        del self.char_plane[0]
-        self.char_plane.append(new_row)
-        self.cursor_line -= 1
+        elif self.cursor_line < self.lines - 1:
+            self.cursor_line += 1
 
     def vertical_tab(self):
         self.line_feed()
@@ -60,7 +410,10 @@ class TtyModel:
         pass
 
     def backspace(self):
-        if self.cursor_column > 0:
+        if self.wrap_pending:
+            self.wrap_pending = False
+            self.cursor_column = max(self.cursor_column - 1, 0)
+        elif self.cursor_column > 0:
             self.cursor_column -= 1
         elif self.cursor_line > 0:
             self.cursor_column = self.columns - 1
@@ -68,6 +421,7 @@ class TtyModel:
 
     def horizontal_tab(self):
         TAB_WIDTH = 8
+        self.wrap_pending = False
         last_tab = self.cursor_column // TAB_WIDTH
         next_tab = last_tab + 1
         self.cursor_column = next_tab * TAB_WIDTH
@@ -77,63 +431,252 @@ class TtyModel:
     def form_feed(self):
         self.line_feed()
 
+    def cancel(self):
+        """CAN/SUB abort any sequence in progress"""
+        self.state = TtyState.NORMAL
+
+    def escape(self):
+        self.state = TtyState.ESC
+        self.csi_params.clear()
+        self.csi_intermediates.clear()
+
+    ## ESC sequences ##
+
+    def control_sequence(self):
+        self.state = TtyState.CSI
+
+    def operating_system_command(self):
+        self.state = TtyState.OSC
+
+    def designate_charset(self):
+        self.state = TtyState.CHARSET
+
+    def index(self):
+        self.line_feed()
+
+    def next_line(self):
+        self.carriage_return()
+        self.line_feed()
+
+    def reverse_index(self):
+        self.wrap_pending = False
+        if self.cursor_line == self.top_margin:
+            self.scroll_rows_down(self.top_margin, self.bottom_margin)
+        elif self.cursor_line > 0:
+            self.cursor_line -= 1
+
+    def save_cursor(self, params: list[int]|None = None):
+        self.saved_cursor = (self.cursor_line, self.cursor_column, self.attr)
+
+    def restore_cursor(self, params: list[int]|None = None):
+        self.cursor_line, self.cursor_column, self.attr = self.saved_cursor
+        self.wrap_pending = False
+
+    def reset(self):
+        """Full reset (RIS)"""
+        self.erase_display([2])
+        self.cursor_line = self.cursor_column = 0
+        self.wrap_pending = False
+        self.autowrap = True
+        self.attr = 0
+        self.top_margin = 0
+        self.bottom_margin = self.lines - 1
+        self.saved_cursor = (0, 0, 0)
+        self.saved_screen = None
+
+    ## CSI sequences ##
+
+    def move_cursor(self, line: int, column: int):
+        """Move the cursor, keeping it on the screen"""
+        self.cursor_line = max(0, min(self.lines - 1, line))
+        self.cursor_column = max(0, min(self.columns - 1, column))
+        self.wrap_pending = False
+
+    def cursor_up(self, params: list[int]):
+        # the cursor stops at the top margin if it starts inside the scroll region
+        limit = self.top_margin if self.cursor_line >= self.top_margin else 0
+        self.move_cursor(max(limit, self.cursor_line - arg(params, 0)), self.cursor_column)
+
+    def cursor_down(self, params: list[int]):
+        limit = self.bottom_margin if self.cursor_line <= self.bottom_margin else self.lines - 1
+        self.move_cursor(min(limit, self.cursor_line + arg(params, 0)), self.cursor_column)
+
+    def cursor_forward(self, params: list[int]):
+        self.move_cursor(self.cursor_line, self.cursor_column + arg(params, 0))
+
+    def cursor_back(self, params: list[int]):
+        self.move_cursor(self.cursor_line, self.cursor_column - arg(params, 0))
+
+    def cursor_next_line(self, params: list[int]):
+        self.cursor_down(params)
+        self.cursor_column = 0
+
+    def cursor_previous_line(self, params: list[int]):
+        self.cursor_up(params)
+        self.cursor_column = 0
+
+    def cursor_column_absolute(self, params: list[int]):
+        self.move_cursor(self.cursor_line, arg(params, 0) - 1)
+
+    def line_position_absolute(self, params: list[int]):
+        self.move_cursor(arg(params, 0) - 1, self.cursor_column)
+
+    def cursor_position(self, params: list[int]):
+        self.move_cursor(arg(params, 0) - 1, arg(params, 1) - 1)
+
+    def erase_display(self, params: list[int]):
+        mode = params[0] if params else 0
+        if mode == 0:
+            # cursor to end of screen
+            self.clear_cells(self.cursor_line, self.cursor_column, self.columns)
+            lines = range(self.cursor_line + 1, self.lines)
+        elif mode == 1:
+            # start of screen to cursor
+            self.clear_cells(self.cursor_line, 0, self.cursor_column + 1)
+            lines = range(0, self.cursor_line)
+        else:
+            # the whole screen, and 3 also clears the scrollback
+            lines = range(self.lines)
+            if mode == 3:
+                self.scrollback.clear()
+        for line in lines:
+            self.clear_cells(line, 0, self.columns)
+
+    def erase_line(self, params: list[int]):
+        mode = params[0] if params else 0
+        if mode == 0:
+            self.clear_cells(self.cursor_line, self.cursor_column, self.columns)
+        elif mode == 1:
+            self.clear_cells(self.cursor_line, 0, self.cursor_column + 1)
+        else:
+            self.clear_cells(self.cursor_line, 0, self.columns)
+
+    def erase_chars(self, params: list[int]):
+        self.clear_cells(self.cursor_line, self.cursor_column, self.cursor_column + arg(params, 0))
+
+    def insert_chars(self, params: list[int]):
+        count = min(arg(params, 0), self.columns - self.cursor_column)
+        line, column = self.cursor_line, self.cursor_column
+        offset = self.row_offset(line)
+        end = offset + self.columns
+        for plane in (self.cells, self.attrs):
+            plane[offset+column+count:end] = plane[offset+column:end-count]
+        self.clear_cells(line, column, column + count)
+
+    def delete_chars(self, params: list[int]):
+        count = min(arg(params, 0), self.columns - self.cursor_column)
+        line, column = self.cursor_line, self.cursor_column
+        offset = self.row_offset(line)
+        end = offset + self.columns
+        for plane in (self.cells, self.attrs):
+            plane[offset+column:end-count] = plane[offset+column+count:end]
+        self.clear_cells(line, self.columns - count, self.columns)
+
+    def insert_lines(self, params: list[int]):
+        if self.top_margin <= self.cursor_line <= self.bottom_margin:
+            self.scroll_rows_down(self.cursor_line, self.bottom_margin, arg(params, 0))
+            self.carriage_return()
+
+    def delete_lines(self, params: list[int]):
+        if self.top_margin <= self.cursor_line <= self.bottom_margin:
+            self.scroll_rows_up(self.cursor_line, self.bottom_margin, arg(params, 0))
+            self.carriage_return()
+
+    def scroll_up(self, params: list[int]):
+        self.scroll_rows_up(self.top_margin, self.bottom_margin, arg(params, 0))
+
+    def scroll_down(self, params: list[int]):
+        self.scroll_rows_down(self.top_margin, self.bottom_margin, arg(params, 0))
+
+    def set_scroll_region(self, params: list[int]):
+        top = arg(params, 0) - 1
+        bottom = min(arg(params, 1, self.lines), self.lines) - 1
+        if top < bottom:
+            self.top_margin = top
+            self.bottom_margin = bottom
+            self.move_cursor(0, 0)
+
+    def set_private_mode(self, params: list[int], enable: bool):
+        """DECSET/DECRST. Modes that don't affect what ends up on the screen are ignored."""
+        for mode in params:
+            if mode == AUTOWRAP_MODE:
+                self.autowrap = enable
+                if not enable:
+                    self.wrap_pending = False
+            elif mode in ALT_SCREEN_MODES:
+                self.alternate_screen(enable, save_cursor=(mode == 1049))
+
+    def alternate_screen(self, enable: bool, save_cursor=False):
+        """Switch to or from the alternate screen. Full screen programs use it so the original screen
+        comes back when they exit."""
+        if enable and self.saved_screen is None:
+            if save_cursor:
+                self.save_cursor()
+            self.saved_screen = (self.cells[:], self.attrs[:], self.row_index[:], self.row_start, self.row_styled[:])
+            self.erase_display([2])
+        elif not enable and self.saved_screen is not None:
+            self.cells, self.attrs, self.row_index, self.row_start, self.row_styled = self.saved_screen
+            self.saved_screen = None
+            self.row_cache = [None] * self.lines
+            self.screen_cache = None
+            if save_cursor:
+                self.restore_cursor()
+
+    def select_graphic_rendition(self, params: list[int]):
+        if not params:
+            params = [0]
+        attr = self.attr
+        i = 0
+        while i < len(params):
+            p = params[i]
+            if p == 0:
+                attr = 0
+            elif p == 1:
+                attr |= ATTR_BOLD
+            elif p == 4:
+                attr |= ATTR_UNDERLINE
+            elif p == 22:
+                attr &= ~ATTR_BOLD
+            elif p == 24:
+                attr &= ~ATTR_UNDERLINE
+            elif 30 <= p <= 37:
+                attr = attr_with_color(attr, ATTR_FG_SHIFT, p - 30 + 1)
+            elif p == 39:
+                attr = attr_with_color(attr, ATTR_FG_SHIFT, 0)
+            elif 40 <= p <= 47:
+                attr = attr_with_color(attr, ATTR_BG_SHIFT, p - 40 + 1)
+            elif p == 49:
+                attr = attr_with_color(attr, ATTR_BG_SHIFT, 0)
+            elif 90 <= p <= 97:
+                attr = attr_with_color(attr, ATTR_FG_SHIFT, p - 90 + 9)
+            elif 100 <= p <= 107:
+                attr = attr_with_color(attr, ATTR_BG_SHIFT, p - 100 + 9)
+            elif p in (38, 48) and i + 1 < len(params):
+                shift = ATTR_FG_SHIFT if p == 38 else ATTR_BG_SHIFT
+                if params[i+1] == 5 and i + 2 < len(params):
+                    # 256 color palette; only the first 16 entries map onto colors we can show
+                    color = params[i+2]
+                    if color < 16:
+                        attr = attr_with_color(attr, shift, color + 1)
+                    i += 2
+                elif params[i+1] == 2:
+                    # 24 bit color isn't representable, so skip over r;g;b
+                    i += 4
+            i += 1
+        self.attr = attr
+
+    ## state machine ##
+
     def write_one_char(self, code: int):
         """Write one character by byte value"""
-        match self.state:
-            case TtyState.NORMAL:
-                self.write_normal(code)
-            case TtyState.UTF8_THREE | TtyState.UTF8_TWO | TtyState.UTF8_ONE:
-                self.write_utf8(code)
-            case _:
-                raise RuntimeError("unknown tty state")
+        self.state_table[self.state](code)
 
     def write_normal(self, code: int):
         if code < 32:
             # ASCII control code
-            match code:
-                case 0:
-                    pass  # NUL (explicitly do nothing)
-                case 1 | 2 | 3 | 4 | 5 | 6:
-                    # SOH | STX | ETX | EOT | ENQ | ACK
-                    pass
-                case 7:
-                    self.bell()
-                case 8:
-                    self.backspace()
-                case 9:
-                    self.horizontal_tab()
-                case 10:
-                    self.line_feed()
-                case 11:
-                    self.vertical_tab()
-                case 12:
-                    self.form_feed()
-                case 13:
-                    self.carriage_return()
-                case 14 | 15:
-                    # SO | SI
-                    pass
-
-                case 16:
-                    pass  # DLE
-                case 17:
-                    pass  # DC1 (XON)
-                case 18:
-                    pass  # DC2
-                case 19:
-                    pass  # DC3 (XOFF)
-                case 20:
-                    pass  # DC4
-                case 21 | 22 | 23 | 24 | 25 | 26:
-                    # NAK | SYN | ETB | CAN | EM | SUB
-                    pass
-                case 27:
-                    # ESC
-                    pass
-                case 28 | 29 | 30 | 31:
-                    # IS4 | IS3 | IS2 | IS1
-                    # FS | GS | RS | US
-                    pass
+            action = self.c0_table.get(code)
+            if action is not None:
+                action()
         elif code < 0x80:
             # ASCII character
             self.put_one_char(chr(code))
@@ -177,7 +720,86 @@ class TtyModel:
                     self.utf8_error()
                 self.state = TtyState.NORMAL
 
+    def write_esc(self, code: int):
+        if code < 32:
+            # control codes still work in the middle of an escape sequence
+            action = self.c0_table.get(code)
+            if action is not None:
+                action()
+            return
+        self.state = TtyState.NORMAL
+        action = self.esc_table.get(code)
+        if action is not None:
+            action()
+
+    def write_csi(self, code: int):
+        if 0x30 <= code <= 0x3F:
+            # parameter bytes: digits, separators and private markers
+            self.csi_params.append(code)
+        elif 0x20 <= code <= 0x2F:
+            self.csi_intermediates.append(code)
+        elif 0x40 <= code <= 0x7E:
+            self.state = TtyState.NORMAL
+            self.dispatch_csi(code)
+        elif code < 32:
+            action = self.c0_table.get(code)
+            if action is not None:
+                action()
+        # anything else (DEL, stray high bytes) is ignored
+
+    def dispatch_csi(self, final: int):
+        """Run the handler for a complete control sequence"""
+        if self.csi_intermediates:
+            # none of the sequences we understand have intermediates
+            return
+        raw = self.csi_params.decode("ascii")
+        marker = raw[:1] if raw[:1] in ("?", "<", "=", ">") else ""
+        raw = raw[len(marker):]
+        try:
+            # colons separate sub-parameters (e.g. 38:5:n); treat them like semicolons
+            params = [int(p) if p else 0 for p in raw.replace(':', ';').split(';')] if raw else []
+        except ValueError:
+            return
+        if marker:
+            if marker == "?" and final in (ord('h'), ord('l')):
+                self.set_private_mode(params, final == ord('h'))
+            return
+        action = self.csi_table.get(final)
+        if action is not None:
+            action(params)
+
+    def write_osc(self, code: int):
+        # OSC ends with BEL or ST (ESC \); the ESC is enough for us to leave this state
+        if code in (0x07, 0x18, 0x1A):
+            self.state = TtyState.NORMAL
+        elif code == 0x1B:
+            self.escape()
+
+    def write_charset(self, code: int):
+        self.state = TtyState.NORMAL
+
     def write(self, chars: bytes):
         """Write a sequence of characters"""
-        for code in chars:
-            self.write_one_char(code)
\ No newline at end of file
+        pos = 0
+        end = len(chars)
+        while pos < end:
+            if self.state == TtyState.NORMAL:
+                # fast path: copy printable runs straight into the plane
+                run = PRINTABLE_RUN.match(chars, pos)
+                if run:
+                    data = run.group()
+                    try:
+                        text = data.decode()
+                    except UnicodeDecodeError as exc:
+                        # overlong or out of range sequence; the state machine handles it from the bad byte on
+                        text = data[:exc.start].decode()
+                        run_length = exc.start
+                    else:
+                        run_length = len(data)
+                    self.put_run(text)
+                    pos += run_length
+                    if pos >= end:
+                        break
+            # slow path: control codes, escape sequences, and split or broken UTF-8
+            self.write_one_char(chars[pos])
+            pos += 1
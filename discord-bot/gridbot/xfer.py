@@ -1,7 +1,9 @@
-import datetime
-import io
+import asyncio
+import collections
+import hashlib
 import logging
-import secrets
+import shlex
+import time
 
 import discord
 import discord.ext.commands as commands
@@ -10,40 +12,68 @@ import aiohttp
 
 from .grid_cmd import GridMiiCogBase
 from .config import Config
-
-try:
-    import oci
-except ModuleNotFoundError:
-    oci = None
-
-oci_config = dict()
-RELAY_BUCKET = "relay_bucket"
-
-def oci_setup() -> bool:
-    """Load OCI config and check whether OCI is set up correctly"""
-    if oci is None or Config.OCI_CONFIG_FILE is None:
-        return False
-    cfg = oci.config.from_file(Config.OCI_CONFIG_FILE)
-    oci.config.validate_config(cfg)
-    if RELAY_BUCKET not in cfg:
-        logging.warning("please specify `relay_bucket` in the OCI config")
-        return False
-    oci_config.update(cfg)
-    return True
+from .object_store import ObjectStoreError, PreauthenticatedRequest
+from .relay import RelayBackend, RelayError, make_relay
 
 class FileTransferCog(GridMiiCogBase):
+    # Every file is fetched at once. Each node keeps a cache of uploaded files named by their SHA-256, so a file that
+    # was uploaded to the node before is copied out of the cache instead of being fetched again.
+    # The bot only hashes a file if one of its size was uploaded lately; otherwise the hash is left empty, and the
+    # node fetches the file and caches it under the hash it works out itself.
     UPLOAD_SCRIPT = """
-    if command -v curl > /dev/null
+    if ! command -v curl > /dev/null
     then
-      echo Downloading:
-      echo '{0}'
-      curl -OsS '{0}'
+      echo Please install curl, then download these urls:
+{urls}
+      exit 1
+    fi
+    cache="${{XDG_CACHE_HOME:-$HOME/.cache}}/gridmii/uploads"
+    if [ {cache_days} -gt 0 ] && mkdir -p "$cache" 2> /dev/null
+    then
+      # forget files that haven't been uploaded in a while
+      find "$cache" -type f -mtime +{cache_days} -exec rm -f {{}} \\;
     else
-      echo Please install curl, then download this url:
-      echo '{0}'
+      cache=
     fi
+    fetch() {{
+      url=$1 name=$2 hash=$3
+      if [ -n "$cache" ] && [ -n "$hash" ] && [ -f "$cache/$hash" ]
+      then
+        touch "$cache/$hash"
+        cp "$cache/$hash" "$name" && echo "$name (cached)" && return 0
+      fi
+      curl -fsS -o "$name" "$url" || return 1
+      echo "$name"
+      if [ -n "$cache" ] && command -v sha256sum > /dev/null && [ $(wc -c < "$name") -le {cache_max} ]
+      then
+        sum=$(sha256sum < "$name" | cut -d ' ' -f 1)
+        if [ -z "$hash" ] || [ "$sum" = "$hash" ]
+        then
+          cp "$name" "$cache/$sum.part" && mv "$cache/$sum.part" "$cache/$sum"
+        fi
+      fi
+    }}
+    echo Downloading:
+    pids=
+{fetches}
+    status=0
+    for pid in $pids
+    do
+      wait "$pid" || status=1
+    done
+    exit $status
     """
 
+    @classmethod
+    def upload_script(cls, attachments: list[discord.Attachment], hashes: list[str|None]) -> str:
+        urls = [shlex.quote(attachment.url) for attachment in attachments]
+        fetches = (f"    fetch {url} {shlex.quote(attachment.filename)} {shlex.quote(file_hash or '')} "
+                   f"& pids=\"$pids $!\""
+                   for url, attachment, file_hash in zip(urls, attachments, hashes))
+        return cls.UPLOAD_SCRIPT.format(urls="\n".join(f"      echo {url}" for url in urls),
+                                        fetches="\n".join(fetches), cache_days=int(Config.UPLOAD_CACHE_DAYS),
+                                        cache_max=int(Config.UPLOAD_CACHE_MAX_BYTES))
+
     DOWNLOAD_SCRIPT = """
     f='{0}'
     if ! command -v curl > /dev/null
@@ -51,118 +81,157 @@ class FileTransferCog(GridMiiCogBase):
       echo Please install curl
       exit 1
     else
-      if [ $(du -k "$f" | cut -f 1) -gt 8192 ]
+      if [ $(wc -c < "$f") -gt {2} ]
       then
         echo File too large
         exit 2
       else
         echo Uploading:
         echo "$f"
-        curl -sS -T "$f" '{1}'
+        curl -fsS -T "$f" '{1}'
       fi
     fi
     """
 
+    # how many file sizes to remember for the upload cache
+    UPLOAD_RECORD_LIMIT = 10_000
+
     def __init__(self, bot):
         super().__init__(bot)
-        self.oci_ok = False
-        self.object_storage: oci.object_storage.ObjectStorageClient|None = None
-        self.object_namespace = None
-        self.bucket: oci.object_storage.models.Bucket|None = None
+        self.relay: RelayBackend|None = None
+        self._session: aiohttp.ClientSession|None = None
+        # size of a recently uploaded file -> when it was last uploaded
+        self._uploaded_sizes: collections.OrderedDict[int, float] = collections.OrderedDict()
 
     async def cog_load(self) -> None:
-        # TODO: split this into an OracleCloudCog
         try:
-            self.oci_ok = oci_setup()
-        except oci.exceptions.ClientError:
-            logging.exception("failed to load OCI config")
-            self.oci_ok = False
-        if not self.oci_ok:
-            logging.warning("OCI not set up; file download not available")
-        else:
-            try:
-                logging.info("Contacting OCI...")
-                self.object_storage = oci.object_storage.ObjectStorageClient(oci_config)
-                self.object_namespace = self.object_storage.get_namespace().data
-            except (oci.exceptions.ClientError, oci.exceptions.ServiceError):
-                logging.exception("OCI threw exception during cog setup")
-                self.oci_ok = False
-            # While we're here, let's make sure the OCI bucket actually exists
-            bucket_name = oci_config[RELAY_BUCKET]
-            try:
-                bucket_resp = self.object_storage.get_bucket(self.object_namespace, bucket_name)
-                self.bucket = bucket_resp.data
-                logging.info(f"Using OCI object bucket {bucket_name} as the file relay")
-            except oci.exceptions.ServiceError as se:
-                logging.exception(f"{se.code}: {se.message}")
-                self.oci_ok = False
-
-    def make_par(self, object_name: str):
-        now = datetime.datetime.now(datetime.timezone.utc)
-        expiration_delta = datetime.timedelta(days=1)
-        expiration = now + expiration_delta
-        par_params = oci.object_storage.models.CreatePreauthenticatedRequestDetails(
-            name="par_" + object_name,
-            object_name = object_name,
-            access_type="ObjectReadWrite",
-            time_expires=expiration
-        )
-        par = self.object_storage.create_preauthenticated_request(
-            self.bucket.namespace, self.bucket.name, par_params).data
-        return par
-
-    async def download_and_attach(self, ctx: Context, url: str, file_name: str):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status != 200:
-                    logging.error("HTTP problem", response)
-                    await ctx.reply(f":x: Couldn't download the file from the relay: HTTP {response.status}")
-                    return
-
-                body = io.BytesIO()
-                try:
-                    body.write(await response.read())
-                    body.seek(0)
-                    attachment = discord.File(body, file_name)
-                    await ctx.reply(file=attachment)
-                except aiohttp.ClientError as exc:
-                    logging.exception(f"Failed download for file {file_name}")
-                    await ctx.reply(f":x: Couldn't download the file from the relay: {exc}")
-                finally:
-                    body.close()
+            relay = make_relay()
+        except (ObjectStoreError, ValueError):
+            logging.exception("failed to set up the file relay")
+            relay = None
+        if relay is None:
+            logging.warning("file relay not set up; file download not available")
+            return
+        try:
+            logging.info("Starting the file relay...")
+            await relay.start()
+        except (ObjectStoreError, OSError):
+            logging.exception("file relay failed to start")
+            await relay.close()
+            return
+        self.relay = relay
+
+    async def cog_unload(self) -> None:
+        if self.relay is not None:
+            await self.relay.close()
+            self.relay = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """HTTP session for reading attachments from Discord's CDN, created on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=Config.DOWNLOAD_TIMEOUT_SEC))
+        return self._session
+
+    def may_be_cached(self, attachment: discord.Attachment) -> bool:
+        """False if no node can have this attachment cached, because no file of its size was uploaded lately"""
+        uploaded = self._uploaded_sizes.get(attachment.size)
+        return uploaded is not None and time.time() - uploaded < Config.UPLOAD_CACHE_DAYS * 24 * 60 * 60
+
+    def record_upload(self, attachment: discord.Attachment):
+        self._uploaded_sizes[attachment.size] = time.time()
+        self._uploaded_sizes.move_to_end(attachment.size)
+        while len(self._uploaded_sizes) > self.UPLOAD_RECORD_LIMIT:
+            self._uploaded_sizes.popitem(last=False)
+
+    async def hash_attachment(self, attachment: discord.Attachment) -> str|None:
+        """SHA-256 of an attachment, streamed from Discord. None if it couldn't be read.
+        On a cache miss the node fetches the file again, so files over the cache's size cap aren't hashed at all."""
+        cap = Config.UPLOAD_CACHE_MAX_BYTES
+        if attachment.size > cap:
+            return None
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with self.session.get(attachment.url) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > cap:
+                        return None
+                    digest.update(chunk)
+        except (aiohttp.ClientError, TimeoutError) as exc:
+            logging.warning(f"couldn't hash attachment {attachment.filename}: {exc}")
+            return None
+        return digest.hexdigest()
+
+    async def download_and_attach(self, ctx: Context, par: PreauthenticatedRequest, file_name: str):
+        if self.relay is None:
+            await ctx.reply(":x: The file relay went away before your file could be fetched")
+            return
+        try:
+            body = await self.relay.fetch(par)
+        except RelayError as exc:
+            logging.warning(f"Failed download for file {file_name}: {exc}")
+            await ctx.reply(f":x: Couldn't download the file from the relay: {exc}")
+            return
+        attachment = discord.File(body, file_name)
+        try:
+            await ctx.reply(file=attachment)
+        finally:
+            # discord.File stubs out close() on files it doesn't own, so give it back before closing
+            attachment.close()
+            body.close()
 
     @commands.command()
     async def upload(self, ctx: Context):
-        """Upload the attached file to your current node."""
+        """Upload the attached files to your current node."""
         attachments = ctx.message.attachments
         if not attachments:
             await ctx.reply(":x: You need to attach one or more files")
             return
-        elif len(attachments) > 1:
-            await ctx.reply(":x: Currently only one file at a time can be uploaded")
-
-        attachment, = attachments
 
-        script = self.UPLOAD_SCRIPT.format(attachment.url)
+        hashes: list[str|None] = [None] * len(attachments)
+        if Config.UPLOAD_CACHE_DAYS > 0:
+            # reading a file from Discord only pays off if a node might have it cached
+            maybe_cached = [i for i, attachment in enumerate(attachments) if self.may_be_cached(attachment)]
+            found = await asyncio.gather(*(self.hash_attachment(attachments[i]) for i in maybe_cached))
+            for i, file_hash in zip(maybe_cached, found):
+                hashes[i] = file_hash
+            for attachment in attachments:
+                self.record_upload(attachment)
+        script = self.upload_script(attachments, hashes)
         await self.bot.submit_job(ctx, script)
 
     @commands.command()
     async def download(self, ctx: Context, file: str):
         """Download the given file from your current node"""
-        if not self.oci_ok:
+        if self.relay is None:
             await ctx.reply(":x: File downloads are not currently available")
             return
 
         logging.info(f"Downloading file {file}")
-        relay_object_name = secrets.token_urlsafe()
-        par = self.make_par(relay_object_name)
-        par_url =  par.full_path
+        try:
+            par = await self.relay.upload_url()
+        except ObjectStoreError:
+            logging.exception("couldn't create a relay URL")
+            await ctx.reply(":x: Couldn't set up the file relay. Please try again later.")
+            return
+        par_url = par.url
         logging.info(f"Access URL for relay upload: {par_url}")
 
         # pass the URI to the client, then make a callback
-        script = self.DOWNLOAD_SCRIPT.format(file, par_url)
+        # the node checks the same cap the bot enforces, so it doesn't upload a file the bot would refuse
+        script = self.DOWNLOAD_SCRIPT.format(file, par_url, int(Config.DOWNLOAD_CAP_BYTES))
+        relay = self.relay
         async def download_ready(_, status_code):
-            if status_code == 0:
-                await self.download_and_attach(ctx, par_url, file)
+            try:
+                if status_code == 0:
+                    await self.download_and_attach(ctx, par, file)
+            finally:
+                await relay.delete(par)
 
         await self.bot.submit_job(ctx, script, callback=download_ready)
\ No newline at end of file